@@ -0,0 +1,210 @@
+# -*- coding: utf-8 -*-
+# Copyright 2020 Immfly.com. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"). You
+# may not use this file except in compliance with the License. A copy of
+# the License is located at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# or in the "license" file accompanying this file. This file is
+# distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF
+# ANY KIND, either express or implied. See the License for the specific
+# language governing permissions and limitations under the License.
+"""Fake S3 endpoint for benchmarks.
+
+Serves HEAD and ranged GET requests of synthetic objects from a local HTTP server,
+with a configurable latency per request and bandwidth per connection. Object bodies
+are generated from their offsets, so serving large objects takes no memory.
+"""
+from __future__ import absolute_import
+
+import re
+import threading
+import time
+
+from six.moves import BaseHTTPServer, socketserver
+
+__all__ = ["FakeS3Server"]
+
+# Object bodies repeat this block
+BLOCK = bytes(bytearray(range(256))) * 4096
+# Bytes written to the socket at once
+WRITE_SIZE = 64 * 1024
+RANGE_RE = re.compile(r"^bytes=(\d+)-(\d*)$")
+
+
+def object_bytes(start, end):
+    """Bytes of every object from start to end, both included."""
+    offset = start % len(BLOCK)
+    length = end - start + 1
+    data = BLOCK[offset:offset + length]
+    while len(data) < length:
+        data += BLOCK[:length - len(data)]
+    return data
+
+
+class _Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args):  # pylint: disable=arguments-differ
+        pass
+
+    def _object(self):
+        # Path style requests: /bucket/key
+        key = self.path.split("?", 1)[0].lstrip("/").split("/", 1)[-1]
+        return key, self.server.objects.get(key)
+
+    def _send_error(self, status, code):
+        body = ("<?xml version=\"1.0\" encoding=\"UTF-8\"?>\n"
+                "<Error><Code>{}</Code><Message>{}</Message></Error>").format(
+                    code, code).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/xml")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        if self.command != "HEAD":
+            self.wfile.write(body)
+
+    def _send_headers(self, status, key, size, length):
+        self.send_response(status)
+        self.send_header("Content-Length", str(length))
+        self.send_header("Accept-Ranges", "bytes")
+        self.send_header("ETag", self.server.etag(key, size))
+        self.send_header("Content-Type", "application/octet-stream")
+        if status == 206:
+            start, end = self._range
+            self.send_header("Content-Range", "bytes {}-{}/{}".format(start, end, size))
+        self.end_headers()
+
+    def _start(self):
+        self.server.count(self.command)
+        if self.server.latency:
+            time.sleep(self.server.latency)
+        key, size = self._object()
+        if size is None:
+            self._send_error(404, "NoSuchKey")
+            return None, None
+        if_match = self.headers.get("If-Match")
+        if if_match and if_match != self.server.etag(key, size):
+            self._send_error(412, "PreconditionFailed")
+            return None, None
+        return key, size
+
+    def do_HEAD(self):  # pylint: disable=invalid-name
+        """Object size and ETag."""
+        key, size = self._start()
+        if key is not None:
+            self._send_headers(200, key, size, size)
+
+    def do_GET(self):  # pylint: disable=invalid-name
+        """Object bytes of the requested range, at the bandwidth of the server."""
+        key, size = self._start()
+        if key is None:
+            return
+        start, end = 0, size - 1
+        match = RANGE_RE.match(self.headers.get("Range", ""))
+        if match:
+            start = int(match.group(1))
+            end = min(int(match.group(2)), end) if match.group(2) else end
+            if start >= size:
+                self._send_error(416, "InvalidRange")
+                return
+        self._range = (start, end)  # pylint: disable=attribute-defined-outside-init
+        self._send_headers(206 if match else 200, key, size, end - start + 1)
+
+        started = time.time()
+        sent = 0
+        bandwidth = self.server.bandwidth
+        while start + sent <= end:
+            chunk = object_bytes(start + sent, min(end, start + sent + WRITE_SIZE - 1))
+            self.wfile.write(chunk)
+            sent += len(chunk)
+            if bandwidth:
+                delay = started + float(sent) / bandwidth - time.time()
+                if delay > 0:
+                    time.sleep(delay)
+        self.server.add_bytes(sent)
+
+
+class _Server(socketserver.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+
+    def __init__(self, objects, latency, bandwidth):
+        BaseHTTPServer.HTTPServer.__init__(self, ("127.0.0.1", 0), _Handler)
+        self.objects = objects
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.requests = {}
+        self.bytes_sent = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def etag(key, size):
+        """ETag of an object."""
+        return '"{}-{}"'.format(re.sub(r"\W", "", key), size)
+
+    def count(self, method):
+        """Count a request."""
+        with self._lock:
+            self.requests[method] = self.requests.get(method, 0) + 1
+
+    def add_bytes(self, sent):
+        """Count bytes sent."""
+        with self._lock:
+            self.bytes_sent += sent
+
+
+class FakeS3Server:
+    """Local HTTP server answering S3 HEAD and GET requests.
+
+    Object sizes are given by key; every bucket holds the same objects. Use the
+    endpoint_url with path style addressing in boto3.
+    """
+
+    def __init__(self, objects, latency=0, bandwidth=None):
+        """Class initializator.
+
+        :param objects: object sizes in bytes by key.
+        :param latency: seconds to wait before answering every request, defaults to 0.
+        :param bandwidth: bytes per second of every connection, defaults to no limit.
+        """
+        self._server = _Server(dict(objects), latency, bandwidth)
+        self._thread = None
+
+    @property
+    def endpoint_url(self):
+        """URL of the server."""
+        return "http://{}:{}".format(*self._server.server_address)
+
+    def set_objects(self, objects):
+        """Replace the object sizes by key."""
+        self._server.objects = dict(objects)
+
+    def stats(self):
+        """Requests by method and bytes sent since the last reset."""
+        return {"requests": dict(self._server.requests),
+                "bytes_sent": self._server.bytes_sent}
+
+    def reset_stats(self):
+        """Reset request and byte counters."""
+        self._server.requests = {}
+        self._server.bytes_sent = 0
+
+    def start(self):
+        """Serve requests from a background thread."""
+        self._thread = threading.Thread(target=self._server.serve_forever)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        """Stop serving requests."""
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *args):
+        self.stop()
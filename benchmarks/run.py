@@ -0,0 +1,191 @@
+# -*- coding: utf-8 -*-
+# Copyright 2020 Immfly.com. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"). You
+# may not use this file except in compliance with the License. A copy of
+# the License is located at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# or in the "license" file accompanying this file. This file is
+# distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF
+# ANY KIND, either express or implied. See the License for the specific
+# language governing permissions and limitations under the License.
+"""Benchmarks of S3Resumable against a local fake S3 endpoint.
+
+Downloads synthetic objects from FakeS3Server for every combination of object size,
+part size and concurrency, and saves throughput, request counts, peak RSS and disk
+bytes written of every run as JSON. Every run happens in its own process, so peak
+RSS is not inherited from the previous ones.
+
+    python benchmarks/run.py --object-sizes 100M,1G --part-sizes 8,auto \\
+        --concurrency 1,8 --latency 0.02 --bandwidth 50M --output results.json
+"""
+from __future__ import absolute_import, print_function
+
+import argparse
+import itertools
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import shutil
+import sys
+import tempfile
+import time
+
+import boto3
+from botocore.config import Config
+
+from fake_s3 import FakeS3Server
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+from s3resumable import S3Resumable  # noqa: E402 pylint: disable=wrong-import-position
+
+UNITS = {"K": 1000, "M": 1000000, "G": 1000000000}
+
+
+def size_type(value):
+    """Size in bytes with an optional K, M or G suffix."""
+    multiplier = UNITS.get(value[-1:].upper())
+    if multiplier is not None:
+        value = value[:-1]
+    return int(float(value) * (multiplier or 1))
+
+
+def list_type(item_type):
+    """Comma separated list of item_type."""
+    return lambda value: [item_type(item) for item in value.split(",")]
+
+
+def part_size_type(value):
+    """Part size in MB or auto."""
+    return value if value == "auto" else int(value)
+
+
+def _proc_io():
+    # Linux only: bytes written by write calls and bytes sent to the block layer
+    try:
+        with open("/proc/self/io") as proc_io:
+            counters = dict(line.split(": ") for line in proc_io.read().splitlines())
+        return int(counters["wchar"]), int(counters["write_bytes"])
+    except (IOError, OSError, KeyError, ValueError):
+        return None, None
+
+
+def _max_rss():
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Kilobytes on Linux, bytes on macOS
+    return max_rss if sys.platform == "darwin" else max_rss * 1024
+
+
+def _run_case(endpoint_url, case, download_dir, queue):
+    client = boto3.client("s3", endpoint_url=endpoint_url, region_name="us-east-1",
+                          aws_access_key_id="benchmark", aws_secret_access_key="benchmark",
+                          config=Config(s3={"addressing_style": "path"},
+                                        max_pool_connections=max(10, case["concurrency"])))
+    s3resumable = S3Resumable(client, part_size_megabytes=case["part_size_megabytes"],
+                              max_concurrency=case["concurrency"],
+                              single_file=case["single_file"])
+    baseline_rss = _max_rss()
+    wchar, write_bytes = _proc_io()
+    started = time.time()
+    s3resumable.download_file("benchmark", case["key"], download_dir)
+    seconds = time.time() - started
+    end_wchar, end_write_bytes = _proc_io()
+    queue.put({"seconds": seconds,
+               "baseline_rss_bytes": baseline_rss,
+               "peak_rss_bytes": _max_rss(),
+               "write_call_bytes": end_wchar - wchar if wchar is not None else None,
+               "disk_bytes_written": (end_write_bytes - write_bytes
+                                      if write_bytes is not None else None)})
+
+
+def run_case(server, case, work_dir):
+    """Download an object in a new process and return the measures of the run."""
+    download_dir = tempfile.mkdtemp(dir=work_dir)
+    queue = multiprocessing.Queue()
+    server.reset_stats()
+    process = multiprocessing.Process(target=_run_case,
+                                      args=(server.endpoint_url, case, download_dir, queue))
+    try:
+        process.start()
+        process.join()
+        if process.exitcode != 0:
+            raise RuntimeError("benchmark run failed: {}".format(case))
+        result = dict(case)
+        result.update(queue.get())
+    finally:
+        shutil.rmtree(download_dir)
+    stats = server.stats()
+    result.update({"requests": stats["requests"],
+                   "bytes_received": stats["bytes_sent"],
+                   "throughput_bytes_per_second": case["object_size"] / result["seconds"]})
+    return result
+
+
+def parse_args(argv=None):
+    """Arguments of the benchmark."""
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--object-sizes", type=list_type(size_type), default=[100000000],
+                        help="object sizes, with an optional K, M or G suffix")
+    parser.add_argument("--part-sizes", type=list_type(part_size_type), default=[15],
+                        help="part sizes in MB or auto")
+    parser.add_argument("--concurrency", type=list_type(int), default=[1, 4],
+                        help="numbers of parts downloaded at the same time")
+    parser.add_argument("--single-file", action="store_true",
+                        help="also run every case writing parts into a single file")
+    parser.add_argument("--latency", type=float, default=0.0,
+                        help="seconds before the server answers every request")
+    parser.add_argument("--bandwidth", type=size_type, default=None,
+                        help="bytes per second of every connection, with an optional "
+                             "K, M or G suffix")
+    parser.add_argument("--repeat", type=int, default=1, help="runs of every case")
+    parser.add_argument("--dir", dest="work_dir", default=None,
+                        help="directory of downloaded files, defaults to a temporary one")
+    parser.add_argument("--output", default=None,
+                        help="JSON file of the results, defaults to the standard output")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    """Run the benchmark."""
+    args = parse_args(argv)
+    objects = dict(("object-{}".format(size), size) for size in args.object_sizes)
+    layouts = [False, True] if args.single_file else [False]
+    results = []
+    with FakeS3Server(objects, latency=args.latency, bandwidth=args.bandwidth) as server:
+        for object_size, part_size, concurrency, single_file, _ in itertools.product(
+                args.object_sizes, args.part_sizes, args.concurrency, layouts,
+                range(args.repeat)):
+            case = {"key": "object-{}".format(object_size),
+                    "object_size": object_size,
+                    "part_size_megabytes": part_size,
+                    "concurrency": concurrency,
+                    "single_file": single_file}
+            result = run_case(server, case, args.work_dir)
+            print("{object_size:>12} bytes  part {part_size_megabytes:>4}  "
+                  "concurrency {concurrency:>3}  single file {single_file!s:>5}  "
+                  "{throughput:8.1f} MB/s  {count:>5} requests  {rss:6.1f} MB RSS".format(
+                      throughput=result["throughput_bytes_per_second"] / 1000000,
+                      count=sum(result["requests"].values()),
+                      rss=result["peak_rss_bytes"] / 1000000.0, **case),
+                  file=sys.stderr)
+            results.append(result)
+
+    report = {"environment": {"python": platform.python_version(),
+                              "platform": platform.platform(),
+                              "cpu_count": multiprocessing.cpu_count()},
+              "server": {"latency": args.latency, "bandwidth": args.bandwidth},
+              "results": results}
+    if args.output:
+        with open(args.output, "w") as output:
+            json.dump(report, output, indent=2, sort_keys=True)
+    else:
+        json.dump(report, sys.stdout, indent=2, sort_keys=True)
+        print()
+
+
+if __name__ == "__main__":
+    main()
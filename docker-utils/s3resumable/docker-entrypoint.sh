@@ -12,6 +12,10 @@ launch_qa() {
   pipenv run coverage report -m 
 }
 
+launch_bench() {
+  pipenv run python benchmarks/run.py ${@}
+}
+
 case $1 in
   "s3resumable")
     shift
@@ -19,6 +23,10 @@ case $1 in
     ;;
   "qa")
     launch_qa ;;
+  "bench")
+    shift
+    launch_bench "${@}"
+    ;;
   *)
     exec "${@}" ;;
 esac
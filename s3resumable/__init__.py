@@ -19,11 +19,29 @@ the configured size.
 """
 from __future__ import absolute_import
 
-from .exceptions import (S3ResumableBloqued, S3ResumableDownloadError, S3ResumableError,
-                         S3ResumableIncompatible)
+import sys
+
+from .bandwidth import BandwidthLimiter
+from .cache import ContentCache
+from .exceptions import (S3ResumableBloqued, S3ResumableChanged, S3ResumableChecksumMismatch,
+                         S3ResumableDownloadError, S3ResumableError, S3ResumableIncompatible,
+                         S3ResumableExtractError, S3ResumableNoSpace, S3ResumableTruncated)
+from .index import SyncIndex
+from .metadata import MetadataCache
 from .observer import S3ResumableObserver
+from .metrics import MetricsObserver
+from .partsize import AutoPartSize
+from .retry import RetryPolicy
 from .s3resumable import S3Resumable
 
 __all__ = ["S3Resumable", "S3ResumableObserver", "S3ResumableError",
            "S3ResumableIncompatible", "S3ResumableBloqued",
-           "S3ResumableDownloadError"]
+           "S3ResumableDownloadError", "S3ResumableChanged", "AutoPartSize",
+           "BandwidthLimiter", "RetryPolicy", "S3ResumableTruncated",
+           "S3ResumableChecksumMismatch", "MetricsObserver", "SyncIndex",
+           "ContentCache", "MetadataCache", "S3ResumableNoSpace",
+           "S3ResumableExtractError"]
+
+if sys.version_info >= (3, 5):
+    from .aio import AsyncS3Resumable  # noqa: F401
+    __all__.append("AsyncS3Resumable")
@@ -0,0 +1,534 @@
+# -*- coding: utf-8 -*-
+# Copyright 2020 Immfly.com. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"). You
+# may not use this file except in compliance with the License. A copy of
+# the License is located at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# or in the "license" file accompanying this file. This file is
+# distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF
+# ANY KIND, either express or implied. See the License for the specific
+# language governing permissions and limitations under the License.
+"""Download S3 in parts.
+
+This modules provides an asyncio version of the S3Resumable helper class. It uses
+the same part layout, manifest and lock files, so a download started by one of
+them can be resumed by the other.
+"""
+import asyncio
+import heapq
+import inspect
+import itertools
+import logging
+import os
+
+import filelock
+
+from .coalesce import SharedLock
+from .core import DownloadCore, Transport, advance, is_flow, notification_download, timer
+from .dispatcher import NotificationQueue
+from .exceptions import S3ResumableBloqued
+from .observer import S3ResumableObserver
+from .options import DownloadOptions
+from .prefix import collect_results, download_listed
+from .stream import (finish_stream, lock_stream, parts_ahead, prepare_stream, read_part,
+                     release_stream, stream_arguments)
+from .utils import get_filelock_path
+
+__all__ = ["AsyncS3Resumable"]
+
+# Seconds between attempts to take the lock of a file
+LOCK_POLL_INTERVAL = 0.1
+# Seconds to wait for the lock of a file
+LOCK_TIMEOUT = 10
+
+LOGGER = logging.getLogger(__name__)
+
+# Downloads in flight in the process, by loop and target, shared by coalescing instances
+IN_FLIGHT = {}
+
+
+class _PrioritySlots:
+    """Semaphore handing free slots to the waiter with the lowest priority first."""
+
+    def __init__(self, slots):
+        self._slots = slots
+        self._waiters = []
+        self._sequence = itertools.count()
+
+    async def acquire(self, priority):
+        """Wait for a free slot."""
+        if self._slots > 0 and not self._waiters:
+            self._slots -= 1
+            return
+        waiter = asyncio.get_event_loop().create_future()
+        heapq.heappush(self._waiters, (priority, next(self._sequence), waiter))
+        await waiter
+
+    def release(self):
+        """Free a slot, waking up the next waiter."""
+        while self._waiters:
+            _, _, waiter = heapq.heappop(self._waiters)
+            if not waiter.done():
+                waiter.set_result(None)
+                return
+        self._slots += 1
+
+
+class _AsyncDispatcher:
+    """Delivers notifications to observers from a task of the event loop."""
+
+    def __init__(self, notify, max_size, overflow):
+        self._notify = notify
+        self._queue = NotificationQueue(max_size, overflow)
+        self._loop = None
+        self._condition = None
+        self._task = None
+
+    @property
+    def dropped(self):
+        """Notifications dropped or coalesced because the queue was full."""
+        return self._queue.dropped
+
+    def _get_condition(self):
+        # Conditions are bound to the loop, and instances may be used by several loops
+        loop = asyncio.get_event_loop()
+        if self._loop is not loop:
+            self._loop = loop
+            self._condition = asyncio.Condition()
+            self._task = None
+        return self._condition
+
+    async def put(self, download, notification):
+        """Queue a notification of download, applying the overflow policy if the queue is
+        full."""
+        condition = self._get_condition()
+        async with condition:
+            while not self._queue.offer(download, notification):
+                await condition.wait()
+            if self._task is None:
+                self._task = asyncio.ensure_future(self._run(condition))
+            condition.notify_all()
+
+    async def join(self):
+        """Wait until every queued notification is delivered."""
+        condition = self._get_condition()
+        async with condition:
+            while self._task is not None:
+                await condition.wait()
+
+    async def _run(self, condition):
+        while True:
+            async with condition:
+                if not self._queue:
+                    self._task = None
+                    condition.notify_all()
+                    return
+                notification = self._queue.pop()
+                condition.notify_all()
+            try:
+                await self._notify(notification)
+            except Exception:  # pylint: disable=broad-except
+                # Observers can't fail the downloads
+                LOGGER.exception("Failed to notify observers")
+
+
+class AsyncTransport(Transport):
+    """Transport of the flows of AsyncS3Resumable, running them in the event loop.
+
+    Requests are awaited, and blocking calls are made in the executor of the loop.
+    """
+
+    dispatcher_class = _AsyncDispatcher
+
+    def __init__(self, client, options, notify):
+        super(AsyncTransport, self).__init__(client, options, notify)
+        self._arrivals = itertools.count()
+
+    async def run(self, flow):
+        """Run flow, returning its result."""
+        if not is_flow(flow):
+            # Awaitables, or results computed already
+            return await flow if inspect.isawaitable(flow) else flow
+        try:
+            done, step = advance(flow)
+            while not done:
+                try:
+                    result = await self.run(step)
+                except Exception as exc:  # pylint: disable=broad-except
+                    done, step = advance(flow, error=exc)
+                else:
+                    done, step = advance(flow, result)
+            return step
+        finally:
+            flow.close()
+
+    async def copy_body(self, body, output, hasher=None, metrics=None):
+        """Copy a streaming body to output in chunks, keeping memory usage flat."""
+        bandwidth_limiter = self._options.bandwidth_limiter
+        written = 0
+        while True:
+            chunk = await body.read(self._options.chunk_size_bytes)
+            if not chunk:
+                break
+            if metrics is not None and "first_byte" not in metrics:
+                metrics["first_byte"] = timer()
+            if bandwidth_limiter is not None:
+                await asyncio.sleep(bandwidth_limiter.reserve(len(chunk)))
+            if hasher is not None:
+                hasher.update(chunk)
+            await self.blocking(output.write, chunk)
+            written += len(chunk)
+        return written
+
+    @staticmethod
+    def sleep(seconds):
+        """Wait without downloading."""
+        return asyncio.sleep(seconds)
+
+    @staticmethod
+    def blocking(function, *args):
+        """Awaitable result of a call blocking on the filesystem, made in the executor."""
+        return asyncio.get_event_loop().run_in_executor(None, function, *args)
+
+    async def publish(self, file_info, update, extra=None):
+        """Update file_info and notify observers of a snapshot of it, with extra fields."""
+        file_info.update(update)
+        snapshot = dict(file_info, **(extra or {}))
+        if self._dispatcher is None:
+            await self._notify(snapshot)
+        else:
+            await self._dispatcher.put(notification_download(snapshot), snapshot)
+
+    async def join_notifications(self):
+        """Wait until every notification is delivered."""
+        if self._dispatcher is not None:
+            await self._dispatcher.join()
+
+    async def fetch_parts(self, file_info, download_part, _resize_parts):
+        """Run the flows made by download_part for every part of file_info.
+
+        Every part is started at once as a task waiting for a slot, so parts are not
+        resized.
+        """
+        slots = file_info.get("scheduler")
+        if slots is None:
+            slots = _PrioritySlots(self._options.max_concurrency)
+        arrival = next(self._arrivals)
+
+        async def fetch_part(part):
+            # Same ordering as PartScheduler: parts of the objects in flight interleave
+            await slots.acquire((arrival + part, arrival))
+            try:
+                await self.run(download_part(part))
+            finally:
+                slots.release()
+
+        tasks = [asyncio.ensure_future(fetch_part(part))
+                 for part in range(file_info["total_parts"])]
+        try:
+            await asyncio.gather(*tasks)
+        except BaseException:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            raise
+
+    def lock_timeout(self):
+        """Seconds to wait for the lock of a file."""
+        return LOCK_TIMEOUT if self._options.lock_timeout is None else self._options.lock_timeout
+
+    async def acquire_lock(self, download_file, local_file_path):
+        """Lock a file, avoiding other instances to download it without blocking the loop.
+
+        Coalescing instances wait for the lock in the kernel, from the executor.
+        """
+        filelock_filepath = get_filelock_path(download_file)
+        loop = asyncio.get_event_loop()
+        timeout = self.lock_timeout()
+        if self._options.coalesce:
+            lock = SharedLock(filelock_filepath)
+            try:
+                await loop.run_in_executor(None, lock.acquire, timeout)
+            except filelock.Timeout as exc:
+                raise S3ResumableBloqued(
+                    "Another instance is currently downloading {}".format(local_file_path)
+                ) from exc
+            return lock
+        lock = filelock.FileLock(filelock_filepath)
+        deadline = loop.time() + timeout
+        while True:
+            try:
+                lock.acquire(timeout=0)
+                return lock
+            except filelock.Timeout as exc:
+                if 0 <= timeout and loop.time() >= deadline:
+                    raise S3ResumableBloqued(
+                        "Another instance is currently downloading {}".format(local_file_path)
+                    ) from exc
+                await asyncio.sleep(LOCK_POLL_INTERVAL)
+
+    async def coalesce(self, target, flow, local_file_path):
+        """Run flow, or wait for the result of the flow of target running already.
+
+        Callers joining a flow in flight wait for it at most lock_timeout seconds, then
+        raise S3ResumableBloqued while the flow goes on for the caller that started it.
+        """
+        loop = asyncio.get_event_loop()
+        target = (loop,) + target
+        future = IN_FLIGHT.get(target)
+        if future is not None:
+            flow.close()
+            timeout = self.lock_timeout()
+            try:
+                return await asyncio.wait_for(asyncio.shield(future),
+                                              timeout if timeout >= 0 else None)
+            except asyncio.TimeoutError as exc:
+                raise S3ResumableBloqued(
+                    "Timed out after {} seconds waiting for the download in flight of {}".format(
+                        timeout, local_file_path)) from exc
+        future = IN_FLIGHT[target] = loop.create_future()
+        try:
+            downloaded_file = await self.run(flow)
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except BaseException as error:
+            future.set_exception(error)
+            # Retrieved, so that it is not logged when there are no waiters
+            future.exception()
+            raise
+        finally:
+            del IN_FLIGHT[target]
+        future.set_result(downloaded_file)
+        return downloaded_file
+
+
+class AsyncS3Resumable:
+    """
+    S3 resumable download class helper for asyncio.
+
+    The client is an asynchronous S3 client, like the ones of aiobotocore, or any
+    transport whose head_object, get_object and list_objects_v2 coroutines take the
+    arguments and return the responses of boto3. Bodies must provide a read(amt)
+    coroutine. Observers may implement update as a coroutine.
+    """
+
+    def __init__(self, client, *args, **kwargs):
+        """Class initializator.
+
+        :param client: asynchronous S3 client.
+        :param args: options of S3Resumable, except cooperative downloads. Blocking
+            calls of the downloads, like fsync or preallocation, are made in the default
+            executor of the loop.
+        """
+        options = DownloadOptions(*args, **kwargs)
+        if options.cooperative:
+            raise ValueError('Cooperative downloads are not available for asyncio')
+        self._observers = []
+        self._transport = AsyncTransport(client, options, self.notify_async)
+        self._core = DownloadCore(self._transport, options)
+
+    @property
+    def bandwidth_limiter(self):
+        """BandwidthLimiter of the downloads, None if the bandwidth is not limited."""
+        return self._core.options.bandwidth_limiter
+
+    def attach(self, observer):
+        """Attach observer to notifications."""
+        if not isinstance(observer, S3ResumableObserver):
+            raise TypeError("Invalid type for observer")
+        self._observers.append(observer)
+
+    def detach(self, observer):
+        """Detach observer from notifications."""
+        self._observers.remove(observer)
+
+    async def notify_async(self, file_info):
+        """Notify file info to observers, awaiting the ones implemented as coroutines."""
+        for observer in list(self._observers):
+            result = observer.update(file_info)
+            if asyncio.iscoroutine(result):
+                await result
+
+    async def get_file_info(self, bucket, key):
+        """Get file information from S3 in order to calculate the total number of parts to
+        download.
+
+        :param bucket: S3 Bucket.
+        :param key: S3 Key.
+        :raises S3ResumableIncompatible: Can't download byte range of key.
+        :return: content length and total parts.
+        :rtype: dict
+        """
+        return await self._transport.run(self._core.get_file_info(bucket, key))
+
+    # pylint: disable=too-many-arguments
+    async def download_file(self, bucket, key, download_dir, download_file=None,
+                            temp_dir=None):
+        """Download a file from s3 in parts in order to be able to resume incomplete downloads.
+
+        :param bucket: s3 bucket.
+        :param key: s3 key.
+        :param download_dir: directory to download file.
+        :param download_file: filename for downloaded file, defaults to None.
+        :param temp_dir: directory to download file parts, defaults to None.
+        :return: string with downloaded file path.
+        """
+        self._core.check_arguments(("Bucket", bucket), ("Key", key))
+
+        if not download_file:
+            download_file = os.path.basename(key)
+
+        try:
+            return await self._transport.run(self._core.download_file(
+                bucket, key, download_dir, download_file, temp_dir))
+        finally:
+            await self._transport.join_notifications()
+
+    # pylint: disable=too-many-arguments
+    def stream(self, bucket, key, temp_dir=None, download_file=None, readahead=None):
+        """Generate the bytes of a key in order while its next parts are downloaded, like
+        S3Resumable.stream.
+
+        :param bucket: s3 bucket.
+        :param key: s3 key.
+        :param temp_dir: directory to download file parts, defaults to None.
+        :param download_file: filename the parts are named after, defaults to the
+            basename of key.
+        :param readahead: maximum parts downloaded ahead of the part being read,
+            defaults to twice max_concurrency.
+        :return: asynchronous generator of byte strings, iterated with async for.
+        """
+        download_file, readahead = stream_arguments(self._core, bucket, key, download_file,
+                                                    readahead)
+        return self._stream(bucket, key, temp_dir, download_file, readahead)
+
+    # pylint: disable=too-many-arguments
+    async def _stream(self, bucket, key, temp_dir, download_file, readahead):
+        temp_dir, lock = await self._transport.run(lock_stream(self._core, temp_dir,
+                                                               download_file))
+        local_file_path = os.path.join(temp_dir, download_file)
+        try:
+            file_info = await self._transport.run(prepare_stream(self._core, bucket, key,
+                                                                 local_file_path))
+            parts = self._stream_parts(bucket, key, file_info, readahead,
+                                       keep_parts=lock is not None)
+            try:
+                async for chunk in parts:
+                    yield chunk
+            finally:
+                # Cancel the downloads now when the stream is closed early
+                await parts.aclose()
+            # Parts without digests are read again
+            await self._transport.blocking(finish_stream, self._core, key, local_file_path,
+                                           file_info)
+        finally:
+            await self._transport.join_notifications()
+            release_stream(temp_dir, lock)
+
+    # pylint: disable=too-many-arguments
+    async def _stream_parts(self, bucket, key, file_info, readahead, keep_parts):
+        total_parts = file_info["total_parts"]
+        slots = _PrioritySlots(self._core.options.max_concurrency)
+
+        async def download_part(part):
+            # Parts closer to the one being read first
+            await slots.acquire(part)
+            try:
+                await self._transport.run(self._core.download_part(bucket, key, part,
+                                                                   file_info))
+            finally:
+                slots.release()
+
+        pending = {}
+        try:
+            for part in range(total_parts):
+                for next_part in parts_ahead(part, readahead, total_parts, pending):
+                    pending[next_part] = asyncio.ensure_future(download_part(next_part))
+                await pending.pop(part)
+                async for chunk in self._read_part(part, file_info, keep_parts):
+                    yield chunk
+        finally:
+            for task in pending.values():
+                task.cancel()
+            await asyncio.gather(*pending.values(), return_exceptions=True)
+
+    async def _read_part(self, part, file_info, keep_parts):
+        """Generate the bytes of a downloaded part, read in the executor."""
+        chunks = read_part(self._core, part, file_info, keep_parts)
+        try:
+            while True:
+                chunk = await self._transport.blocking(next, chunks, None)
+                if chunk is None:
+                    return
+                yield chunk
+        finally:
+            chunks.close()
+
+    async def _list_objects(self, bucket, prefix):
+        kwargs = {"Bucket": bucket, "Prefix": prefix}
+        while True:
+            page = await self._transport.client.list_objects_v2(**kwargs)
+            yield page
+            if not page.get("IsTruncated"):
+                return
+            kwargs["ContinuationToken"] = page["NextContinuationToken"]
+
+    # pylint: disable=too-many-arguments
+    async def download_prefix(self, bucket, prefix, download_dir, temp_dir=None, index=None):
+        """Download every key under prefix, keeping the tree of keys below it.
+
+        Keys are listed page by page and downloaded while the listing goes on, using the
+        size and ETag of the listing instead of requesting every key. At most
+        max_concurrency parts of all the keys are downloaded at the same time.
+
+        With an index, keys are synced: the ones whose ETag and size match the index
+        are not requested, and the rest are downloaded again even if their file exists.
+
+        :param bucket: s3 bucket.
+        :param prefix: s3 prefix, an empty string for the whole bucket.
+        :param download_dir: directory to download files.
+        :param temp_dir: directory to download file parts, defaults to None.
+        :param index: SyncIndex of the downloaded keys, defaults to None.
+        :raises S3ResumableDownloadError: some keys could not be downloaded, once the
+            rest of keys are done.
+        :return: dict with the downloaded file path of every key.
+        """
+        self._core.check_arguments(("Bucket", bucket), ("Prefix", prefix))
+
+        max_concurrency = self._core.options.max_concurrency
+        slots = _PrioritySlots(max_concurrency)
+        object_slots = asyncio.Semaphore(max_concurrency * 2)
+        pending = {}
+
+        async def download_key(listed):
+            try:
+                return await self._transport.run(download_listed(
+                    self._core, bucket, listed, prefix, download_dir, temp_dir, slots, index))
+            finally:
+                object_slots.release()
+
+        try:
+            try:
+                async for page in self._list_objects(bucket, prefix):
+                    for listed in page.get('Contents', []):
+                        if listed["Key"].endswith("/"):
+                            continue
+                        await object_slots.acquire()
+                        pending[listed["Key"]] = asyncio.ensure_future(download_key(listed))
+            except BaseException:
+                # No download outlives a failed listing
+                for task in pending.values():
+                    task.cancel()
+                await asyncio.gather(*pending.values(), return_exceptions=True)
+                raise
+
+            results = await asyncio.gather(*pending.values(), return_exceptions=True)
+        finally:
+            await self._transport.join_notifications()
+            if index is not None:
+                index.flush()
+        return collect_results(bucket, dict(zip(pending, results)))
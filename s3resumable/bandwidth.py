@@ -0,0 +1,93 @@
+# -*- coding: utf-8 -*-
+# Copyright 2020 Immfly.com. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"). You
+# may not use this file except in compliance with the License. A copy of
+# the License is located at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# or in the "license" file accompanying this file. This file is
+# distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF
+# ANY KIND, either express or implied. See the License for the specific
+# language governing permissions and limitations under the License.
+"""Download S3 in parts.
+
+This modules provides the bandwidth limiter of S3Resumable.
+"""
+import threading
+import time
+
+__all__ = ["BandwidthLimiter"]
+
+timer = getattr(time, "monotonic", time.time)  # pylint: disable=invalid-name
+
+
+class BandwidthLimiter:
+    """Token bucket limiting the bytes read per second.
+
+    Tokens are refilled at max_bandwidth bytes per second up to burst bytes. Reads
+    take the tokens of the bytes read, going in debt if needed, and wait until the
+    debt is paid back. The same limiter can be shared by several S3Resumable
+    instances and threads, and max_bandwidth can be changed while downloading.
+    """
+
+    def __init__(self, max_bandwidth, burst=None):
+        """Class initializator.
+
+        :param max_bandwidth: maximum bytes per second.
+        :type max_bandwidth: int
+        :param burst: maximum bytes read at once after an idle period, defaults to
+            one second of max_bandwidth.
+        :type burst: int
+        """
+        self._lock = threading.Lock()
+        self._burst = None
+        self._rate = None
+        self.max_bandwidth = max_bandwidth
+        if burst is not None:
+            if int(burst) < 1:
+                raise ValueError('Invalid value for burst')
+            self._burst = int(burst)
+        self._tokens = float(self.burst)
+        self._updated = timer()
+
+    @property
+    def max_bandwidth(self):
+        """Maximum bytes per second."""
+        return self._rate
+
+    @max_bandwidth.setter
+    def max_bandwidth(self, max_bandwidth):
+        if float(max_bandwidth) <= 0:
+            raise ValueError('Invalid value for max_bandwidth')
+        with self._lock:
+            if self._rate is not None:
+                self._refill()
+            self._rate = float(max_bandwidth)
+
+    @property
+    def burst(self):
+        """Maximum bytes read at once after an idle period."""
+        return self._burst if self._burst is not None else max(1, int(self._rate))
+
+    def _refill(self):
+        now = timer()
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self._rate)
+        self._updated = now
+
+    def reserve(self, size):
+        """Take the tokens of size bytes and return the seconds to wait before reading
+        them."""
+        with self._lock:
+            self._refill()
+            self._tokens -= size
+            if self._tokens >= 0:
+                return 0
+            return -self._tokens / self._rate
+
+    def consume(self, size):
+        """Take the tokens of size bytes, waiting until they are available."""
+        delay = self.reserve(size)
+        if delay > 0:
+            time.sleep(delay)
@@ -0,0 +1,145 @@
+# -*- coding: utf-8 -*-
+# Copyright 2020 Immfly.com. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"). You
+# may not use this file except in compliance with the License. A copy of
+# the License is located at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# or in the "license" file accompanying this file. This file is
+# distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF
+# ANY KIND, either express or implied. See the License for the specific
+# language governing permissions and limitations under the License.
+"""Download S3 in parts.
+
+This modules provides the content addressed cache shared by S3Resumable instances
+and processes to download the same content only once.
+"""
+import errno
+import hashlib
+import os
+import time
+
+import filelock
+
+from .utils import create_directory_tree, link_file, remove_if_exists
+
+__all__ = ["ContentCache"]
+
+# Seconds after which temporary files left by interrupted processes are removed
+STALE_TEMP_FILE_AGE = 3600
+
+
+class ContentCache:
+    """Directory of downloaded objects addressed by their ETag and size.
+
+    Entries are added and materialized with hard links, reflinks or copies, in this
+    order of preference, and are always complete: they are written with a temporary
+    name and renamed. Several processes can share the directory.
+
+    The least recently used entries are evicted when the cache grows over max_size.
+    Entries hard linked to downloaded files use no space of their own, but hard
+    linked files must be replaced, never modified in place, or the cache entry
+    changes too; use hardlinks=False for files that are modified.
+    """
+
+    def __init__(self, path, max_size=None, hardlinks=True):
+        """Class initializator.
+
+        :param path: cache directory, shared by the processes using the cache.
+        :param max_size: maximum bytes of the entries, defaults to None for no limit.
+        :param hardlinks: link files to entries with hard links when possible,
+            defaults to True.
+        """
+        if max_size is not None and int(max_size) < 0:
+            raise ValueError('Invalid value for max_size')
+        self._path = path
+        self._max_size = int(max_size) if max_size is not None else None
+        self._hardlinks = hardlinks
+        create_directory_tree(path)
+        self._lock = filelock.FileLock(os.path.join(path, ".lock"))
+
+    @property
+    def path(self):
+        """Cache directory."""
+        return self._path
+
+    def entry_path(self, etag, size):
+        """Path of the entry of the content with etag and size."""
+        digest = hashlib.sha256("{}:{}".format(etag, int(size)).encode("utf-8")).hexdigest()
+        return os.path.join(self._path, digest[:2], digest)
+
+    def get(self, etag, size, dst):
+        """Materialize the entry of the content with etag and size as dst.
+
+        :return: False if the content is not in the cache.
+        """
+        if not etag:
+            return False
+        entry_path = self.entry_path(etag, size)
+        try:
+            stat = os.stat(entry_path)
+            if stat.st_size != int(size):
+                os.remove(entry_path)
+                return False
+            link_file(entry_path, dst, self._hardlinks)
+            # Access time orders the entries for eviction, without touching mtime
+            os.utime(entry_path, (time.time(), stat.st_mtime))
+        except OSError as exc:
+            # Evicted by another process
+            if exc.errno == errno.ENOENT:
+                return False
+            raise
+        return True
+
+    def put(self, etag, size, src):
+        """Add the downloaded file src as the content with etag and size."""
+        if not etag or os.path.getsize(src) != int(size):
+            return
+        entry_path = self.entry_path(etag, size)
+        create_directory_tree(os.path.dirname(entry_path))
+        link_file(src, entry_path, self._hardlinks)
+        os.utime(entry_path, (time.time(), os.path.getmtime(entry_path)))
+        self.evict()
+
+    def evict(self):
+        """Remove the least recently used entries until the cache fits in max_size.
+
+        Only one process evicts at a time, the rest skip it.
+        """
+        if self._max_size is None:
+            return
+        try:
+            with self._lock.acquire(timeout=0):
+                self._evict()
+        except filelock.Timeout:
+            pass
+
+    def _evict(self):
+        entries = []
+        total_size = 0
+        now = time.time()
+        for directory, _, files in os.walk(self._path):
+            for name in files:
+                path = os.path.join(directory, name)
+                try:
+                    stat = os.stat(path)
+                    if name.endswith(".linking"):
+                        if now - stat.st_mtime > STALE_TEMP_FILE_AGE:
+                            os.remove(path)
+                        continue
+                except OSError as exc:
+                    if exc.errno == errno.ENOENT:
+                        continue
+                    raise
+                if directory == self._path:
+                    continue
+                entries.append((stat.st_atime, stat.st_size, path))
+                total_size += stat.st_size
+
+        for _, size, path in sorted(entries):
+            if total_size <= self._max_size:
+                break
+            remove_if_exists(path)
+            total_size -= size
@@ -0,0 +1,265 @@
+# -*- coding: utf-8 -*-
+# Copyright 2020 Immfly.com. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"). You
+# may not use this file except in compliance with the License. A copy of
+# the License is located at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# or in the "license" file accompanying this file. This file is
+# distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF
+# ANY KIND, either express or implied. See the License for the specific
+# language governing permissions and limitations under the License.
+"""Download S3 in parts.
+
+This modules provides the streaming checksums used by S3Resumable to verify parts
+and objects without reading them again.
+"""
+import base64
+import binascii
+import hashlib
+import struct
+import threading
+import zlib
+
+try:
+    from awscrt import checksums as crt_checksums
+except ImportError:
+    crt_checksums = None
+
+try:
+    import crc32c
+except ImportError:
+    crc32c = None
+
+__all__ = ["ObjectHasher", "PartHasher", "available_algorithms", "combine_crc",
+           "head_checksums", "object_checksum"]
+
+# Reflected polynomials and widths of the CRC algorithms supported by S3
+CRC_PARAMETERS = {
+    "crc32": (0xEDB88320, 32),
+    "crc32c": (0x82F63B78, 32),
+    "crc64nvme": (0x9A6C9329AC4BC9B5, 64),
+}
+HASH_ALGORITHMS = ("md5", "sha1", "sha256")
+# Fields of the checksums of HEAD responses with ChecksumMode enabled
+HEAD_CHECKSUM_FIELDS = {
+    "ChecksumCRC32": "crc32",
+    "ChecksumCRC32C": "crc32c",
+    "ChecksumCRC64NVME": "crc64nvme",
+    "ChecksumSHA1": "sha1",
+    "ChecksumSHA256": "sha256",
+}
+
+
+def _crc_functions():
+    functions = {"crc32": lambda data, value: zlib.crc32(data, value) & 0xFFFFFFFF}
+    if crt_checksums is not None:
+        functions["crc32c"] = crt_checksums.crc32c
+        if hasattr(crt_checksums, "crc64nvme"):
+            functions["crc64nvme"] = crt_checksums.crc64nvme
+    elif crc32c is not None:
+        functions["crc32c"] = crc32c.crc32c
+    return functions
+
+
+# CRC functions taking the data and the CRC of the previous data
+CRC_FUNCTIONS = _crc_functions()
+
+
+def available_algorithms():
+    """Algorithms that can be computed while downloading. CRC32C and CRC64NVME need
+    the awscrt or crc32c packages."""
+    return frozenset(HASH_ALGORITHMS) | frozenset(CRC_FUNCTIONS)
+
+
+def head_checksums(head, etag):
+    """Checksums of an object by algorithm, from its HEAD response and ETag.
+
+    The ETag is used as the MD5 checksum, unless the object is encrypted with KMS or
+    customer keys and its ETag is not an MD5 digest.
+    """
+    checksums = dict((algorithm, head[field])
+                     for field, algorithm in HEAD_CHECKSUM_FIELDS.items() if head.get(field))
+    if etag and not head.get("SSECustomerAlgorithm") and \
+            not str(head.get("ServerSideEncryption", "")).startswith("aws:kms"):
+        checksums["md5"] = etag.strip('"')
+    return checksums
+
+
+class PartHasher:
+    """Digests of the bytes of a part, updated as they are written."""
+
+    def __init__(self, algorithms):
+        self._hashes = dict((algorithm, hashlib.new(algorithm))
+                            for algorithm in algorithms if algorithm in HASH_ALGORITHMS)
+        self._crcs = dict((algorithm, 0) for algorithm in algorithms if algorithm in CRC_FUNCTIONS)
+
+    def update(self, data):
+        """Add data to the digests."""
+        for part_hash in self._hashes.values():
+            part_hash.update(data)
+        for algorithm, crc in self._crcs.items():
+            self._crcs[algorithm] = CRC_FUNCTIONS[algorithm](data, crc)
+
+    def update_file(self, file_obj, length, chunk_size=1024 * 1024):
+        """Add length bytes read from file_obj to the digests."""
+        while length > 0:
+            data = file_obj.read(min(chunk_size, length))
+            if not data:
+                break
+            self.update(data)
+            length -= len(data)
+
+    def digests(self):
+        """Hex digests of the hashes and integer CRCs, by algorithm."""
+        digests = dict((algorithm, part_hash.hexdigest())
+                       for algorithm, part_hash in self._hashes.items())
+        digests.update(self._crcs)
+        return digests
+
+
+class ObjectHasher:
+    """Digests of a whole object, for the checksums that can't be computed from the
+    digests of its parts, like the MD5 ETag of an object uploaded at once.
+
+    Bytes are hashed in order: bytes written after a gap are not hashed, and are read
+    again once the bytes before them are.
+    """
+
+    def __init__(self, algorithms):
+        self._hasher = PartHasher(algorithms)
+        self._position = 0
+        self._lock = threading.Lock()
+
+    @property
+    def position(self):
+        """Offset of the first byte not hashed yet."""
+        return self._position
+
+    def update(self, position, data):
+        """Add data, found at position of the object, to the digests if it follows the
+        bytes hashed."""
+        with self._lock:
+            skip = self._position - position
+            if skip < 0 or skip >= len(data):
+                return
+            self._hasher.update(data[skip:] if skip else data)
+            self._position += len(data) - skip
+
+    def part_hasher(self, position, hasher=None):
+        """Hasher of bytes written from position, updating the object digests as well as
+        hasher."""
+        return _ObjectPartHasher(self, position, hasher)
+
+    def checksums(self):
+        """Checksums of the bytes hashed, by algorithm, in the format of S3."""
+        return dict((algorithm, _encode(algorithm, _raw_digest(algorithm, digest)))
+                    for algorithm, digest in self._hasher.digests().items())
+
+
+class _ObjectPartHasher(PartHasher):
+    """PartHasher of the bytes of a part, also added to the digests of its object."""
+
+    # pylint: disable=super-init-not-called
+    def __init__(self, object_hasher, position, hasher=None):
+        self._object_hasher = object_hasher
+        self._position = position
+        self._hasher = hasher
+
+    def update(self, data):
+        if self._hasher is not None:
+            self._hasher.update(data)
+        self._object_hasher.update(self._position, data)
+        self._position += len(data)
+
+    def digests(self):
+        return self._hasher.digests() if self._hasher is not None else {}
+
+
+def _gf2_times(matrix, vector):
+    result = 0
+    row = 0
+    while vector:
+        if vector & 1:
+            result ^= matrix[row]
+        vector >>= 1
+        row += 1
+    return result
+
+
+def _gf2_square(matrix):
+    return [_gf2_times(matrix, row) for row in matrix]
+
+
+def combine_crc(algorithm, crc1, crc2, length2):
+    """CRC of the concatenation of two blocks from the CRCs of both blocks and the
+    length of the second one, as zlib's crc32_combine."""
+    if length2 <= 0:
+        return crc1
+    polynomial, width = CRC_PARAMETERS[algorithm]
+    # Operator appending one zero bit, then two and four zero bits
+    odd = [polynomial] + [1 << row for row in range(width - 1)]
+    even = _gf2_square(odd)
+    odd = _gf2_square(even)
+    while True:
+        even = _gf2_square(odd)
+        if length2 & 1:
+            crc1 = _gf2_times(even, crc1)
+        length2 >>= 1
+        if not length2:
+            break
+        odd = _gf2_square(even)
+        if length2 & 1:
+            crc1 = _gf2_times(odd, crc1)
+        length2 >>= 1
+        if not length2:
+            break
+    return crc1 ^ crc2
+
+
+def _raw_digest(algorithm, digest):
+    if algorithm in CRC_PARAMETERS:
+        return struct.pack(">Q" if CRC_PARAMETERS[algorithm][1] == 64 else ">I", digest)
+    return binascii.unhexlify(digest)
+
+
+def _encode(algorithm, raw_digest):
+    if algorithm == "md5":
+        return binascii.hexlify(raw_digest).decode("ascii")
+    return base64.b64encode(raw_digest).decode("ascii")
+
+
+def object_checksum(algorithm, expected, part_digests, part_lengths, upload_parts=None):
+    """Checksum of an object from the digests of its parts, in the format of expected.
+
+    Checksums of objects uploaded in several parts, like multipart ETags, hash the
+    checksums of the uploaded parts, so they can only be computed when the downloaded
+    parts are the uploaded ones.
+
+    :param algorithm: md5 for ETags, or the name of an S3 checksum algorithm.
+    :param expected: ETag or S3 checksum of the object.
+    :param part_digests: digests of the downloaded parts, as computed by PartHasher.
+    :param part_lengths: lengths of the downloaded parts.
+    :param upload_parts: whether the downloaded parts are the uploaded ones.
+    :return: the checksum, None if it can't be computed from the parts.
+    """
+    digests = [digests[algorithm] for digests in part_digests]
+    if "-" in expected:
+        if not upload_parts or expected.rsplit("-", 1)[1] != str(len(digests)):
+            return None
+        raw_digests = b"".join(_raw_digest(algorithm, digest) for digest in digests)
+        if algorithm in CRC_PARAMETERS:
+            raw_digest = _raw_digest(algorithm, CRC_FUNCTIONS[algorithm](raw_digests, 0))
+        else:
+            raw_digest = hashlib.new(algorithm, raw_digests).digest()
+        return "{}-{}".format(_encode(algorithm, raw_digest), len(digests))
+    if algorithm in CRC_PARAMETERS:
+        crc = digests[0]
+        for digest, length in zip(digests[1:], part_lengths[1:]):
+            crc = combine_crc(algorithm, crc, digest, length)
+        return _encode(algorithm, _raw_digest(algorithm, crc))
+    if len(digests) != 1:
+        return None
+    return _encode(algorithm, _raw_digest(algorithm, digests[0]))
@@ -18,15 +18,95 @@ Command line interface for S3resumable.
 from __future__ import absolute_import
 
 import argparse
+import json
 import logging
 import os
 import re
+import sys
+from concurrent import futures
 
 import boto3
+from botocore.compat import six
+from botocore.config import Config
 
-from s3resumable import S3Resumable, S3ResumableObserver, S3ResumableError
+from s3resumable import (ContentCache, MetadataCache, MetricsObserver, S3Resumable,
+                         S3ResumableObserver, S3ResumableError, SyncIndex)
 
 S3_URL = r"^s3://([^/]+)/(.*?([^/]+)/?)$"
+S3_PREFIX_URL = r"^s3://([^/]+)/?(.*)$"
+
+
+def part_size_type(value):
+    """Part size argument, in MB or "auto"."""
+    if value == "auto":
+        return value
+    return int(value)
+
+
+def size_parser(name, minimum):
+    """Argument type of a size named name, in bytes with an optional K, M or G suffix,
+    of at least minimum bytes."""
+    units = {"K": 1000, "M": 1000000, "G": 1000000000}
+
+    def parse_size(value):
+        multiplier = units.get(value[-1:].upper())
+        if multiplier is not None:
+            value = value[:-1]
+        size = int(float(value) * (multiplier or 1))
+        if size < minimum:
+            raise argparse.ArgumentTypeError("invalid {}".format(name))
+        return size
+
+    # Named in the errors of argparse
+    parse_size.__name__ = "{}_type".format(name)
+    return parse_size
+
+
+# Bandwidth argument, in bytes per second
+bandwidth_type = size_parser("bandwidth", 1)  # pylint: disable=invalid-name
+# Size argument, in bytes
+size_type = size_parser("size", 0)  # pylint: disable=invalid-name
+
+
+def address_type(value):
+    """host:port argument."""
+    host, _, port = value.rpartition(":")
+    if not host or not port.isdigit():
+        raise argparse.ArgumentTypeError("invalid address, expected host:port")
+    return host, int(port)
+
+
+def split_target(target):
+    """Download dir and file of a target dir or file, None as file for dirs."""
+    if os.path.isdir(target) or target.endswith(os.sep):
+        return target, None
+    return os.path.dirname(target) or ".", os.path.basename(target)
+
+
+def read_batch(lines, default_target):
+    """Sources and targets of a batch file.
+
+    Lines are "source [target]", or JSON objects with source and target keys. Empty
+    lines and lines starting with # are skipped, and sources without target are
+    downloaded into default_target.
+
+    :raises ValueError: invalid line.
+    """
+    for number, line in enumerate(lines, 1):
+        line = line.strip()
+        if not line or line.startswith("#"):
+            continue
+        try:
+            if line.startswith("{"):
+                item = json.loads(line)
+                source, target = item["source"], item.get("target") or default_target
+            else:
+                fields = line.split(None, 1)
+                source = fields[0]
+                target = fields[1] if len(fields) > 1 else default_target
+        except (KeyError, TypeError, ValueError) as exc:
+            six.raise_from(ValueError("invalid line {}: {}".format(number, line)), exc)
+        yield source, target
 
 
 class Cli(S3ResumableObserver):
@@ -43,11 +123,74 @@ class Cli(S3ResumableObserver):
         self.parser.add_argument("--debug", action="store_true", help="increase output verbosity")
         self.parser.add_argument("--logfile", dest='logfile', help="set log file")
         self.parser.add_argument("--temp-dir", dest='temp_dir', help="temporal dir for parts")
-        self.parser.add_argument("--part-size", dest='part_size', default=15, type=int,
-                                 help="maximum size of temporary parts in MB")
-        self.parser.add_argument("source", nargs=1, help="source object")
-        self.parser.add_argument("target", nargs='?', default=os.getcwd(),
-                                 help="target dir or file")
+        self.parser.add_argument("--part-size", dest='part_size', default=15,
+                                 type=part_size_type,
+                                 help="maximum size of temporary parts in MB, or auto to "
+                                      "choose it from the size of objects")
+        self.parser.add_argument("--concurrency", dest='concurrency', default=1, type=int,
+                                 help="number of parts downloaded at the same time")
+        self.parser.add_argument("--chunk-size", dest='chunk_size', default=256, type=int,
+                                 help="size of the buffer used to write parts in KB")
+        self.parser.add_argument("--single-file", dest='single_file', action="store_true",
+                                 help="write parts in place into a single preallocated file")
+        self.parser.add_argument("--max-bandwidth", dest='max_bandwidth', default=None,
+                                 type=bandwidth_type,
+                                 help="maximum bytes per second, with an optional K, M or G "
+                                      "suffix")
+        self.parser.add_argument("--verify", dest='verify_checksums', action="store_true",
+                                 help="verify the ETag and checksums of downloaded objects")
+        self.parser.add_argument("--prometheus-file", dest='prometheus_file',
+                                 help="write part metrics to a Prometheus text file")
+        self.parser.add_argument("--statsd", dest='statsd_address', type=address_type,
+                                 help="send part metrics to a StatsD server at host:port")
+        self.parser.add_argument("--cache-dir", dest='cache_dir',
+                                 help="cache of downloaded objects shared by downloads, "
+                                      "addressed by ETag and size")
+        self.parser.add_argument("--cache-size", dest='cache_size', default=None,
+                                 type=size_type,
+                                 help="maximum bytes of the cache, with an optional K, M or G "
+                                      "suffix, evicting the least recently used objects")
+        self.parser.add_argument("--metadata-cache", dest='metadata_cache',
+                                 help="JSON file caching the size and ETag of objects "
+                                      "across runs instead of requesting them")
+        self.parser.add_argument("--metadata-ttl", dest='metadata_ttl', default=300,
+                                 type=float,
+                                 help="seconds after which cached metadata expires")
+        self.parser.add_argument("--cooperative", action="store_true",
+                                 help="download parts together with other processes or "
+                                      "hosts sharing the temporary dir")
+        self.parser.add_argument("--lease-ttl", dest='lease_ttl', default=60, type=int,
+                                 help="seconds after which the parts leased by a dead "
+                                      "cooperative worker are taken over")
+        self.parser.add_argument("--coalesce", action="store_true",
+                                 help="wait for the download of the same file by another "
+                                      "process and share it instead of failing")
+        self.parser.add_argument("--lock-timeout", dest='lock_timeout', default=None,
+                                 type=float,
+                                 help="seconds to wait for the download of the same file by "
+                                      "another process, negative to wait forever")
+        self.parser.add_argument("--decompress", action="store_true",
+                                 help="decompress the .gz, .bz2, .xz or .zst source into the "
+                                      "target while it is downloaded")
+        self.parser.add_argument("--extract", action="store_true",
+                                 help="extract the tar archive source into the target dir "
+                                      "while it is downloaded")
+        self.parser.add_argument("--recursive", action="store_true",
+                                 help="download every key under the source prefix")
+        self.parser.add_argument("--sync-index", dest='sync_index',
+                                 help="with --recursive, SQLite index of downloaded keys used "
+                                      "to download only new or changed keys")
+        self.parser.add_argument("--from-file", dest='from_file',
+                                 help="download the sources of a file, - for stdin, with "
+                                      "\"source [target]\" or JSON lines with source and "
+                                      "target; the only positional argument is then the "
+                                      "target of sources without one")
+        self.parser.add_argument("--jobs", dest='jobs', default=1, type=int,
+                                 help="with --from-file, number of sources downloaded at the "
+                                      "same time")
+        self.parser.add_argument("source", nargs='?', help="source object")
+        self.parser.add_argument("target", nargs='?',
+                                 help="target dir or file, - to stream the source to stdout")
 
     def update(self, file_info):
         self.logger.debug("downloaded part %d of %d", file_info['part'], file_info['total_parts'])
@@ -55,17 +198,65 @@ class Cli(S3ResumableObserver):
     def start(self):
         """Starts here."""
         args = self.parser.parse_args()
+        if args.from_file:
+            if args.target is not None:
+                self.parser.error("--from-file takes the sources from the file")
+            args.target, args.source = args.source or os.getcwd(), None
+        elif args.source is None:
+            self.parser.error("the source is required")
+        args.target = args.target or os.getcwd()
+        if args.jobs < 1:
+            self.parser.error("--jobs must be positive")
+        if (args.decompress or args.extract) and (args.from_file or args.recursive):
+            self.parser.error("--decompress and --extract take a single source")
         logging.basicConfig(filename=args.logfile,
                             format='%(asctime)-15s %(levelname)s: %(message)s')
         self.logger.setLevel(logging.DEBUG if args.debug else logging.INFO)
 
         s3client = boto3.client('s3', aws_access_key_id=args.aws_access_key_id,
                                 aws_secret_access_key=args.aws_secret_access_key,
-                                aws_session_token=args.aws_session_token)
-        s3resumable = S3Resumable(s3client, part_size_megabytes=args.part_size)
+                                aws_session_token=args.aws_session_token,
+                                config=Config(max_pool_connections=max(
+                                    10, args.concurrency * args.jobs)))
+        metadata_cache = None
+        if args.metadata_cache:
+            metadata_cache = MetadataCache(ttl=args.metadata_ttl, path=args.metadata_cache)
+        s3resumable = S3Resumable(s3client, part_size_megabytes=args.part_size,
+                                  max_concurrency=args.concurrency,
+                                  chunk_size_kilobytes=args.chunk_size,
+                                  single_file=args.single_file,
+                                  max_bandwidth=args.max_bandwidth,
+                                  verify_checksums=args.verify_checksums,
+                                  cache=ContentCache(args.cache_dir, max_size=args.cache_size)
+                                  if args.cache_dir else None,
+                                  cooperative=args.cooperative,
+                                  lease_ttl=args.lease_ttl,
+                                  coalesce=args.coalesce,
+                                  lock_timeout=args.lock_timeout,
+                                  metadata_cache=metadata_cache)
         s3resumable.attach(self)
 
-        s3_url_re = re.match(S3_URL, args.source[0])
+        metrics = None
+        if args.prometheus_file or args.statsd_address:
+            metrics = MetricsObserver(prometheus_file=args.prometheus_file,
+                                      statsd_address=args.statsd_address)
+            s3resumable.attach(metrics)
+        try:
+            if args.from_file:
+                return self.download_batch(s3resumable, args)
+            if args.recursive:
+                return self.download_prefix(s3resumable, args)
+            return self.download_file(s3resumable, args)
+        finally:
+            if metrics is not None:
+                s3resumable.detach(metrics)
+                metrics.flush()
+            if metadata_cache is not None:
+                metadata_cache.flush()
+
+    def download_file(self, s3resumable, args):
+        """Download the source key into the target."""
+        s3_url_re = re.match(S3_URL, args.source)
         if not s3_url_re:
             self.logger.error("invalid argument for s3 url")
             return -1
@@ -73,12 +264,12 @@ class Cli(S3ResumableObserver):
         bucket = s3_url_re.group(1)
         key = s3_url_re.group(2)
 
-        if os.path.isdir(args.target) or args.target.endswith(os.sep):
-            download_dir = args.target
-            download_file = None
-        else:
-            download_dir = os.path.dirname(args.target[0])
-            download_file = os.path.basename(args.target[0])
+        if args.target == "-":
+            return self.stream(s3resumable, bucket, key, args)
+        if args.extract:
+            return self.extract(s3resumable, bucket, key, args)
+
+        download_dir, download_file = split_target(args.target)
 
         self.logger.debug("bucket: %s", bucket)
         self.logger.debug("key: %s", key)
@@ -87,19 +278,112 @@ class Cli(S3ResumableObserver):
         self.logger.debug("temp_dir: %s", args.temp_dir or download_dir)
 
         try:
-            downloaded_file = s3resumable.download_file(bucket, key, download_dir,
-                                                        download_file=download_file,
-                                                        temp_dir=args.temp_dir)
+            if args.decompress:
+                downloaded_file = s3resumable.decompress_file(bucket, key, download_dir,
+                                                              download_file=download_file,
+                                                              temp_dir=args.temp_dir)
+            else:
+                downloaded_file = s3resumable.download_file(bucket, key, download_dir,
+                                                            download_file=download_file,
+                                                            temp_dir=args.temp_dir)
             self.logger.info("%s downloaded", downloaded_file)
+        except (S3ResumableError, ValueError) as err:
+            self.logger.error(str(err))
+        return 0
+
+    def extract(self, s3resumable, bucket, key, args):
+        """Extract the source archive into the target dir while it is downloaded."""
+        try:
+            extracted = s3resumable.extract_archive(bucket, key, args.target,
+                                                    temp_dir=args.temp_dir)
+            self.logger.info("%d files extracted to %s", len(extracted), args.target)
+        except (S3ResumableError, ValueError) as err:
+            self.logger.error(str(err))
+        return 0
+
+    def stream(self, s3resumable, bucket, key, args):
+        """Write the source key to stdout while it is downloaded."""
+        output = getattr(sys.stdout, "buffer", sys.stdout)
+        try:
+            for chunk in s3resumable.stream(bucket, key, temp_dir=args.temp_dir):
+                output.write(chunk)
+            output.flush()
         except S3ResumableError as err:
             self.logger.error(str(err))
         return 0
 
+    def download_prefix(self, s3resumable, args):
+        """Download every key under the source prefix into the target dir."""
+        s3_url_re = re.match(S3_PREFIX_URL, args.source)
+        if not s3_url_re:
+            self.logger.error("invalid argument for s3 url")
+            return -1
+
+        bucket = s3_url_re.group(1)
+        prefix = s3_url_re.group(2)
+
+        self.logger.debug("bucket: %s", bucket)
+        self.logger.debug("prefix: %s", prefix)
+        self.logger.debug("download_dir: %s", args.target)
+        self.logger.debug("temp_dir: %s", args.temp_dir or args.target)
+
+        index = SyncIndex(args.sync_index) if args.sync_index else None
+        try:
+            downloaded_files = s3resumable.download_prefix(bucket, prefix, args.target,
+                                                           temp_dir=args.temp_dir, index=index)
+            self.logger.info("%d files downloaded", len(downloaded_files))
+        except S3ResumableError as err:
+            self.logger.error(str(err))
+        finally:
+            if index is not None:
+                index.close()
+        return 0
+
+    def download_batch(self, s3resumable, args):
+        """Download the sources of the batch file, --jobs of them at the same time."""
+        if args.from_file == "-":
+            lines = sys.stdin.readlines()
+        else:
+            with open(args.from_file) as batch_file:
+                lines = batch_file.readlines()
+        try:
+            items = list(read_batch(lines, args.target))
+        except ValueError as err:
+            self.logger.error(str(err))
+            return -1
+
+        with futures.ThreadPoolExecutor(max_workers=args.jobs) as executor:
+            pending = [(source, executor.submit(self.download_item, s3resumable, source,
+                                                target, args.temp_dir))
+                       for source, target in items]
+        failed = 0
+        for source, future in pending:
+            error = future.exception()
+            if error is None:
+                self.logger.info("%s downloaded to %s", source, future.result())
+            else:
+                failed += 1
+                self.logger.error("%s failed: %s", source, error)
+        self.logger.info("%d downloaded, %d failed", len(pending) - failed, failed)
+        return 1 if failed else 0
+
+    @staticmethod
+    def download_item(s3resumable, source, target, temp_dir):
+        """Download a source of a batch into its target."""
+        s3_url_re = re.match(S3_URL, source)
+        if not s3_url_re:
+            raise ValueError("invalid s3 url")
+        download_dir, download_file = split_target(target)
+        return s3resumable.download_file(s3_url_re.group(1), s3_url_re.group(2), download_dir,
+                                         download_file=download_file, temp_dir=temp_dir)
+
 
 def main():
     """Main function."""
     cli = Cli()
-    cli.start()
+    # Only failed sources of a batch exit with an error, single downloads log theirs
+    if cli.start() > 0:
+        sys.exit(1)
 
 
 if __name__ == "__main__":
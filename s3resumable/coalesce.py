@@ -0,0 +1,147 @@
+# -*- coding: utf-8 -*-
+# Copyright 2020 Immfly.com. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"). You
+# may not use this file except in compliance with the License. A copy of
+# the License is located at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# or in the "license" file accompanying this file. This file is
+# distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF
+# ANY KIND, either express or implied. See the License for the specific
+# language governing permissions and limitations under the License.
+"""Download S3 in parts.
+
+This modules provides the helpers used by S3Resumable to share a download with the
+callers requesting the same file at the same time, in the same or other processes.
+"""
+import errno
+import threading
+from concurrent import futures
+
+import filelock
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover
+    fcntl = None
+
+__all__ = ["InFlightDownloads", "SharedLock"]
+
+
+class InFlightDownloads:
+    """Registry of the downloads in flight in the process, by target."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._downloads = {}
+
+    def join(self, target):
+        """Join the download of target, or register a new one.
+
+        :return: the future of the download, and True if the caller must download it
+            and finish it.
+        """
+        with self._lock:
+            future = self._downloads.get(target)
+            if future is not None:
+                return future, False
+            future = futures.Future()
+            self._downloads[target] = future
+            return future, True
+
+    def finish(self, target, result=None, error=None):
+        """Hand the result or the error of the download of target to its waiters."""
+        with self._lock:
+            future = self._downloads.pop(target)
+        if error is not None:
+            future.set_exception(error)
+        else:
+            future.set_result(result)
+
+
+class SharedLock:
+    """Exclusive lock of a file shared by processes, compatible with filelock.
+
+    Waiters block in the kernel until the lock is released instead of polling for it.
+    A waiter with a timeout blocks in a thread cancelled at its deadline, which drops
+    the lock as soon as it gets it. Without fcntl, it falls back to filelock.
+    """
+
+    def __init__(self, path):
+        self._path = path
+        self._file = None
+        self._fallback = None
+
+    def acquire(self, timeout=-1):
+        """Lock the file.
+
+        :param timeout: seconds to wait for the lock, negative to wait forever.
+        :raises filelock.Timeout: the lock was not released in time.
+        """
+        if fcntl is None:
+            self._fallback = filelock.FileLock(self._path)
+            self._fallback.acquire(timeout=timeout)
+            return
+        lock_file = open(self._path, "a")
+        try:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except (IOError, OSError) as exc:
+            if exc.errno not in (errno.EAGAIN, errno.EACCES):
+                lock_file.close()
+                raise
+            if timeout is None or timeout < 0:
+                fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+            else:
+                self._wait(lock_file, timeout)
+        self._file = lock_file
+
+    def _wait(self, lock_file, timeout):
+        """Wait for the lock in the kernel from a thread, for timeout seconds."""
+        acquired = threading.Event()
+        state_lock = threading.Lock()
+        state = {"cancelled": False}
+
+        def wait():
+            try:
+                fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+            except (IOError, OSError) as exc:
+                state["error"] = exc
+            with state_lock:
+                if state["cancelled"]:
+                    # Given up by acquire, the lock must not be kept
+                    lock_file.close()
+                else:
+                    acquired.set()
+
+        waiter = threading.Thread(target=wait, name="SharedLock {}".format(self._path))
+        # A cancelled waiter must not keep the process alive while the lock is held
+        waiter.daemon = True
+        waiter.start()
+        # Event.wait measures the timeout with a monotonic clock
+        acquired.wait(timeout)
+        with state_lock:
+            if not acquired.is_set():
+                state["cancelled"] = True
+                raise filelock.Timeout(self._path)
+        if "error" in state:
+            lock_file.close()
+            raise state["error"]
+
+    def release(self):
+        """Unlock the file."""
+        if self._fallback is not None:
+            self._fallback.release()
+            self._fallback = None
+        elif self._file is not None:
+            fcntl.flock(self._file.fileno(), fcntl.LOCK_UN)
+            self._file.close()
+            self._file = None
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *args):
+        self.release()
@@ -0,0 +1,175 @@
+# -*- coding: utf-8 -*-
+# Copyright 2020 Immfly.com. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"). You
+# may not use this file except in compliance with the License. A copy of
+# the License is located at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# or in the "license" file accompanying this file. This file is
+# distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF
+# ANY KIND, either express or implied. See the License for the specific
+# language governing permissions and limitations under the License.
+"""Download S3 in parts.
+
+This modules provides the cooperative downloads of S3Resumable, where the workers of
+several processes or hosts sharing temp_dir download the parts of one object together.
+"""
+from __future__ import absolute_import
+
+import errno
+import os
+import time
+from concurrent import futures
+
+import filelock
+
+from .exceptions import S3ResumableDownloadError
+from .layout import check_part_size, join_parts
+from .lease import PartLeases
+from .manifest import ResumeManifest
+from .utils import move_file, remove_if_exists
+from .verify import verify_object
+
+__all__ = ["download_cooperatively"]
+
+# Seconds between looks for parts leased by other workers of a cooperative download
+LEASE_POLL_INTERVAL = 1
+# Rounds of a cooperative download before giving up on a manifest removed by other
+# workers without the file being found
+MAX_ROUNDS = 3
+
+
+# pylint: disable=too-many-arguments,too-many-locals
+def download_cooperatively(core, bucket, key, local_file_path, temp_file_path, listed_info,
+                           replace):
+    """Download the parts of a key not leased by other workers sharing temp_dir, see
+    DownloadCore.download_file.
+
+    The setup of the manifest and the assembly of the file hold a lock file next to
+    the parts, so the first worker records the part size used by all of them and
+    the last one to finish assembles the file. A worker not finding the file assembled
+    by another one, like on a host not sharing download_dir, downloads the key again.
+    """
+    transport, options = core.transport, core.options
+    if options.cache is not None:
+        listed_info = transport.run(core.from_cache(bucket, key, local_file_path,
+                                                    listed_info))
+        if listed_info is None:
+            return local_file_path
+    scheduler = listed_info.pop("scheduler", None) if listed_info else None
+    for _ in range(MAX_ROUNDS):
+        downloaded_file = _download_round(core, bucket, key, local_file_path, temp_file_path,
+                                          listed_info, replace, scheduler)
+        if downloaded_file is not None:
+            return downloaded_file
+        # The file was assembled where local_file_path is not shared, or the parts were
+        # discarded on a checksum mismatch, so the next round downloads the key again,
+        # with or without other workers, from its current info
+        listed_info = None
+    raise S3ResumableDownloadError("Failed to download key {}".format(key))
+
+
+# pylint: disable=too-many-arguments,too-many-locals
+def _download_round(core, bucket, key, local_file_path, temp_file_path, listed_info, replace,
+                    scheduler):
+    """Download the parts of a key together with the other workers, see
+    download_cooperatively.
+
+    :return: local_file_path, or None if the manifest was removed by another worker
+        without local_file_path being found.
+    """
+    transport, options = core.transport, core.options
+    lock = filelock.FileLock("{path}.lock".format(path=temp_file_path))
+    manifest = ResumeManifest("{path}.manifest".format(path=temp_file_path))
+    with lock:
+        if os.path.isfile(local_file_path) and not replace:
+            remove_if_exists(lock.lock_file)
+            return local_file_path
+        manifest.load()
+        if listed_info and (not options.verify_checksums or "checksums" in listed_info):
+            file_info = listed_info
+        else:
+            file_info = transport.run(core.get_file_info(bucket, key))
+        core.prepare_manifest(bucket, key, temp_file_path, manifest, file_info)
+
+    part_path = "{path}.part{{part}}".format(path=temp_file_path)
+    leases = PartLeases(part_path, options.lease_ttl)
+    work_info = dict(file_info, part_path=leases.owner_part_path, digests={})
+    workers = min(options.max_concurrency, file_info["total_parts"])
+    with leases:
+        def cooperate(_):
+            _cooperate(core, bucket, key, work_info, leases, part_path, manifest.path)
+        if scheduler is not None:
+            transport.wait(scheduler.map_parts(cooperate, range(workers)))
+        elif workers > 1:
+            with futures.ThreadPoolExecutor(max_workers=workers) as executor:
+                transport.wait([executor.submit(cooperate, worker)
+                                for worker in range(workers)])
+        else:
+            cooperate(0)
+
+    with lock:
+        if not os.path.isfile(manifest.path):
+            # Assembled, or discarded on a checksum mismatch, by another worker
+            if not os.path.isfile(local_file_path):
+                return None
+            remove_if_exists(lock.lock_file)
+            return local_file_path
+        file_info.update({"manifest": manifest, "part_path": part_path,
+                          "digests": work_info["digests"]})
+        verify_object(core, key, temp_file_path, file_info)
+        # Workers stop once the manifest is gone, before parts are removed
+        manifest.remove()
+        downloaded_file = join_parts(key, temp_file_path, file_info)
+        core.add_to_cache(file_info, downloaded_file)
+        if downloaded_file != local_file_path:
+            move_file(downloaded_file, local_file_path)
+        # Removed by every worker finding the file, the lock is only needed while the
+        # parts are downloaded
+        remove_if_exists(lock.lock_file)
+    return local_file_path
+
+
+# pylint: disable=too-many-arguments
+def _cooperate(core, bucket, key, file_info, leases, part_path, manifest_path):
+    """Download parts until every part is complete, waiting for the parts leased by
+    other workers, or until another worker assembled the file."""
+    while True:
+        waiting = False
+        for part in range(file_info["total_parts"]):
+            file_part = part_path.format(part=part)
+            if check_part_size(core, file_part, part, file_info):
+                continue
+            if not leases.acquire(part):
+                waiting = True
+                continue
+            try:
+                # Complete parts are renamed before releasing their lease, and
+                # removed only after the manifest by the worker assembling the file
+                if check_part_size(core, file_part, part, file_info):
+                    continue
+                if not os.path.isfile(manifest_path):
+                    return
+                core.transport.run(core.download_part(bucket, key, part, file_info))
+                owner_part = file_info["part_path"].format(part=part)
+                try:
+                    with open(owner_part, "rb") as part_file:
+                        os.fsync(part_file.fileno())
+                except (IOError, OSError) as exc:
+                    # Removed by a worker taking the lease over
+                    if exc.errno != errno.ENOENT:
+                        raise
+                if not leases.held(part):
+                    # Taken over while it was downloaded, the part of the new owner is
+                    # never replaced
+                    remove_if_exists(owner_part)
+                    waiting = True
+                    continue
+                os.rename(owner_part, file_part)
+            finally:
+                leases.release(part)
+        if not waiting:
+            return
+        time.sleep(LEASE_POLL_INTERVAL)
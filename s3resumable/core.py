@@ -0,0 +1,762 @@
+# -*- coding: utf-8 -*-
+# Copyright 2020 Immfly.com. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"). You
+# may not use this file except in compliance with the License. A copy of
+# the License is located at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# or in the "license" file accompanying this file. This file is
+# distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF
+# ANY KIND, either express or implied. See the License for the specific
+# language governing permissions and limitations under the License.
+"""Download S3 in parts.
+
+This modules provides the download logic shared by S3Resumable and AsyncS3Resumable.
+
+Downloads are written as flows: generators yielding what they wait for, like requests,
+blocking calls or the flows they call, and raising Return with their result. A
+transport provides what flows wait for and runs them: the one of S3Resumable in the
+calling thread, and the one of AsyncS3Resumable in the event loop, so both
+downloaders share every step of a download while neither blocks its callers.
+"""
+from __future__ import absolute_import
+
+import logging
+import math
+import os
+import threading
+import time
+import types
+
+from botocore.compat import six
+from botocore.exceptions import ClientError
+
+from .checksum import head_checksums
+from .exceptions import (S3ResumableChanged, S3ResumableDownloadError, S3ResumableIncompatible,
+                         S3ResumableTruncated)
+from .layout import (check_free_space, discard_parts, finish_single_file, join_parts,
+                     open_output, part_file_size, prepare_single_file, resume_part_file)
+from .manifest import ResumeManifest
+from .utils import create_directory_tree, move_file, sync_file
+from .verify import add_digests, object_hasher, part_hasher, verify_object
+
+__all__ = ["DownloadCore", "Return", "Transport", "advance", "is_flow", "notification_download"]
+
+timer = getattr(time, "monotonic", time.time)  # pylint: disable=invalid-name
+
+LOGGER = logging.getLogger(__name__)
+
+
+class Return(Exception):
+    """Raised by a flow to end with value as its result."""
+
+    def __init__(self, value=None):
+        super(Return, self).__init__()
+        self.value = value
+
+
+def is_flow(step):
+    """Check if a step yielded by a flow is a flow to run."""
+    return isinstance(step, types.GeneratorType)
+
+
+def advance(flow, result=None, error=None):
+    """Resume flow with the result, or the error, of the last step it yielded.
+
+    :return: (True, result of flow) once it ends, (False, next step) otherwise.
+    """
+    try:
+        step = flow.send(result) if error is None else flow.throw(error)
+    except Return as done:
+        return True, done.value
+    except StopIteration:
+        return True, None
+    return False, step
+
+
+def notification_download(file_info):
+    """Download a notification belongs to, so notifications are ordered and coalesced
+    by download."""
+    return (file_info.get("key"), file_info.get("file_path") or file_info.get("part_path"))
+
+
+class Transport:
+    """Base of the transports of DownloadCore, sharing their client and notifications."""
+
+    # Class of the dispatcher delivering notifications from a queue
+    dispatcher_class = None
+
+    def __init__(self, client, options, notify):
+        self.client = client
+        self._options = options
+        self._notify = notify
+        self._dispatcher = None
+        if options.observer_queue_size:
+            self._dispatcher = self.dispatcher_class(  # pylint: disable=not-callable
+                notify, options.observer_queue_size, options.observer_overflow)
+
+    def head_object(self, **kwargs):
+        """Response of a head_object request, awaitable with asynchronous clients."""
+        return self.client.head_object(**kwargs)
+
+    def get_object(self, **kwargs):
+        """Response of a get_object request, awaitable with asynchronous clients."""
+        return self.client.get_object(**kwargs)
+
+
+class DownloadCore:
+    """
+    Steps of the downloads of S3Resumable and AsyncS3Resumable.
+
+    Methods documented as flows return a flow to be run by the transport. Besides
+    running flows with run, the transport provides what they wait for:
+    head_object and get_object requests, copy_body copying a response body to a file,
+    sleep, blocking calls to the filesystem, publish of notifications, fetch_parts
+    downloading every part of a file, acquire_lock and coalesce. Cooperative
+    downloads are provided by download_cooperatively, when the transport supports
+    them.
+    """
+
+    def __init__(self, transport, options):
+        self.transport = transport
+        self.options = options
+        self._retry_lock = threading.Lock()
+
+    @staticmethod
+    def check_arguments(*arguments):
+        """Check that arguments, (name, value) pairs, are strings."""
+        for argument in arguments:
+            if not isinstance(argument[1], six.string_types):
+                raise ValueError('{} must be a string'.format(argument[0]))
+
+    def get_readahead(self, readahead):
+        """Parts downloaded ahead of the part being read by streams."""
+        if readahead is None:
+            return self.options.max_concurrency * 2
+        if int(readahead) < 1:
+            raise ValueError('Invalid value for readahead')
+        return int(readahead)
+
+    def get_file_info(self, bucket, key):
+        """Flow of the file information of key, as returned by S3Resumable.get_file_info."""
+        file_info = self._cached_file_info(bucket, key)
+        if file_info is not None:
+            raise Return(file_info)
+
+        if not self.options.verify_checksums:
+            head = yield self.transport.head_object(Bucket=bucket, Key=key)
+            file_info = self._parse_head(bucket, key, head)
+        else:
+            head = yield self.transport.head_object(Bucket=bucket, Key=key,
+                                                    ChecksumMode='ENABLED')
+            file_info = self._parse_head(bucket, key, head)
+            upload_parts = self._upload_parts(file_info)
+            if upload_parts:
+                part_head = yield self.transport.head_object(
+                    Bucket=bucket, Key=key, PartNumber=1, IfMatch=file_info["etag"])
+                self._align_upload_parts(file_info, upload_parts,
+                                         part_head.get('ContentLength'))
+        yield self.transport.blocking(self._cache_file_info, bucket, key, file_info)
+        raise Return(file_info)
+
+    def _cached_file_info(self, bucket, key):
+        """File information from the metadata cache, None if key is not cached."""
+        metadata_cache = self.options.metadata_cache
+        verify_checksums = self.options.verify_checksums
+        if metadata_cache is None:
+            return None
+        cached = metadata_cache.get(bucket, key)
+        if cached is None or (verify_checksums and "checksums" not in cached):
+            return None
+        file_info = {"key": key,
+                     "content_length": cached["content_length"],
+                     "etag": cached.get("etag"),
+                     "cached": True}
+        if verify_checksums:
+            file_info["checksums"] = cached["checksums"]
+        if verify_checksums and "upload_part_size" in cached:
+            file_info["upload_part_size"] = cached["upload_part_size"]
+            self.set_part_size(file_info, cached["upload_part_size"])
+        else:
+            self.set_part_size(file_info, self.object_part_size(cached["content_length"]))
+        return file_info
+
+    def _cache_file_info(self, bucket, key, file_info):
+        if self.options.metadata_cache is not None:
+            self.options.metadata_cache.put(bucket, key, file_info)
+
+    def _parse_head(self, bucket, key, head):
+        accept_ranges = None
+        content_length = 0
+        etag = None
+        metadata = None
+        http_headers = None
+
+        if head is not None:
+            metadata = head.get('ResponseMetadata')
+        if metadata is not None:
+            http_headers = metadata.get('HTTPHeaders')
+        if http_headers is not None:
+            content_length = int(http_headers.get('content-length', 0))
+            accept_ranges = http_headers.get('accept-ranges', 'none')
+            etag = http_headers.get('etag')
+
+        # Calculate total parts
+        if content_length == 0 or "bytes" not in accept_ranges:
+            raise S3ResumableIncompatible("Can't download key {} from {} bucket".format(
+                key, bucket))
+
+        file_info = {"key": key,
+                     "content_length": content_length,
+                     "etag": etag}
+        if self.options.verify_checksums:
+            file_info["checksums"] = head_checksums(head, etag)
+        self.set_part_size(file_info, self.object_part_size(content_length))
+        return file_info
+
+    @staticmethod
+    def _upload_parts(file_info):
+        """Number of uploaded parts hashed by the checksums of the object, None if they
+        hash the whole object."""
+        for checksum in file_info.get("checksums", {}).values():
+            if "-" in checksum:
+                return int(checksum.rsplit("-", 1)[1])
+        return None
+
+    def _align_upload_parts(self, file_info, upload_parts, upload_part_size):
+        """Download the uploaded parts, so checksums hashing them can be verified."""
+        if not upload_part_size or upload_parts != int(math.ceil(
+                float(file_info["content_length"]) / upload_part_size)):
+            return
+        self.set_part_size(file_info, int(upload_part_size))
+        file_info["upload_part_size"] = int(upload_part_size)
+
+    def _probe_file_info(self, bucket, key):
+        """Flow getting file information requesting the first bytes of the object instead
+        of a HEAD request.
+
+        The body of the response is kept in file_info to be written as the first part, so
+        objects that fit in the minimum part size are downloaded by this one request.
+        """
+        probe_size = self.options.part_size_policy.min_part_size_bytes
+        response = None
+        try:
+            response = yield self.transport.get_object(
+                Bucket=bucket, Key=key, Range='bytes=0-{}'.format(probe_size - 1))
+        except ClientError as client_error:
+            self.raise_client_error(client_error, bucket, key)
+            if client_error.response['Error']['Code'] != 'InvalidRange':
+                raise
+        if response is None:
+            # Empty objects have no byte to request
+            file_info = yield self.get_file_info(bucket, key)
+            raise Return(file_info)
+
+        content_range = response.get('ContentRange')
+        if not content_range or response.get('Body') is None:
+            raise S3ResumableIncompatible("Can't download key {} from {} bucket".format(
+                key, bucket))
+        file_info = {"key": key,
+                     "content_length": int(content_range.rsplit("/", 1)[1]),
+                     "etag": response.get('ETag')}
+        self.set_part_size(file_info, self.object_part_size(file_info["content_length"]))
+        file_info["probe"] = response['Body']
+        raise Return(file_info)
+
+    def object_part_size(self, content_length):
+        """Part size of an object of content_length bytes."""
+        if self.options.part_size_policy is not None:
+            return self.options.part_size_policy.part_size(content_length)
+        return self.options.part_size_bytes
+
+    @staticmethod
+    def set_part_size(file_info, part_size, segments=None):
+        """Set the part size of file_info, and the parts resized after the first ones."""
+        file_info.update({"part_size": part_size, "segments": list(segments or [])})
+        first_part, first_byte = 0, 0
+        if file_info["segments"]:
+            first_part, first_byte, part_size = file_info["segments"][-1]
+        file_info["total_parts"] = first_part + int(math.ceil(
+            float(file_info["content_length"] - first_byte) / float(part_size)))
+
+    def part_range(self, part, file_info):
+        """Calculate first and last byte (inclusive) of part."""
+        first_part, first_byte, part_size = self.part_segment(part, file_info)
+        start_range = first_byte + (part - first_part) * part_size
+        end_range = min(start_range + part_size, file_info["content_length"]) - 1
+        return start_range, end_range
+
+    def part_segment(self, part, file_info):
+        """First part, first byte and part size of the parts of the same size as part."""
+        segment = (0, 0, file_info.get("part_size", self.options.part_size_bytes))
+        for resized in file_info.get("segments") or ():
+            if resized[0] > part:
+                break
+            segment = resized
+        return segment
+
+    def resize_parts(self, file_info, next_part):
+        """Resize parts from next_part on, none of them started, with the part size policy."""
+        policy = self.options.part_size_policy
+        if policy is None or next_part >= file_info["total_parts"] or \
+                "upload_part_size" in file_info:
+            return
+        part_size = self.part_segment(next_part, file_info)[2]
+        new_part_size = policy.resize(part_size)
+        if new_part_size == part_size:
+            return
+        start_range = self.part_range(next_part, file_info)[0]
+        segments = file_info["segments"] + [[next_part, start_range, new_part_size]]
+        # Workers read segments concurrently, so the list is replaced instead of extended
+        self.set_part_size(file_info, file_info["part_size"], segments)
+        file_info["manifest"].add_segment(next_part, start_range, new_part_size)
+
+    def _observe_part(self, metrics):
+        metrics["finished"] = timer()
+        if self.options.part_size_policy is not None:
+            self.options.part_size_policy.observe(metrics["bytes"],
+                                                  metrics["response"] - metrics["started"],
+                                                  metrics["finished"] - metrics["started"])
+
+    @staticmethod
+    def _part_metrics(part, metrics, attempts):
+        """Timings of the request that completed part, as notified to observers."""
+        started = metrics["started"]
+        finished = metrics["finished"]
+        first_byte = metrics.get("first_byte", finished)
+        return {"part": part,
+                "bytes": metrics["bytes"],
+                "request_latency": metrics["response"] - started,
+                "time_to_first_byte": first_byte - started,
+                "transfer_time": finished - first_byte,
+                "retries": sum(attempts.values()),
+                "throttled": attempts.get(True, 0)}
+
+    # pylint: disable=too-many-arguments
+    def part_request(self, bucket, key, part, file_info, offset=0):
+        """Arguments of the get_object request of part, starting at offset."""
+        start_range, end_range = self.part_range(part, file_info)
+        start_range += offset
+        part_range = 'bytes={start}-{end}'.format(start=start_range, end=end_range)
+        kwargs = {"Bucket": bucket, "Key": key, "Range": part_range}
+        if file_info.get("etag"):
+            # Detect at once an object overwritten since the parts were started
+            kwargs["IfMatch"] = file_info["etag"]
+        return kwargs
+
+    def raise_client_error(self, client_error, bucket, key):
+        """Raise the error of S3Resumable matching a client error, if any."""
+        error_code = client_error.response['Error']['Code']
+        if error_code in ('404', '412', 'PreconditionFailed') and \
+                self.options.metadata_cache is not None:
+            self.options.metadata_cache.discard(bucket, key)
+        if error_code == '404':
+            raise S3ResumableDownloadError("Key {} does not exist in {} bucket".format(
+                key, bucket))
+        if error_code in ('412', 'PreconditionFailed'):
+            raise S3ResumableChanged("Key {} changed in {} bucket".format(key, bucket))
+
+    # pylint: disable=too-many-arguments
+    def _get_part_body(self, bucket, key, part, file_info, offset=0):
+        try:
+            response = yield self.transport.get_object(
+                **self.part_request(bucket, key, part, file_info, offset=offset))
+        except ClientError as client_error:
+            self.raise_client_error(client_error, bucket, key)
+            raise
+        raise Return(response.get('Body'))
+
+    def retry_delay(self, error, attempts, file_info):
+        """Seconds to wait before downloading a part again after error, or None if it
+        can't be retried.
+
+        :param attempts: failed attempts of the part, by throttled or not.
+        :type attempts: dict
+        """
+        policy = self.options.retry_policy
+        throttle = policy.is_throttle(error)
+        if not throttle and not policy.is_transient(error):
+            return None
+        attempts[throttle] = attempts.get(throttle, 0) + 1
+        if attempts[throttle] >= (policy.max_throttle_attempts if throttle
+                                  else policy.max_attempts):
+            return None
+        if not throttle:
+            # Parts of the same object share its retries
+            with self._retry_lock:
+                retries = file_info.get("retries", 0)
+                if retries >= policy.max_retries:
+                    return None
+                file_info["retries"] = retries + 1
+        return policy.delay(attempts[throttle], throttle)
+
+    def retry(self, attempt, file_info):
+        """Flow running the flows made by attempt until one of them succeeds, or fails
+        with an error that can't be retried.
+
+        :return: result of the flow and failed attempts, by throttled or not.
+        """
+        attempts = {}
+        while True:
+            try:
+                result = yield attempt()
+                break
+            except Exception as error:  # pylint: disable=broad-except
+                delay = self.retry_delay(error, attempts, file_info)
+                if delay is None:
+                    raise
+            yield self.transport.sleep(delay)
+        raise Return((result, attempts))
+
+    def download_part(self, bucket, key, part, file_info):
+        """Flow downloading part, unless the manifest records it as complete."""
+        manifest = file_info.get("manifest")
+        if manifest is not None and manifest.is_complete(part):
+            return
+        metrics = {}
+
+        def write_part():
+            metrics.clear()
+            return self._write_part(bucket, key, part, file_info, metrics)
+
+        downloaded, attempts = yield self.retry(write_part, file_info)
+        if manifest is not None:
+            yield self.transport.blocking(manifest.add, part,
+                                          file_info.get("digests", {}).get(part))
+        if not downloaded and not attempts:
+            # Left complete by a previous run
+            return
+
+        extra = None
+        if "finished" in metrics:
+            extra = {"part_metrics": self._part_metrics(part, metrics, attempts)}
+        yield self.transport.publish(file_info, {"part": part + 1}, extra)
+
+    # pylint: disable=too-many-arguments
+    def _write_part(self, bucket, key, part, file_info, metrics):
+        """Flow writing part to its part file, or at its offset of the single file,
+        recording the timings of the request in metrics.
+
+        A part file left by a previous attempt is resumed from its size.
+
+        :return: False if the part file was left complete by a previous run.
+        """
+        start_range, end_range = self.part_range(part, file_info)
+        hasher = part_hasher(file_info)
+        if file_info.get("object_hasher") is not None:
+            # Parts written in order are hashed for the whole object as well
+            hasher = file_info["object_hasher"].part_hasher(start_range, hasher)
+        output = yield self._part_output(part, file_info, hasher)
+        if output is None:
+            raise Return(False)
+        offset = output.pop()
+
+        metrics["started"] = timer()
+        body = yield self._get_part_body(bucket, key, part, file_info, offset=offset)
+        metrics["response"] = timer()
+        written = 0
+        if body is not None:
+            # The manifest must never claim bytes that are not on disk yet.
+            written = yield self._copy_to_file(body, output, hasher, metrics,
+                                               sync=file_info.get("manifest") is not None)
+            metrics["bytes"] = written
+            self._observe_part(metrics)
+        if offset + written != end_range - start_range + 1:
+            raise S3ResumableTruncated("Failed to download part {} of key {}".format(
+                part, key))
+        add_digests(part, file_info, hasher)
+        raise Return(True)
+
+    def _part_output(self, part, file_info, hasher):
+        """Flow of where part is written: the open_output arguments of its file followed
+        by the offset of the part it is resumed from.
+
+        :return: None if the part file was left complete by a previous run.
+        """
+        if "file_path" in file_info:
+            raise Return([file_info["file_path"], "r+b", self.part_range(part, file_info)[0],
+                          0])
+        file_path = file_info["part_path"].format(part=part)
+        offset = yield self.transport.blocking(resume_part_file, self, file_path, part,
+                                               file_info, hasher)
+        if offset is None:
+            raise Return(None)
+        raise Return([file_path, "ab" if offset else "wb", 0, offset])
+
+    # pylint: disable=too-many-arguments
+    def _copy_to_file(self, body, output, hasher=None, metrics=None, sync=True):
+        """Flow copying a response body to the file opened with the open_output arguments
+        in output, synced to disk if sync.
+
+        :return: bytes written.
+        """
+        output_file = yield self.transport.blocking(open_output, *output)
+        try:
+            written = yield self.transport.copy_body(body, output_file, hasher, metrics)
+            if sync:
+                yield self.transport.blocking(sync_file, output_file)
+        finally:
+            output_file.close()
+        raise Return(written)
+
+    def _write_probe(self, file_info):
+        """Flow writing the first bytes of the object requested by _probe_file_info."""
+        body = file_info.pop("probe", None)
+        if body is None:
+            return
+        manifest = file_info["manifest"]
+        kept = manifest.is_complete(0)
+        if not kept and file_info.get("resumed") and "file_path" not in file_info:
+            # Bytes of a part file are trusted only from the run the manifest records
+            kept_size = yield self.transport.blocking(part_file_size,
+                                                      file_info["part_path"].format(part=0))
+            kept = kept_size >= min(self.options.part_size_policy.min_part_size_bytes,
+                                    file_info["content_length"])
+        if kept:
+            # Kept from a previous run, the connection of the unread body is released
+            body.close()
+            return
+        if "file_path" in file_info:
+            whole_hasher = file_info.get("object_hasher")
+            hasher = whole_hasher.part_hasher(0) if whole_hasher is not None else None
+            written = yield self._copy_to_file(body, [file_info["file_path"], "r+b"], hasher)
+            if written > self.part_range(0, file_info)[1]:
+                yield self.transport.blocking(manifest.add, 0)
+        else:
+            # The rest of the part, if any, is requested as for an interrupted part
+            yield self._copy_to_file(body, [file_info["part_path"].format(part=0), "wb"],
+                                     sync=False)
+
+    def _download_probed(self, key, local_file_path, manifest, file_info):
+        """Flow writing an object fully requested by _probe_file_info."""
+        if manifest.header is not None:
+            yield self.transport.blocking(discard_parts, self, local_file_path, manifest)
+            yield self.transport.blocking(manifest.remove)
+        file_path = "{path}.partial".format(path=local_file_path)
+        written = yield self._copy_to_file(file_info.pop("probe"), [file_path, "wb"],
+                                           sync=False)
+        if written != file_info["content_length"]:
+            yield self.transport.blocking(os.remove, file_path)
+            raise S3ResumableDownloadError("Failed to download key {}".format(key))
+        yield self.transport.blocking(os.rename, file_path, local_file_path)
+
+        yield self.transport.publish(file_info, {"part": 1})
+        raise Return(local_file_path)
+
+    def resume_file_info(self, bucket, key, manifest):
+        """Build file information from the manifest of a previous run.
+
+        The object is not requested again: range requests carry the recorded ETag, so
+        a changed object is detected by the first of them.
+
+        :return: file information, None if there is nothing to resume.
+        """
+        header = manifest.load()
+        if header is None or not header.get("etag") or \
+                (header.get("bucket"), header.get("key")) != (bucket, key):
+            return None
+        verify_checksums = self.options.verify_checksums
+        if verify_checksums and "checksums" not in header:
+            # Request the checksums the previous run did not record
+            return None
+        file_info = {"key": key,
+                     "content_length": header["content_length"],
+                     "etag": header["etag"],
+                     "resumed": True}
+        for field in ("checksums", "upload_part_size"):
+            if verify_checksums and field in header:
+                file_info[field] = header[field]
+        self.set_part_size(file_info, header["part_size"], manifest.segments)
+        return file_info
+
+    # pylint: disable=too-many-arguments
+    def prepare_manifest(self, bucket, key, local_file_path, manifest, file_info):
+        """Keep the state of a previous run of the same object version, or start anew."""
+        if manifest.header is not None:
+            if manifest.matches(bucket, key, file_info.get("etag"), file_info["content_length"]):
+                # Keep the part sizes of the previous run so no valid byte is lost
+                self.set_part_size(file_info, manifest.header["part_size"], manifest.segments)
+                file_info["resumed"] = True
+                return
+            discard_parts(self, local_file_path, manifest)
+        manifest.start(bucket, key, file_info)
+
+    def _download_layout(self, bucket, key, local_file_path, file_info):
+        """Flow downloading the parts of file_info to a single file or to part files."""
+        yield self.transport.blocking(check_free_space, self, local_file_path, file_info)
+        file_info.update({"digests": file_info["manifest"].digests,
+                          "object_hasher": object_hasher(file_info)})
+        if self.options.single_file:
+            yield self.transport.blocking(prepare_single_file, bucket, key,
+                                          local_file_path, file_info)
+        else:
+            file_info["part_path"] = "{path}.part{{part}}".format(path=local_file_path)
+        yield self._write_probe(file_info)
+        yield self.transport.fetch_parts(
+            file_info, lambda part: self.download_part(bucket, key, part, file_info),
+            lambda next_part: self.resize_parts(file_info, next_part))
+        # Parts without digests are read again
+        yield self.transport.blocking(verify_object, self, key, local_file_path, file_info)
+        finish = finish_single_file if self.options.single_file else join_parts
+        downloaded_file = yield self.transport.blocking(finish, key, local_file_path,
+                                                        file_info)
+        raise Return(downloaded_file)
+
+    # pylint: disable=too-many-arguments
+    def download_parts(self, bucket, key, download_file, temp_dir, listed_info=None,
+                       target_path=None):
+        """Flow downloading key to download_file in temp_dir, resuming a previous run.
+
+        :return: downloaded file path.
+        """
+        local_file_path = os.path.join(temp_dir, download_file)
+        manifest = ResumeManifest("{path}.manifest".format(path=local_file_path))
+        scheduler = listed_info.pop("scheduler", None) if listed_info else None
+
+        file_info = yield self.transport.blocking(self.resume_file_info, bucket, key, manifest)
+        if file_info is not None:
+            file_info.update({"manifest": manifest, "scheduler": scheduler,
+                              "target_path": target_path})
+            try:
+                downloaded_file = yield self._download_layout(bucket, key, local_file_path,
+                                                              file_info)
+                yield self.transport.blocking(manifest.remove)
+                downloaded_file = yield self.transport.blocking(
+                    self.add_to_cache, file_info, downloaded_file)
+                raise Return(downloaded_file)
+            except S3ResumableChanged:
+                # Overwritten since the previous run, start again from scratch
+                yield self.transport.blocking(manifest.load)
+                listed_info = None
+
+        policy = self.options.part_size_policy
+        verify_checksums = self.options.verify_checksums
+        if listed_info and (not verify_checksums or "checksums" in listed_info):
+            file_info = listed_info
+        elif policy is not None and not verify_checksums:
+            file_info = yield self._probe_file_info(bucket, key)
+            if "probe" in file_info and \
+                    file_info["content_length"] <= policy.min_part_size_bytes:
+                downloaded_file = yield self._download_probed(key, local_file_path, manifest,
+                                                              file_info)
+                downloaded_file = yield self.transport.blocking(
+                    self.add_to_cache, file_info, downloaded_file)
+                raise Return(downloaded_file)
+        else:
+            file_info = yield self.get_file_info(bucket, key)
+        file_info["target_path"] = target_path
+        try:
+            downloaded_file = yield self._download_new(bucket, key, local_file_path, manifest,
+                                                       scheduler, file_info)
+            raise Return(downloaded_file)
+        except S3ResumableChanged:
+            if not file_info.get("cached"):
+                raise
+        # The cached metadata was stale, start again with the current one
+        yield self.transport.blocking(manifest.load)
+        file_info = yield self.get_file_info(bucket, key)
+        file_info["target_path"] = target_path
+        downloaded_file = yield self._download_new(bucket, key, local_file_path, manifest,
+                                                   scheduler, file_info)
+        raise Return(downloaded_file)
+
+    # pylint: disable=too-many-arguments
+    def _download_new(self, bucket, key, local_file_path, manifest, scheduler, file_info):
+        """Flow downloading key with new file information, resuming the parts of the same
+        object."""
+        yield self.transport.blocking(self.prepare_manifest, bucket, key, local_file_path,
+                                      manifest, file_info)
+        file_info.update({"manifest": manifest, "scheduler": scheduler})
+
+        downloaded_file = yield self._download_layout(bucket, key, local_file_path, file_info)
+        yield self.transport.blocking(manifest.remove)
+        downloaded_file = yield self.transport.blocking(self.add_to_cache, file_info,
+                                                        downloaded_file)
+        raise Return(downloaded_file)
+
+    def add_to_cache(self, file_info, downloaded_file):
+        """Add a downloaded file to the cache, with the ETag it was downloaded with."""
+        if self.options.cache is not None and downloaded_file is not None:
+            self.options.cache.put(file_info.get("etag"), file_info["content_length"],
+                                   downloaded_file)
+        return downloaded_file
+
+    def from_cache(self, bucket, key, local_file_path, listed_info):
+        """Flow materializing a key from the cache.
+
+        :return: file information of the key, None if it was found in the cache.
+        """
+        if listed_info is None:
+            # Also used to download the key on a miss
+            listed_info = yield self.get_file_info(bucket, key)
+        found = yield self.transport.blocking(
+            self.options.cache.get, listed_info.get("etag"), listed_info["content_length"],
+            local_file_path)
+        raise Return(None if found else listed_info)
+
+    # pylint: disable=too-many-arguments
+    def download_file(self, bucket, key, download_dir, download_file, temp_dir,
+                      listed_info=None, replace=False):
+        """Flow of S3Resumable.download_file.
+
+        :param listed_info: file information of the key from a listing, defaults to None.
+        :param replace: download the key even if its file exists, defaults to False.
+        """
+        if not temp_dir:
+            temp_dir = download_dir
+
+        yield self.transport.blocking(create_directory_tree, temp_dir)
+        yield self.transport.blocking(create_directory_tree, download_dir)
+
+        local_file_path = os.path.join(download_dir, download_file)
+
+        # The file was already downloaded
+        downloaded = yield self.transport.blocking(os.path.isfile, local_file_path)
+        if downloaded and not replace:
+            raise Return(local_file_path)
+
+        if self.options.cooperative:
+            downloaded_file = yield self.transport.download_cooperatively(
+                self, bucket, key, local_file_path, os.path.join(temp_dir, download_file),
+                listed_info, replace)
+            raise Return(downloaded_file)
+
+        flow = self._download_locked(bucket, key, local_file_path, download_file, temp_dir,
+                                     listed_info, replace)
+        if self.options.coalesce:
+            # Requests of the process for the same file share the download in flight
+            flow = self.transport.coalesce((bucket, key, os.path.abspath(local_file_path)),
+                                           flow, local_file_path)
+        downloaded_file = yield flow
+        raise Return(downloaded_file)
+
+    # pylint: disable=too-many-arguments
+    def _download_locked(self, bucket, key, local_file_path, download_file, temp_dir,
+                         listed_info, replace):
+        """Flow downloading a file holding the lock that avoids other instances to
+        download it."""
+        lock = yield self.transport.acquire_lock(download_file, local_file_path)
+        try:
+            downloaded = yield self.transport.blocking(os.path.isfile, local_file_path)
+            if downloaded and not replace:
+                # Downloaded by the instance holding the lock before
+                raise Return(local_file_path)
+            if self.options.cache is not None:
+                listed_info = yield self.from_cache(bucket, key, local_file_path,
+                                                    listed_info)
+                if listed_info is None:
+                    raise Return(local_file_path)
+                if replace and downloaded:
+                    # May be a hard link to an entry, never written in place
+                    yield self.transport.blocking(os.remove, local_file_path)
+            downloaded_file = yield self.download_parts(bucket, key, download_file, temp_dir,
+                                                        listed_info=listed_info,
+                                                        target_path=local_file_path)
+            if downloaded_file is not None and downloaded_file != local_file_path:
+                yield self.transport.blocking(move_file, downloaded_file, local_file_path)
+        finally:
+            lock.release()
+
+        raise Return(local_file_path)
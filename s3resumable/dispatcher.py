@@ -0,0 +1,135 @@
+# -*- coding: utf-8 -*-
+# Copyright 2020 Immfly.com. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"). You
+# may not use this file except in compliance with the License. A copy of
+# the License is located at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# or in the "license" file accompanying this file. This file is
+# distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF
+# ANY KIND, either express or implied. See the License for the specific
+# language governing permissions and limitations under the License.
+"""Download S3 in parts.
+
+This modules provides the dispatchers delivering the notifications of S3Resumable
+to its observers without blocking the downloads.
+"""
+import collections
+import logging
+import threading
+
+__all__ = ["NotificationDispatcher", "OVERFLOW_POLICIES"]
+
+# What to do with a notification when the queue is full
+OVERFLOW_POLICIES = ("block", "drop_oldest", "coalesce")
+
+LOGGER = logging.getLogger(__name__)
+
+
+class NotificationQueue:
+    """Bounded FIFO of notifications, tagged with the download they belong to.
+
+    When the queue is full, "block" makes the producer wait, "drop_oldest" drops the
+    oldest notification, and "coalesce" replaces the last notification of the same
+    download, or drops the oldest one if there is none. Notifications of a download
+    are always delivered in the order they were put.
+    """
+
+    def __init__(self, max_size, overflow):
+        if int(max_size) < 1:
+            raise ValueError('Invalid value for max_size')
+        if overflow not in OVERFLOW_POLICIES:
+            raise ValueError('Invalid value for overflow')
+        self._max_size = int(max_size)
+        self._overflow = overflow
+        self._queue = collections.deque()
+        self.dropped = 0
+
+    def __len__(self):
+        return len(self._queue)
+
+    def offer(self, download, notification):
+        """Add a notification.
+
+        :return: False if the queue is full and the producer must wait.
+        """
+        if len(self._queue) < self._max_size:
+            self._queue.append((download, notification))
+            return True
+        if self._overflow == "block":
+            return False
+        if self._overflow == "coalesce":
+            for index in range(len(self._queue) - 1, -1, -1):
+                if self._queue[index][0] == download:
+                    self._queue[index] = (download, notification)
+                    self.dropped += 1
+                    return True
+        self._queue.popleft()
+        self._queue.append((download, notification))
+        self.dropped += 1
+        return True
+
+    def pop(self):
+        """Remove and return the oldest notification."""
+        return self._queue.popleft()[1]
+
+
+class NotificationDispatcher:
+    """Delivers notifications to observers from a background thread.
+
+    The thread is started when notifications are queued and ends when the queue is
+    empty, so idle instances hold no thread.
+    """
+
+    def __init__(self, notify, max_size=1000, overflow="block"):
+        """Class initializator.
+
+        :param notify: function delivering a notification to the observers.
+        :param max_size: maximum notifications queued, defaults to 1000.
+        :param overflow: policy when the queue is full: block, drop_oldest or coalesce,
+            defaults to block.
+        """
+        self._notify = notify
+        self._queue = NotificationQueue(max_size, overflow)
+        self._condition = threading.Condition()
+        self._thread = None
+
+    @property
+    def dropped(self):
+        """Notifications dropped or coalesced because the queue was full."""
+        return self._queue.dropped
+
+    def put(self, download, notification):
+        """Queue a notification of download, applying the overflow policy if the queue is
+        full."""
+        with self._condition:
+            while not self._queue.offer(download, notification):
+                self._condition.wait()
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run)
+                self._thread.daemon = True
+                self._thread.start()
+            self._condition.notify_all()
+
+    def join(self):
+        """Wait until every queued notification is delivered."""
+        with self._condition:
+            while self._thread is not None:
+                self._condition.wait()
+
+    def _run(self):
+        while True:
+            with self._condition:
+                if not self._queue:
+                    self._thread = None
+                    self._condition.notify_all()
+                    return
+                notification = self._queue.pop()
+                self._condition.notify_all()
+            try:
+                self._notify(notification)
+            except Exception:  # pylint: disable=broad-except
+                # Observers can't fail the downloads
+                LOGGER.exception("Failed to notify observers")
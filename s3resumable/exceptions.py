@@ -17,7 +17,8 @@ This modules provides exceptions classes for S3Resumable.
 """
 
 __all__ = ["S3ResumableError", "S3ResumableIncompatible", "S3ResumableDownloadError",
-           "S3ResumableBloqued"]
+           "S3ResumableBloqued", "S3ResumableChanged", "S3ResumableTruncated",
+           "S3ResumableChecksumMismatch", "S3ResumableNoSpace", "S3ResumableExtractError"]
 
 
 class S3ResumableError(Exception):
@@ -34,3 +35,23 @@ class S3ResumableDownloadError(S3ResumableError):
 
 class S3ResumableBloqued(S3ResumableError):
     """Another instance is downloading the same file."""
+
+
+class S3ResumableChanged(S3ResumableDownloadError):
+    """The key was overwritten while it was being downloaded."""
+
+
+class S3ResumableTruncated(S3ResumableDownloadError):
+    """The body of a part ended before the end of its range."""
+
+
+class S3ResumableChecksumMismatch(S3ResumableDownloadError):
+    """The downloaded bytes don't match the ETag or the checksums of the key."""
+
+
+class S3ResumableNoSpace(S3ResumableError):
+    """The filesystems lack the free space needed to download the key."""
+
+
+class S3ResumableExtractError(S3ResumableError):
+    """The key can't be decompressed or extracted."""
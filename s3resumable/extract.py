@@ -0,0 +1,367 @@
+# -*- coding: utf-8 -*-
+# Copyright 2020 Immfly.com. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"). You
+# may not use this file except in compliance with the License. A copy of
+# the License is located at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# or in the "license" file accompanying this file. This file is
+# distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF
+# ANY KIND, either express or implied. See the License for the specific
+# language governing permissions and limitations under the License.
+"""Download S3 in parts.
+
+This modules provides the decompression and archive extraction stages that
+S3Resumable applies to objects in order while their next parts are downloaded.
+"""
+from __future__ import absolute_import
+
+import bz2
+import hashlib
+import io
+import json
+import os
+import tarfile
+import zlib
+
+from botocore.compat import six
+
+try:
+    import lzma
+except ImportError:  # pragma: no cover
+    lzma = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+from .exceptions import S3ResumableExtractError
+from .manifest import Journal
+from .stream import ChunkReader, stream_key
+from .utils import create_directory_tree
+
+__all__ = ["ExtractCheckpoint", "archive_compression", "available_compressions",
+           "checkpoint_path", "compression_of", "decompress_chunks", "decompress_key",
+           "extract_key", "member_path"]
+
+# Bytes of decompressed output written between checkpoints
+EXTRACT_CHECKPOINT_BYTES = 64 * 1000 * 1000
+# Arguments extracting archive members with the safe filter of tarfile, when available
+EXTRACT_KWARGS = {"filter": "data"} if hasattr(tarfile, "data_filter") else {}
+
+# Compression of objects by suffix
+COMPRESSION_SUFFIXES = {".gz": "gzip", ".bz2": "bz2", ".xz": "xz", ".zst": "zstd"}
+# Compression of tar archives by suffix
+ARCHIVE_SUFFIXES = {".tar": None, ".tgz": "gzip", ".tbz2": "bz2", ".txz": "xz",
+                    ".tzst": "zstd"}
+
+
+def _decompressor_factories():
+    factories = {"gzip": lambda: zlib.decompressobj(16 + zlib.MAX_WBITS),
+                 "bz2": bz2.BZ2Decompressor}
+    if lzma is not None:
+        factories["xz"] = lzma.LZMADecompressor
+    if zstandard is not None:
+        factories["zstd"] = lambda: zstandard.ZstdDecompressor().decompressobj()
+    return factories
+
+
+# Functions creating a decompressor of one stream, by compression
+DECOMPRESSOR_FACTORIES = _decompressor_factories()
+# Errors raised by decompressors on corrupt data
+DECOMPRESS_ERRORS = tuple([EOFError, IOError, OSError, ValueError, zlib.error] +
+                          ([lzma.LZMAError] if lzma is not None else []) +
+                          ([zstandard.ZstdError] if zstandard is not None else []))
+
+
+def available_compressions():
+    """Compressions that can be decompressed with the modules installed."""
+    return set(DECOMPRESSOR_FACTORIES)
+
+
+def compression_of(name):
+    """Compression of a file name by its suffix, and the name without it.
+
+    :return: compression, None if the name has no known suffix, and the name.
+    """
+    for suffix, compression in COMPRESSION_SUFFIXES.items():
+        if name.endswith(suffix) and len(name) > len(suffix):
+            return compression, name[:-len(suffix)]
+    return None, name
+
+
+def archive_compression(name):
+    """Compression of a tar archive by the suffix of its name.
+
+    :raises ValueError: the name is not the one of a tar archive.
+    """
+    for suffix, compression in ARCHIVE_SUFFIXES.items():
+        if name.endswith(suffix):
+            return compression
+    compression, archive_name = compression_of(name)
+    if compression is not None and archive_name.endswith(".tar"):
+        return compression
+    raise ValueError("{} is not a tar archive".format(name))
+
+
+def decompress_chunks(chunks, compression):
+    """Generate the decompressed bytes of an iterator of compressed byte strings.
+
+    Concatenated streams are decompressed one after another, like gzip and bzip2 do.
+
+    :raises S3ResumableExtractError: the data is corrupt or truncated.
+    """
+    if compression not in DECOMPRESSOR_FACTORIES:
+        raise ValueError("Unsupported compression {}".format(compression))
+    factory = DECOMPRESSOR_FACTORIES[compression]
+    decompressor = factory()
+    finished = False
+    for data in chunks:
+        while data:
+            if finished:
+                # The data after a stream starts another one
+                decompressor = factory()
+            try:
+                output = decompressor.decompress(data)
+            except DECOMPRESS_ERRORS as exc:
+                six.raise_from(S3ResumableExtractError("Can't decompress {} data: {}".format(
+                    compression, exc)), exc)
+            if output:
+                yield output
+            # Decompressors without eof keep the data after their stream unused
+            unused_data = getattr(decompressor, "unused_data", b"")
+            finished = getattr(decompressor, "eof", bool(unused_data))
+            data = unused_data if finished else b""
+    if not finished and hasattr(decompressor, "eof"):
+        raise S3ResumableExtractError("Truncated {} data".format(compression))
+
+
+def member_path(extract_dir, member):
+    """Path of an archive member extracted into extract_dir.
+
+    :raises S3ResumableExtractError: the member or its link would be outside of
+        extract_dir.
+    """
+    root = os.path.realpath(extract_dir)
+    path = os.path.realpath(os.path.join(root, member.name))
+    targets = [path]
+    if member.issym():
+        targets.append(os.path.realpath(os.path.join(os.path.dirname(path),
+                                                     member.linkname)))
+    elif member.islnk():
+        targets.append(os.path.realpath(os.path.join(root, member.linkname)))
+    for target in targets:
+        if target != root and not target.startswith(root + os.sep):
+            raise S3ResumableExtractError("Member {} is outside of {}".format(
+                member.name, extract_dir))
+    return path
+
+
+class ExtractCheckpoint:
+    """Journal of a decompression or extraction stored next to the parts of its object.
+
+    The first line records the ETag and content length of the object, and every
+    following line the bytes of output written and synced, or an extracted member
+    with its size. A new object version starts a new journal.
+    """
+
+    def __init__(self, path):
+        self._journal = Journal(path)
+        self._header = None
+        self._written = 0
+        self._members = {}
+
+    @property
+    def path(self):
+        """Path of the checkpoint file."""
+        return self._journal.path
+
+    @property
+    def written(self):
+        """Bytes of output written and synced."""
+        return self._written
+
+    def extracted(self, name, size):
+        """Check if the member name of size was extracted."""
+        return self._members.get(name) == size
+
+    def load(self):
+        """Load the checkpoint from disk.
+
+        :return: the checkpoint header, None if there is no valid checkpoint.
+        :rtype: dict
+        """
+        self._header = None
+        self._written = 0
+        self._members = {}
+        self._header, entries = self._journal.read()
+        for entry in entries:
+            if "written" in entry:
+                self._written = entry["written"]
+            elif "member" in entry:
+                self._members[entry["member"]] = entry["size"]
+        return self._header
+
+    def matches(self, etag, content_length):
+        """Check if the checkpoint belongs to the given object version."""
+        return self._header is not None and etag is not None and \
+            self._header.get("etag") == etag and \
+            self._header.get("content_length") == content_length
+
+    def start(self, etag, content_length):
+        """Discard any previous state and write a new header for the object version."""
+        self._header = {"etag": etag, "content_length": content_length}
+        self._written = 0
+        self._members = {}
+        self._journal.start(self._header)
+
+    def add_written(self, written):
+        """Record the bytes of output written and synced."""
+        self._journal.append({"written": written})
+        self._written = written
+
+    def add_member(self, name, size):
+        """Record an extracted member."""
+        self._journal.append({"member": name, "size": size})
+        self._members[name] = size
+
+    def remove(self):
+        """Remove the checkpoint file."""
+        self._journal.remove()
+
+
+def checkpoint_path(temp_dir, bucket, key, target):
+    """Path in temp_dir of the checkpoint of the decompression or extraction of a key to
+    target, a file or a directory.
+
+    Like the resume manifest is named after the file it downloads, the checkpoint is
+    keyed on its target, so keys with the same name don't share checkpoints.
+    """
+    target_id = json.dumps([bucket, key, os.path.abspath(target)])
+    return os.path.join(temp_dir, "{}.{}.checkpoint".format(
+        os.path.basename(key), hashlib.md5(target_id.encode("utf-8")).hexdigest()))
+
+
+# pylint: disable=too-many-arguments,too-many-locals
+def decompress_key(core, bucket, key, download_dir, download_file, temp_dir, compression,
+                   readahead):
+    """Decompress a key in order while its next parts are downloaded, see
+    S3Resumable.decompress_file."""
+    readahead = core.get_readahead(readahead)
+    key_compression, name = compression_of(os.path.basename(key))
+    compression = compression or key_compression
+    if compression not in available_compressions():
+        raise ValueError("Unsupported compression of key {}".format(key))
+    temp_dir = temp_dir or download_dir
+    create_directory_tree(download_dir)
+    local_file_path = os.path.join(download_dir, download_file or name)
+
+    # The file was already decompressed
+    if os.path.isfile(local_file_path):
+        return local_file_path
+
+    output_path = "{path}.extracting".format(path=local_file_path)
+    checkpoint = ExtractCheckpoint(checkpoint_path(temp_dir, bucket, key, local_file_path))
+    state = {}
+
+    def started(file_info):
+        etag, content_length = file_info.get("etag"), file_info["content_length"]
+        checkpoint.load()
+        if not checkpoint.matches(etag, content_length) or \
+                not os.path.isfile(output_path) or \
+                os.path.getsize(output_path) < checkpoint.written:
+            checkpoint.start(etag, content_length)
+        output = open(output_path, "ab")
+        # Bytes written after the last checkpoint are written again
+        output.truncate(checkpoint.written)
+        state.update({"output": output, "skip": checkpoint.written})
+
+    chunks = stream_key(core, bucket, key, temp_dir, os.path.basename(key), readahead,
+                        started=started)
+    try:
+        written = 0
+        for data in decompress_chunks(chunks, compression):
+            output, skip = state["output"], state["skip"]
+            if written + len(data) > skip:
+                output.write(data[max(0, skip - written):])
+            written += len(data)
+            if written - checkpoint.written >= EXTRACT_CHECKPOINT_BYTES:
+                output.flush()
+                os.fsync(output.fileno())
+                checkpoint.add_written(written)
+        output = state["output"]
+        output.flush()
+        os.fsync(output.fileno())
+    finally:
+        chunks.close()
+        if "output" in state:
+            state["output"].close()
+    os.rename(output_path, local_file_path)
+    checkpoint.remove()
+    return local_file_path
+
+
+# pylint: disable=too-many-arguments
+def extract_key(core, bucket, key, extract_dir, temp_dir, compression, readahead):
+    """Extract the members of a tar archive in order while its next parts are downloaded,
+    see S3Resumable.extract_archive."""
+    readahead = core.get_readahead(readahead)
+    if compression is None:
+        compression = archive_compression(os.path.basename(key))
+    elif compression == "none":
+        compression = None
+    if compression is not None and compression not in available_compressions():
+        raise ValueError("Unsupported compression of key {}".format(key))
+    temp_dir = temp_dir or extract_dir
+    create_directory_tree(extract_dir)
+    checkpoint = ExtractCheckpoint(checkpoint_path(temp_dir, bucket, key, extract_dir))
+
+    def started(file_info):
+        etag, content_length = file_info.get("etag"), file_info["content_length"]
+        checkpoint.load()
+        if not checkpoint.matches(etag, content_length):
+            checkpoint.start(etag, content_length)
+
+    chunks = stream_key(core, bucket, key, temp_dir, os.path.basename(key), readahead,
+                        started=started)
+    data = decompress_chunks(chunks, compression) if compression else chunks
+    chunk_size_bytes = core.options.chunk_size_bytes
+    reader = io.BufferedReader(ChunkReader(data), buffer_size=chunk_size_bytes)
+    try:
+        extracted = _extract_members(reader, extract_dir, checkpoint)
+        # Read the padding after the archive, so the stream ends and is verified
+        while reader.read(chunk_size_bytes):
+            pass
+    except tarfile.TarError as exc:
+        six.raise_from(S3ResumableExtractError("Can't extract key {}: {}".format(key, exc)),
+                       exc)
+    finally:
+        reader.close()
+        chunks.close()
+    checkpoint.remove()
+    return extracted
+
+
+def _extract_members(reader, extract_dir, checkpoint):
+    extracted = []
+    with tarfile.open(fileobj=reader, mode="r|") as archive:
+        for member in archive:
+            path = member_path(extract_dir, member)
+            if not (member.isfile() or member.isdir() or member.issym() or
+                    member.islnk()):
+                continue
+            if member.isfile() and checkpoint.extracted(member.name, member.size) and \
+                    os.path.isfile(path) and os.path.getsize(path) == member.size:
+                # Extracted before the previous run was interrupted
+                extracted.append(path)
+                continue
+            archive.extract(member, extract_dir, **EXTRACT_KWARGS)
+            if member.isfile():
+                with open(path, "rb") as member_file:
+                    os.fsync(member_file.fileno())
+                checkpoint.add_member(member.name, member.size)
+            extracted.append(path)
+    return extracted
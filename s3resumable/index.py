@@ -0,0 +1,158 @@
+# -*- coding: utf-8 -*-
+# Copyright 2020 Immfly.com. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"). You
+# may not use this file except in compliance with the License. A copy of
+# the License is located at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# or in the "license" file accompanying this file. This file is
+# distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF
+# ANY KIND, either express or implied. See the License for the specific
+# language governing permissions and limitations under the License.
+"""Download S3 in parts.
+
+This modules provides the local index of downloaded objects used by S3Resumable to
+sync prefixes without requesting the objects that did not change.
+"""
+import calendar
+import os
+import sqlite3
+import threading
+
+__all__ = ["SyncIndex"]
+
+# Changes written to the index before committing them
+COMMIT_INTERVAL = 1000
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS objects (
+    bucket TEXT NOT NULL,
+    key TEXT NOT NULL,
+    etag TEXT,
+    size INTEGER NOT NULL,
+    last_modified TEXT,
+    local_path TEXT NOT NULL,
+    PRIMARY KEY (bucket, key)
+)
+"""
+
+
+def _timestamp(last_modified):
+    """Seconds since the epoch of a LastModified datetime, None if unknown."""
+    if not hasattr(last_modified, "utctimetuple"):
+        return None
+    return calendar.timegm(last_modified.utctimetuple())
+
+
+def _text(last_modified):
+    if last_modified is None:
+        return None
+    if hasattr(last_modified, "isoformat"):
+        return last_modified.isoformat()
+    return str(last_modified)
+
+
+class SyncIndex:
+    """SQLite index of the ETag, size, LastModified and local path of downloaded keys.
+
+    A listed key is unchanged when its ETag and size match the ones indexed and its
+    local file is still there with the same size. Files downloaded without the index,
+    or whose changes were not committed, are adopted when their size matches and they
+    are not older than the object, like aws s3 sync does.
+
+    Changes are committed every COMMIT_INTERVAL keys and by flush and close; losing
+    them only means those files are adopted again on the next sync.
+    """
+
+    def __init__(self, path):
+        """Class initializator.
+
+        :param path: path of the SQLite database, created if it does not exist.
+        """
+        self._path = path
+        self._lock = threading.Lock()
+        self._pending = 0
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute("PRAGMA synchronous=NORMAL")
+        self._connection.execute(SCHEMA)
+        self._connection.commit()
+
+    @property
+    def path(self):
+        """Path of the SQLite database."""
+        return self._path
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def get(self, bucket, key):
+        """Indexed ETag, size, LastModified and local path of a key.
+
+        :return: dict with the indexed values, None if the key is not indexed.
+        """
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT etag, size, last_modified, local_path FROM objects "
+                "WHERE bucket = ? AND key = ?", (bucket, key)).fetchone()
+        if row is None:
+            return None
+        return dict(zip(("etag", "size", "last_modified", "local_path"), row))
+
+    def unchanged(self, bucket, listed, local_file_path):
+        """Whether the local file of a list_objects_v2 entry is up to date.
+
+        :param bucket: s3 bucket.
+        :param listed: list_objects_v2 entry of the key.
+        :param local_file_path: path the key is downloaded to.
+        """
+        size = int(listed["Size"])
+        try:
+            stat = os.stat(local_file_path)
+        except OSError:
+            return False
+        if stat.st_size != size:
+            return False
+
+        entry = self.get(bucket, listed["Key"])
+        if entry is not None:
+            return (entry["etag"] == listed.get("ETag") and entry["size"] == size and
+                    entry["local_path"] == local_file_path)
+
+        # Adopt files downloaded before the index existed
+        last_modified = _timestamp(listed.get("LastModified"))
+        if last_modified is None or stat.st_mtime < last_modified:
+            return False
+        self.update(bucket, listed, local_file_path)
+        return True
+
+    def update(self, bucket, listed, local_file_path):
+        """Index the local file of a downloaded list_objects_v2 entry."""
+        with self._lock:
+            self._connection.execute(
+                "INSERT OR REPLACE INTO objects VALUES (?, ?, ?, ?, ?, ?)",
+                (bucket, listed["Key"], listed.get("ETag"), int(listed["Size"]),
+                 _text(listed.get("LastModified")), local_file_path))
+            self._pending += 1
+            if self._pending >= COMMIT_INTERVAL:
+                self._commit()
+
+    def flush(self):
+        """Commit the changes to the index."""
+        with self._lock:
+            self._commit()
+
+    def close(self):
+        """Commit the changes and close the index."""
+        with self._lock:
+            self._commit()
+            self._connection.close()
+
+    def _commit(self):
+        self._connection.commit()
+        self._pending = 0
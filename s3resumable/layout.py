@@ -0,0 +1,202 @@
+# -*- coding: utf-8 -*-
+# Copyright 2020 Immfly.com. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"). You
+# may not use this file except in compliance with the License. A copy of
+# the License is located at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# or in the "license" file accompanying this file. This file is
+# distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF
+# ANY KIND, either express or implied. See the License for the specific
+# language governing permissions and limitations under the License.
+"""Download S3 in parts.
+
+This modules provides the steps of S3Resumable and AsyncS3Resumable on the local
+files of a download: its part files or its single file, and the space they need.
+They block on the filesystem, so flows run them through their transport.
+"""
+from __future__ import absolute_import
+
+import os
+
+from .exceptions import S3ResumableDownloadError, S3ResumableNoSpace
+from .utils import copy_fileobj, free_space, preallocate_file
+
+__all__ = ["check_free_space", "check_part_size", "discard_parts", "finish_single_file",
+           "join_parts", "open_output", "part_file_size", "prepare_single_file",
+           "resume_part_file"]
+
+
+def check_part_size(core, file_part, part, file_info):
+    """Check if the part file of part is complete."""
+    if not os.path.isfile(file_part):
+        return False
+    start_range, end_range = core.part_range(part, file_info)
+    return os.path.getsize(file_part) == end_range - start_range + 1
+
+
+def part_file_size(file_part):
+    """Size of a part file, 0 if it does not exist."""
+    return os.path.getsize(file_part) if os.path.isfile(file_part) else 0
+
+
+def resume_part_file(core, file_part, part, file_info, hasher):
+    """Offset a part file is resumed from, hashing the bytes before it.
+
+    A part file longer than its part is truncated when the manifest kept from a
+    previous run confirms the part sizes: bytes beyond the part size can't belong
+    to the part, but the ones before are still valid. Otherwise the part file may
+    have been written with another part size, so it is downloaded again.
+
+    :return: size of the part file, None if it is complete.
+    """
+    if check_part_size(core, file_part, part, file_info):
+        return None
+    if not os.path.isfile(file_part):
+        return 0
+    start_range, end_range = core.part_range(part, file_info)
+    part_length = end_range - start_range + 1
+    offset = os.path.getsize(file_part)
+    if offset > part_length:
+        if not file_info.get("resumed"):
+            os.remove(file_part)
+            return 0
+        with open(file_part, "r+b") as part_buffer:
+            part_buffer.truncate(part_length)
+        return None
+    if hasher is not None and offset:
+        with open(file_part, "rb") as part_file:
+            hasher.update_file(part_file, offset)
+    return offset
+
+
+def open_output(file_path, mode, position=0):
+    """Open the file a part body is written to, at position."""
+    output = open(file_path, mode)
+    if position:
+        output.seek(position)
+    return output
+
+
+def prepare_single_file(bucket, key, local_file_path, file_info):
+    """Preallocate the single file of a download, unless a previous run did."""
+    content_length = file_info["content_length"]
+    manifest = file_info["manifest"]
+    file_path = "{path}.partial".format(path=local_file_path)
+    file_info.update({"file_path": file_path})
+
+    # Resumable download
+    if not os.path.isfile(file_path) or os.path.getsize(file_path) != content_length:
+        with open(file_path, "wb") as result_file:
+            preallocate_file(result_file.fileno(), content_length)
+        if manifest.completed:
+            manifest.start(bucket, key, file_info)
+            file_info["digests"] = {}
+
+
+def finish_single_file(key, local_file_path, file_info):
+    """Rename the single file of a download once every part is written."""
+    file_path = file_info["file_path"]
+    if os.path.getsize(file_path) != file_info["content_length"] or \
+            len(file_info["manifest"].completed) != file_info["total_parts"]:
+        raise S3ResumableDownloadError("Failed to download key {}".format(key))
+    os.rename(file_path, local_file_path)
+    return local_file_path
+
+
+def _space_needed(core, local_file_path, file_info):
+    """Bytes the layout of a download needs in temp_dir at its peak, less the ones a
+    previous run left."""
+    content_length = file_info["content_length"]
+    if core.options.single_file:
+        file_path = "{path}.partial".format(path=local_file_path)
+        if os.path.isfile(file_path):
+            # Preallocated by a previous run
+            return content_length - min(os.path.getsize(file_path), content_length)
+        return content_length
+    part_lengths = [end_range - start_range + 1 for start_range, end_range in
+                    (core.part_range(part, file_info)
+                     for part in range(file_info["total_parts"]))]
+    needed = content_length + max(part_lengths)
+    manifest = file_info["manifest"]
+    for part, part_length in enumerate(part_lengths):
+        if manifest.is_complete(part):
+            # Downloaded by a previous run
+            needed -= part_length
+    return needed
+
+
+def check_free_space(core, local_file_path, file_info):
+    """Check up front that the filesystems have the space the layout needs at its peak.
+
+    Part files need the object and its largest part while they are joined, and
+    single files the object. A target in another filesystem needs a copy.
+
+    :raises S3ResumableNoSpace: a filesystem lacks free space.
+    """
+    temp_dir = os.path.dirname(local_file_path) or "."
+    needs = [(temp_dir, _space_needed(core, local_file_path, file_info))]
+    target_path = file_info.get("target_path")
+    if target_path and target_path != local_file_path:
+        target_dir = os.path.dirname(target_path) or "."
+        if os.stat(target_dir).st_dev != os.stat(temp_dir).st_dev:
+            needs.append((target_dir, file_info["content_length"]))
+    for path, size in needs:
+        available = free_space(path)
+        if available is not None and available < size:
+            raise S3ResumableNoSpace(
+                "Key {} needs {} bytes in {}, {} are free".format(
+                    file_info["key"], size, path, available))
+
+
+def join_parts(key, local_file_path, file_info):
+    """Concatenate the part files of a download, removing them."""
+    total_parts = file_info["total_parts"]
+    content_length = file_info["content_length"]
+    part_path = file_info["part_path"]
+
+    # Concatenate parts
+    written = 0
+    with open(local_file_path, "wb") as result_file:
+        # Reserve the blocks at once, so the file is contiguous, when there is room for
+        # it besides the parts. Otherwise it grows as each part is removed, within the
+        # peak checked by check_free_space.
+        available = free_space(os.path.dirname(local_file_path) or ".")
+        preallocated = available is not None and available >= content_length
+        if preallocated:
+            preallocate_file(result_file.fileno(), content_length)
+        for part in range(total_parts):
+            file_part = part_path.format(part=part)
+            try:
+                with open(file_part, "rb") as part_file:
+                    written += copy_fileobj(part_file, result_file)
+            finally:
+                if os.path.exists(file_part):
+                    os.remove(file_part)
+        if preallocated:
+            # Short parts must not be hidden by the reserved size
+            result_file.truncate(written)
+
+    # Check file size
+    if os.path.getsize(local_file_path) != content_length:
+        os.remove(local_file_path)
+        raise S3ResumableDownloadError("Failed to download key {}".format(key))
+
+    return local_file_path
+
+
+def discard_parts(core, local_file_path, manifest):
+    """Remove parts left by a download of another object or object version."""
+    header = manifest.header
+    if header.get("content_length") and header.get("part_size"):
+        stale_info = {"content_length": header["content_length"]}
+        core.set_part_size(stale_info, header["part_size"], manifest.segments)
+        for part in range(stale_info["total_parts"]):
+            file_part = "{path}.part{part}".format(path=local_file_path, part=part)
+            if os.path.exists(file_part):
+                os.remove(file_part)
+    file_path = "{path}.partial".format(path=local_file_path)
+    if os.path.exists(file_path):
+        os.remove(file_path)
@@ -0,0 +1,218 @@
+# -*- coding: utf-8 -*-
+# Copyright 2020 Immfly.com. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"). You
+# may not use this file except in compliance with the License. A copy of
+# the License is located at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# or in the "license" file accompanying this file. This file is
+# distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF
+# ANY KIND, either express or implied. See the License for the specific
+# language governing permissions and limitations under the License.
+"""Download S3 in parts.
+
+This modules provides the leases of parts used by S3Resumable to download an object
+from several processes or hosts sharing its temporary directory.
+"""
+import errno
+import os
+import socket
+import threading
+import time
+import uuid
+
+from .utils import remove_if_exists
+
+__all__ = ["PartLeases"]
+
+
+class PartLeases:
+    """Leases of the parts of a download, kept as files next to the part files.
+
+    A lease is a file created exclusively with the owner in it, renewed by touching it
+    every third of ttl while it is held. Leases not renewed for ttl seconds belong to
+    dead workers and are taken over. Workers write their parts to files of their own
+    and rename them when complete, so a part file is never written by two workers.
+    Hosts sharing the directory must have their clocks synchronized well within ttl.
+    """
+
+    def __init__(self, part_path, ttl=60, owner=None):
+        """Class initializator.
+
+        :param part_path: path of the part files, with a {part} field.
+        :param ttl: seconds after which a lease not renewed expires, defaults to 60.
+        :param owner: unique name of the worker, defaults to host, pid and a random id.
+        """
+        if ttl <= 0:
+            raise ValueError('Invalid value for ttl')
+        self._part_path = part_path
+        self._ttl = ttl
+        self._owner = owner or "{}-{}-{}".format(socket.gethostname(), os.getpid(),
+                                                 uuid.uuid4().hex[:8])
+        self._held = set()
+        self._lock = threading.Lock()
+        # Thread renewing the held leases and the event stopping it
+        self._renewal = None
+        self._error = None
+
+    @property
+    def owner(self):
+        """Unique name of the worker."""
+        return self._owner
+
+    @property
+    def owner_part_path(self):
+        """Path of the part files being written by this worker, with a {part} field."""
+        return "{path}.{owner}".format(path=self._part_path, owner=self._owner)
+
+    def lease_path(self, part):
+        """Path of the lease of part."""
+        return "{path}.lease".format(path=self._part_path.format(part=part))
+
+    def __enter__(self):
+        self._error = None
+        stop = threading.Event()
+        thread = threading.Thread(target=self._renew, args=(stop,))
+        thread.daemon = True
+        thread.start()
+        self._renewal = (thread, stop)
+        return self
+
+    def __exit__(self, *args):
+        thread, stop = self._renewal
+        stop.set()
+        thread.join()
+        self._renewal = None
+        for part in list(self._held):
+            self.release(part)
+        if args[0] is None:
+            self._raise_error()
+
+    def acquire(self, part):
+        """Lease part, taking the lease over if it expired.
+
+        The part file left by the previous owner of an expired lease is removed.
+
+        :return: False if another worker holds the lease.
+        :raises OSError: the error that stopped the renewal of the leases.
+        """
+        self._raise_error()
+        if not self._create(self.lease_path(part)) and not self._take_over(part):
+            return False
+        with self._lock:
+            self._held.add(part)
+        return True
+
+    def held(self, part):
+        """Whether the lease of part is still held, False if it was taken over.
+
+        The lease file is read, so a take over is seen before it is renewed.
+
+        :raises OSError: the error that stopped the renewal of the leases.
+        """
+        self._raise_error()
+        with self._lock:
+            if part not in self._held:
+                return False
+        return self._read_owner(self.lease_path(part)) == self._owner
+
+    def release(self, part):
+        """Release the lease of part."""
+        with self._lock:
+            if part not in self._held:
+                return
+            self._held.discard(part)
+        path = self.lease_path(part)
+        if self._read_owner(path) == self._owner:
+            remove_if_exists(path)
+
+    def _create(self, path):
+        try:
+            lease_fd = os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY, 0o644)
+        except OSError as exc:
+            if exc.errno == errno.EEXIST:
+                return False
+            raise
+        try:
+            os.write(lease_fd, self._owner.encode("utf-8"))
+        finally:
+            os.close(lease_fd)
+        return True
+
+    def _expired(self, path):
+        try:
+            return time.time() - os.stat(path).st_mtime > self._ttl
+        except OSError as exc:
+            if exc.errno == errno.ENOENT:
+                return False
+            raise
+
+    def _take_over(self, part):
+        path = self.lease_path(part)
+        if not self._expired(path):
+            return False
+        # Only one of the workers renaming the lease succeeds
+        stale_path = "{path}.{owner}.stale".format(path=path, owner=self._owner)
+        try:
+            os.rename(path, stale_path)
+        except OSError as exc:
+            if exc.errno == errno.ENOENT:
+                return False
+            raise
+        if not self._expired(stale_path):
+            # Another worker took it over in the meantime, give it back
+            try:
+                os.link(stale_path, path)
+            except OSError as exc:
+                if exc.errno != errno.EEXIST:
+                    raise
+            remove_if_exists(stale_path)
+            return False
+        previous_owner = self._read_owner(stale_path)
+        remove_if_exists(stale_path)
+        if not self._create(path):
+            return False
+        if previous_owner and previous_owner != self._owner and os.sep not in previous_owner:
+            remove_if_exists("{path}.{owner}".format(path=self._part_path.format(part=part),
+                                                     owner=previous_owner))
+        return True
+
+    def _raise_error(self):
+        if self._error is not None:
+            raise self._error
+
+    def _renew(self, stop):
+        try:
+            self._renew_held(stop)
+        except Exception as exc:  # pylint: disable=broad-except
+            # Raised in the thread downloading the parts, whose leases would expire
+            self._error = exc
+
+    def _renew_held(self, stop):
+        while not stop.wait(self._ttl / 3.0):
+            with self._lock:
+                held = list(self._held)
+            for part in held:
+                path = self.lease_path(part)
+                if self._read_owner(path) != self._owner:
+                    # Taken over by another worker
+                    with self._lock:
+                        self._held.discard(part)
+                    continue
+                try:
+                    os.utime(path, None)
+                except OSError as exc:
+                    if exc.errno != errno.ENOENT:
+                        raise
+
+    @staticmethod
+    def _read_owner(path):
+        try:
+            with open(path, "rb") as lease_file:
+                return lease_file.read().decode("utf-8")
+        except (IOError, OSError) as exc:
+            if exc.errno == errno.ENOENT:
+                return None
+            raise
@@ -0,0 +1,190 @@
+# -*- coding: utf-8 -*-
+# Copyright 2020 Immfly.com. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"). You
+# may not use this file except in compliance with the License. A copy of
+# the License is located at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# or in the "license" file accompanying this file. This file is
+# distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF
+# ANY KIND, either express or implied. See the License for the specific
+# language governing permissions and limitations under the License.
+"""Download S3 in parts.
+
+This modules provides the resume manifest used by S3Resumable to record which
+object version the parts come from and which parts are complete, and the journal
+file it is stored in.
+"""
+import json
+import os
+import threading
+
+__all__ = ["Journal", "ResumeManifest"]
+
+
+class Journal:
+    """File of JSON lines, a header followed by entries.
+
+    Lines are only appended, and synced to disk as they are written, so an
+    interrupted write can at most lose the last entry.
+    """
+
+    def __init__(self, path):
+        self._path = path
+
+    @property
+    def path(self):
+        """Path of the journal file."""
+        return self._path
+
+    def read(self):
+        """Read the header and entries of the journal, skipping a torn last entry.
+
+        :return: the header, None if there is no journal, and the list of entries.
+        :rtype: tuple
+        """
+        if not os.path.isfile(self._path):
+            return None, []
+        entries = []
+        with open(self._path, "r") as journal_file:
+            for line in journal_file:
+                try:
+                    entries.append(json.loads(line))
+                except ValueError:
+                    # Torn write of the last entry
+                    continue
+        return (entries[0], entries[1:]) if entries else (None, [])
+
+    def start(self, header):
+        """Write a new journal with header, discarding the previous one."""
+        self._write("w", header)
+
+    def append(self, entry):
+        """Append entry to the journal."""
+        self._write("a", entry)
+
+    def _write(self, mode, entry):
+        with open(self._path, mode) as journal_file:
+            journal_file.write(json.dumps(entry) + "\n")
+            journal_file.flush()
+            os.fsync(journal_file.fileno())
+
+    def remove(self):
+        """Remove the journal file."""
+        if os.path.exists(self._path):
+            os.remove(self._path)
+
+
+class ResumeManifest:
+    """Journal of a download stored next to its parts.
+
+    The first line is a header with the object, ETag, content length and part size
+    of the download, and every following line records a completed part, with its
+    digests when checksums are verified, or a new size for the parts not started
+    yet. Lines are only appended, so an interrupted write can at most lose the last
+    part recorded.
+    """
+
+    def __init__(self, path):
+        self._journal = Journal(path)
+        self._header = None
+        self._completed = set()
+        self._digests = {}
+        self._segments = []
+        self._lock = threading.Lock()
+
+    @property
+    def path(self):
+        """Path of the manifest file."""
+        return self._journal.path
+
+    @property
+    def header(self):
+        """ETag, content length and part size recorded in the manifest."""
+        return self._header
+
+    @property
+    def completed(self):
+        """Set of completed parts."""
+        return frozenset(self._completed)
+
+    @property
+    def digests(self):
+        """Digests of the completed parts recorded with them, by part."""
+        return dict(self._digests)
+
+    @property
+    def segments(self):
+        """Resized parts, as [first part, first byte, part size] lists."""
+        return list(self._segments)
+
+    def load(self):
+        """Load the manifest from disk.
+
+        :return: the manifest header, None if there is no valid manifest.
+        :rtype: dict
+        """
+        self._header = None
+        self._completed = set()
+        self._digests = {}
+        self._segments = []
+        self._header, entries = self._journal.read()
+        for entry in entries:
+            if "part" in entry:
+                self._completed.add(entry["part"])
+                if entry.get("digests"):
+                    self._digests[entry["part"]] = entry["digests"]
+            elif "segment" in entry:
+                self._segments.append(entry["segment"])
+        return self._header
+
+    def matches(self, bucket, key, etag, content_length):
+        """Check if the manifest belongs to the given object version."""
+        return self._header is not None and \
+            self._header.get("bucket") == bucket and \
+            self._header.get("key") == key and \
+            self._header.get("etag") == etag and \
+            self._header.get("content_length") == content_length
+
+    def start(self, bucket, key, file_info):
+        """Discard any previous state and write a new header for file_info."""
+        with self._lock:
+            self._header = {"bucket": bucket,
+                            "key": key,
+                            "etag": file_info.get("etag"),
+                            "content_length": file_info["content_length"],
+                            "part_size": file_info["part_size"]}
+            for field in ("checksums", "upload_part_size"):
+                if field in file_info:
+                    self._header[field] = file_info[field]
+            self._completed = set()
+            self._digests = {}
+            self._segments = []
+            self._journal.start(self._header)
+
+    def add(self, part, digests=None):
+        """Record part as complete, with the digests of its bytes if given."""
+        entry = {"part": part}
+        if digests:
+            entry["digests"] = digests
+        with self._lock:
+            self._journal.append(entry)
+            self._completed.add(part)
+            if digests:
+                self._digests[part] = digests
+
+    def add_segment(self, first_part, first_byte, part_size):
+        """Record that parts from first_part on start at first_byte and have a new size."""
+        with self._lock:
+            self._journal.append({"segment": [first_part, first_byte, part_size]})
+            self._segments.append([first_part, first_byte, part_size])
+
+    def is_complete(self, part):
+        """Check if part is recorded as complete."""
+        return part in self._completed
+
+    def remove(self):
+        """Remove the manifest file."""
+        self._journal.remove()
@@ -0,0 +1,146 @@
+# -*- coding: utf-8 -*-
+# Copyright 2020 Immfly.com. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"). You
+# may not use this file except in compliance with the License. A copy of
+# the License is located at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# or in the "license" file accompanying this file. This file is
+# distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF
+# ANY KIND, either express or implied. See the License for the specific
+# language governing permissions and limitations under the License.
+"""Download S3 in parts.
+
+This modules provides the cache of object metadata used by S3Resumable instead of
+requesting the objects with HEAD.
+"""
+import collections
+import json
+import os
+import threading
+import time
+import uuid
+
+__all__ = ["MetadataCache"]
+
+# Metadata of an object kept by the cache
+FIELDS = ("content_length", "etag", "checksums", "upload_part_size")
+
+
+class MetadataCache:
+    """Least recently used cache of the size, ETag and checksums of objects.
+
+    Entries expire ttl seconds after they were stored. Range requests carry the ETag of
+    the entry, so an object changed before its entry expired is detected by the first
+    of them, and the download starts again with its current metadata.
+
+    With a path, entries are loaded from it and saved to it by flush, so they are kept
+    across runs; the path may be shared by processes, the last one to flush wins.
+    """
+
+    def __init__(self, max_entries=10000, ttl=300, path=None):
+        """Class initializator.
+
+        :param max_entries: maximum number of objects, defaults to 10000.
+        :param ttl: seconds after which entries expire, defaults to 300, None to keep
+            them until they are evicted.
+        :param path: JSON file to persist the entries, defaults to None.
+        """
+        if int(max_entries) < 1:
+            raise ValueError('Invalid value for max_entries')
+        if ttl is not None and ttl <= 0:
+            raise ValueError('Invalid value for ttl')
+        self._max_entries = int(max_entries)
+        self._ttl = ttl
+        self._path = path
+        self._lock = threading.Lock()
+        self._entries = collections.OrderedDict()
+        if path is not None and os.path.isfile(path):
+            self._load()
+
+    def _load(self):
+        with open(self._path) as cache_file:
+            try:
+                entries = json.load(cache_file)
+            except ValueError:
+                # Truncated by a crash, start empty
+                return
+        for bucket, key, stored, info in entries:
+            if not self._expired(stored):
+                self._store((bucket, key), stored, info)
+
+    def _expired(self, stored):
+        return self._ttl is not None and time.time() - stored >= self._ttl
+
+    def _store(self, name, stored, info):
+        self._entries.pop(name, None)
+        self._entries[name] = (stored, info)
+        while len(self._entries) > self._max_entries:
+            self._entries.popitem(last=False)
+
+    def get(self, bucket, key):
+        """Metadata of key, None if it is not cached or expired."""
+        name = (bucket, key)
+        with self._lock:
+            entry = self._entries.pop(name, None)
+            if entry is None or self._expired(entry[0]):
+                return None
+            # Most recently used, the last to be evicted
+            self._entries[name] = entry
+            return dict(entry[1])
+
+    def put(self, bucket, key, file_info):
+        """Store the metadata of key from its file information."""
+        info = dict((field, file_info[field]) for field in FIELDS if field in file_info)
+        with self._lock:
+            self._store((bucket, key), time.time(), info)
+
+    def put_listed(self, bucket, listed):
+        """Store the metadata of a key from a list_objects_v2 entry.
+
+        Checksums of the entry of the same content are kept, as listings have none.
+        """
+        if listed["Key"].endswith("/") or not listed.get("Size"):
+            return
+        info = {"content_length": int(listed["Size"]), "etag": listed.get("ETag")}
+        name = (bucket, listed["Key"])
+        with self._lock:
+            entry = self._entries.get(name)
+            if entry is not None and all(entry[1].get(field) == info[field] for field in info):
+                info = entry[1]
+            self._store(name, time.time(), info)
+
+    def discard(self, bucket, key):
+        """Remove the metadata of key, known to be stale."""
+        with self._lock:
+            self._entries.pop((bucket, key), None)
+
+    def flush(self):
+        """Save the entries not expired to the path of the cache, if any."""
+        if self._path is None:
+            return
+        with self._lock:
+            entries = [[bucket, key, stored, info]
+                       for (bucket, key), (stored, info) in self._entries.items()
+                       if not self._expired(stored)]
+        temp_path = "{path}.{id}.tmp".format(path=self._path, id=uuid.uuid4().hex)
+        try:
+            with open(temp_path, "w") as cache_file:
+                json.dump(entries, cache_file)
+            os.rename(temp_path, self._path)
+        except BaseException:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+
+    def __len__(self):
+        with self._lock:
+            return len(self._entries)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.flush()
@@ -0,0 +1,183 @@
+# -*- coding: utf-8 -*-
+# Copyright 2020 Immfly.com. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"). You
+# may not use this file except in compliance with the License. A copy of
+# the License is located at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# or in the "license" file accompanying this file. This file is
+# distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF
+# ANY KIND, either express or implied. See the License for the specific
+# language governing permissions and limitations under the License.
+"""Download S3 in parts.
+
+This modules provides an observer exporting the metrics of the parts downloaded by
+S3Resumable to Prometheus text files and StatsD.
+"""
+import bisect
+import os
+import socket
+import threading
+
+from .core import timer
+from .observer import S3ResumableObserver
+
+__all__ = ["MetricsObserver"]
+
+# Upper bounds of the histograms of seconds
+SECONDS_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+# Upper bounds of the histogram of bytes per second
+THROUGHPUT_BUCKETS = (1e5, 5e5, 1e6, 5e6, 1e7, 2.5e7, 5e7, 1e8, 2.5e8, 5e8, 1e9)
+
+# Name, help, field of the part metrics and buckets of every histogram
+HISTOGRAMS = (
+    ("part_request_latency_seconds", "Seconds from part requests to their response headers.",
+     "request_latency", SECONDS_BUCKETS),
+    ("part_time_to_first_byte_seconds", "Seconds from part requests to their first byte.",
+     "time_to_first_byte", SECONDS_BUCKETS),
+    ("part_transfer_seconds", "Seconds from the first to the last byte of parts.",
+     "transfer_time", SECONDS_BUCKETS),
+    ("part_throughput_bytes_per_second", "Bytes per second of part transfers.",
+     "throughput", THROUGHPUT_BUCKETS),
+)
+# Name, help and field of the part metrics of every counter
+COUNTERS = (
+    ("parts_total", "Parts downloaded.", None),
+    ("bytes_total", "Bytes downloaded.", "bytes"),
+    ("part_retries_total", "Failed attempts of downloaded parts.", "retries"),
+    ("part_throttled_total", "Attempts of downloaded parts throttled by S3.", "throttled"),
+)
+
+
+class _Histogram:
+    """Cumulative histogram of observed values, in the Prometheus style."""
+
+    def __init__(self, buckets):
+        """Class initializator.
+
+        :param buckets: upper bounds of the buckets.
+        """
+        self.buckets = tuple(sorted(buckets))
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+
+    def observe(self, value):
+        """Count value in the first bucket whose bound is not lower than it."""
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+
+    def lines(self, name):
+        """Lines of the histogram named name in the Prometheus text format."""
+        cumulative = 0
+        for bound, count in zip(self.buckets + ("+Inf",), self.counts):
+            cumulative += count
+            yield '{}_bucket{{le="{}"}} {}'.format(name, bound, cumulative)
+        yield "{}_sum {}".format(name, self.sum)
+        yield "{}_count {}".format(name, cumulative)
+
+
+class MetricsObserver(S3ResumableObserver):
+    """Observer aggregating the metrics of downloaded parts.
+
+    Every part notified with part_metrics updates counters of parts, bytes, retries
+    and throttled attempts, and histograms of request latency, time to first byte,
+    transfer time and throughput. They are written in the Prometheus text format to
+    prometheus_file, for the textfile collector of the node exporter, and sent as
+    StatsD counters, timers and histograms to statsd_address.
+    """
+
+    # pylint: disable=too-many-arguments
+    def __init__(self, prometheus_file=None, statsd_address=None, prefix="s3resumable",
+                 write_interval=10):
+        """Class initializator.
+
+        :param prometheus_file: path of the Prometheus text file, defaults to None.
+        :param statsd_address: (host, port) of the StatsD server, defaults to None.
+        :param prefix: prefix of the metric names, defaults to s3resumable.
+        :param write_interval: minimum seconds between writes of the Prometheus file,
+            defaults to 10. flush writes it at once.
+        """
+        self._prometheus = None
+        if prometheus_file is not None:
+            self._prometheus = (prometheus_file, float(write_interval))
+        self._statsd = None
+        if statsd_address is not None:
+            statsd_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            statsd_socket.setblocking(False)
+            self._statsd = (statsd_socket, statsd_address)
+        self._prefix = prefix
+        self._written = None
+        # Counters and histograms by name
+        self._metrics = dict((name, 0) for name, _, _ in COUNTERS)
+        self._metrics.update((name, _Histogram(buckets))
+                             for name, _, _, buckets in HISTOGRAMS)
+        self._lock = threading.Lock()
+        self._write_lock = threading.Lock()
+
+    def update(self, file_info):
+        """Record the metrics of the part notified in file_info."""
+        metrics = file_info.get("part_metrics")
+        if metrics is None:
+            return
+        metrics = dict(metrics)
+        metrics["throughput"] = float(metrics["bytes"]) / max(metrics["transfer_time"], 1e-6)
+        with self._lock:
+            for name, _, field in COUNTERS:
+                self._metrics[name] += 1 if field is None else metrics[field]
+            for name, _, field, _ in HISTOGRAMS:
+                self._metrics[name].observe(metrics[field])
+            write = self._prometheus is not None and (
+                self._written is None or timer() - self._written >= self._prometheus[1])
+        self._send_statsd(metrics)
+        if write:
+            self.flush()
+
+    def _send_statsd(self, metrics):
+        if self._statsd is None:
+            return
+        lines = ["{}.parts:1|c".format(self._prefix),
+                 "{}.bytes:{}|c".format(self._prefix, metrics["bytes"])]
+        for field in ("retries", "throttled"):
+            if metrics[field]:
+                lines.append("{}.{}:{}|c".format(self._prefix, field, metrics[field]))
+        for field in ("request_latency", "time_to_first_byte", "transfer_time"):
+            lines.append("{}.{}:{:.3f}|ms".format(self._prefix, field, metrics[field] * 1000))
+        lines.append("{}.throughput:{:.0f}|h".format(self._prefix, metrics["throughput"]))
+        try:
+            statsd_socket, statsd_address = self._statsd
+            statsd_socket.sendto("\n".join(lines).encode("utf-8"), statsd_address)
+        except (socket.error, IOError):
+            # Metrics are best effort, they never fail a download
+            pass
+
+    def prometheus_text(self):
+        """Metrics in the Prometheus text format."""
+        lines = []
+        with self._lock:
+            for name, description, _ in COUNTERS:
+                full_name = "{}_{}".format(self._prefix, name)
+                lines.extend(["# HELP {} {}".format(full_name, description),
+                              "# TYPE {} counter".format(full_name),
+                              "{} {}".format(full_name, self._metrics[name])])
+            for name, description, _, _ in HISTOGRAMS:
+                full_name = "{}_{}".format(self._prefix, name)
+                lines.extend(["# HELP {} {}".format(full_name, description),
+                              "# TYPE {} histogram".format(full_name)])
+                lines.extend(self._metrics[name].lines(full_name))
+        return "\n".join(lines) + "\n"
+
+    def flush(self):
+        """Write the Prometheus file now."""
+        if self._prometheus is None:
+            return
+        with self._lock:
+            self._written = timer()
+        # Replaced at once, so the collector never reads a partial file
+        path = self._prometheus[0]
+        temp_path = "{}.{}.tmp".format(path, os.getpid())
+        with self._write_lock:
+            with open(temp_path, "w") as prometheus_file:
+                prometheus_file.write(self.prometheus_text())
+            os.rename(temp_path, path)
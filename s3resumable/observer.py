@@ -16,7 +16,8 @@
 This modules provides observer class for S3Resumable.
 """
 import abc
-import six
+
+from botocore.compat import six
 
 __all__ = ["S3ResumableObserver"]
 
@@ -0,0 +1,87 @@
+# -*- coding: utf-8 -*-
+# Copyright 2020 Immfly.com. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"). You
+# may not use this file except in compliance with the License. A copy of
+# the License is located at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# or in the "license" file accompanying this file. This file is
+# distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF
+# ANY KIND, either express or implied. See the License for the specific
+# language governing permissions and limitations under the License.
+"""Download S3 in parts.
+
+This modules provides the options of the downloads of S3Resumable and AsyncS3Resumable.
+"""
+from __future__ import absolute_import
+
+import collections
+
+from .bandwidth import BandwidthLimiter
+from .cache import ContentCache
+from .dispatcher import OVERFLOW_POLICIES
+from .metadata import MetadataCache
+from .partsize import AutoPartSize
+from .retry import RetryPolicy
+
+__all__ = ["DownloadOptions"]
+
+
+def _check(name, valid):
+    """Reject the value of the argument name unless valid."""
+    if not valid:
+        raise ValueError('Invalid value for {}'.format(name))
+
+
+def _part_size(part_size_megabytes):
+    """Part size in bytes and part size policy, None for a fixed part size."""
+    if part_size_megabytes == "auto":
+        part_size_megabytes = AutoPartSize()
+    if isinstance(part_size_megabytes, AutoPartSize):
+        return part_size_megabytes.min_part_size_bytes, part_size_megabytes
+    _check("part_size_megabytes", int(part_size_megabytes) >= 1)
+    return int(part_size_megabytes) * 1000000, None
+
+
+def _instance(value, cls, factory):
+    """Value as an instance of cls, built by factory from other values, None if None."""
+    if value is None or isinstance(value, cls):
+        return value
+    return factory(value)
+
+
+class DownloadOptions(collections.namedtuple("DownloadOptions", [
+        "part_size_bytes", "part_size_policy", "max_concurrency", "chunk_size_bytes",
+        "single_file", "bandwidth_limiter", "retry_policy", "verify_checksums",
+        "observer_queue_size", "observer_overflow", "cache", "cooperative", "lease_ttl",
+        "coalesce", "lock_timeout", "metadata_cache"])):
+    """Options of the downloads, built from the arguments of S3Resumable."""
+
+    __slots__ = ()
+
+    # pylint: disable=too-many-arguments,too-many-locals
+    def __new__(cls, part_size_megabytes=15, max_concurrency=1, chunk_size_kilobytes=256,
+                single_file=False, max_bandwidth=None, retry_policy=None,
+                verify_checksums=False, observer_queue_size=1000, observer_overflow="block",
+                cache=None, cooperative=False, lease_ttl=60, coalesce=False,
+                lock_timeout=None, metadata_cache=None):
+        part_size_bytes, part_size_policy = _part_size(part_size_megabytes)
+        _check("max_concurrency", int(max_concurrency) >= 1)
+        _check("chunk_size_kilobytes", int(chunk_size_kilobytes) >= 1)
+        _check("observer_queue_size", int(observer_queue_size) >= 0)
+        _check("observer_overflow", observer_overflow in OVERFLOW_POLICIES)
+        _check("lease_ttl", lease_ttl > 0)
+        if cooperative and single_file:
+            raise ValueError('Cooperative downloads need one file per part')
+
+        return super(DownloadOptions, cls).__new__(
+            cls, part_size_bytes, part_size_policy, int(max_concurrency),
+            int(chunk_size_kilobytes) * 1000, bool(single_file),
+            _instance(max_bandwidth, BandwidthLimiter, BandwidthLimiter),
+            retry_policy if retry_policy is not None else RetryPolicy(),
+            bool(verify_checksums), int(observer_queue_size), observer_overflow,
+            _instance(cache, ContentCache, ContentCache), bool(cooperative), lease_ttl,
+            bool(coalesce), lock_timeout,
+            _instance(metadata_cache, MetadataCache, lambda path: MetadataCache(path=path)))
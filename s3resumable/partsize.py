@@ -0,0 +1,101 @@
+# -*- coding: utf-8 -*-
+# Copyright 2020 Immfly.com. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"). You
+# may not use this file except in compliance with the License. A copy of
+# the License is located at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# or in the "license" file accompanying this file. This file is
+# distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF
+# ANY KIND, either express or implied. See the License for the specific
+# language governing permissions and limitations under the License.
+"""Download S3 in parts.
+
+This modules provides the adaptive part size policy of S3Resumable.
+"""
+import math
+import threading
+
+__all__ = ["AutoPartSize"]
+
+# Part sizes are multiples of a decimal megabyte, like part_size_megabytes.
+MEGABYTE = 1000000
+
+
+class AutoPartSize:
+    """Part size policy choosing the part size from the size of every object.
+
+    The part size of an object is its size split in target_parts, within the
+    configured bounds. While an object downloads, the measured throughput and
+    latency of its requests are used to resize the parts not started yet, so that
+    request latency stays around target_overhead of the time of every request.
+    """
+
+    # pylint: disable=too-many-arguments
+    def __init__(self, min_part_size_megabytes=5, max_part_size_megabytes=200,
+                 target_parts=64, target_overhead=0.05, smoothing=0.3):
+        """Class initializator.
+
+        :param min_part_size_megabytes: minimum part size in MB, defaults to 5.
+        :param max_part_size_megabytes: maximum part size in MB, defaults to 200.
+        :param target_parts: number of parts to split objects in, defaults to 64.
+        :param target_overhead: fraction of the time of a request spent waiting for
+            the first byte, defaults to 0.05.
+        :param smoothing: weight of the last measure in the moving averages,
+            defaults to 0.3.
+        """
+        if int(min_part_size_megabytes) < 1 or \
+                int(max_part_size_megabytes) < int(min_part_size_megabytes):
+            raise ValueError('Invalid value for part size bounds')
+        if int(target_parts) < 1:
+            raise ValueError('Invalid value for target_parts')
+        if not 0 < float(target_overhead) < 1:
+            raise ValueError('Invalid value for target_overhead')
+
+        self.min_part_size_bytes = int(min_part_size_megabytes) * MEGABYTE
+        self.max_part_size_bytes = int(max_part_size_megabytes) * MEGABYTE
+        self._target_parts = int(target_parts)
+        self._target_overhead = float(target_overhead)
+        self._smoothing = float(smoothing)
+        # Moving averages of the throughput and latency of the requests
+        self._measures = None
+        self._lock = threading.Lock()
+
+    def _bound(self, part_size):
+        part_size = int(math.ceil(float(part_size) / MEGABYTE)) * MEGABYTE
+        return max(self.min_part_size_bytes, min(self.max_part_size_bytes, part_size))
+
+    def part_size(self, content_length):
+        """Part size in bytes for an object of content_length bytes."""
+        return self._bound(float(content_length) / self._target_parts)
+
+    def observe(self, size, latency, seconds):
+        """Record a request of size bytes, with latency seconds to the first byte and
+        seconds in total."""
+        if size <= 0 or seconds <= latency:
+            return
+        throughput = size / (seconds - latency)
+        with self._lock:
+            if self._measures is None:
+                self._measures = (throughput, latency)
+            else:
+                average_throughput, average_latency = self._measures
+                self._measures = (
+                    average_throughput + self._smoothing * (throughput - average_throughput),
+                    average_latency + self._smoothing * (latency - average_latency))
+
+    def resize(self, part_size):
+        """Part size in bytes for parts not started yet, currently of part_size bytes."""
+        with self._lock:
+            if self._measures is None:
+                return part_size
+            throughput, latency = self._measures
+        # Transfer time should be (1 - overhead) / overhead times the latency
+        ideal = throughput * latency * (1 - self._target_overhead) / self._target_overhead
+        ideal = self._bound(ideal)
+        # Avoid resizing on small variations of the measures
+        if abs(ideal - part_size) < part_size / 4:
+            return part_size
+        return ideal
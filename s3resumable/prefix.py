@@ -0,0 +1,93 @@
+# -*- coding: utf-8 -*-
+# Copyright 2020 Immfly.com. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"). You
+# may not use this file except in compliance with the License. A copy of
+# the License is located at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# or in the "license" file accompanying this file. This file is
+# distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF
+# ANY KIND, either express or implied. See the License for the specific
+# language governing permissions and limitations under the License.
+"""Download S3 in parts.
+
+This modules provides the downloads of the keys listed under a prefix, shared by
+S3Resumable and AsyncS3Resumable, which use the listing instead of requesting every
+key.
+"""
+from __future__ import absolute_import
+
+import os
+
+from .core import Return
+from .exceptions import S3ResumableDownloadError
+from .utils import create_directory_tree
+
+__all__ = ["collect_results", "download_listed", "listed_download_file", "listed_info"]
+
+
+def listed_download_file(listed, prefix, download_dir, temp_dir):
+    """Path of a listed key relative to download_dir, creating its directories."""
+    key = listed["Key"]
+    # Keep the key tree below the last "directory" of prefix
+    relative_key = key[len(prefix[:prefix.rfind("/") + 1]):]
+    download_file = os.path.normpath(os.path.join(*relative_key.split("/")))
+    if os.path.isabs(download_file) or download_file.split(os.sep)[0] == os.pardir:
+        raise S3ResumableDownloadError("Key {} is outside of {} prefix".format(key, prefix))
+
+    create_directory_tree(os.path.dirname(os.path.join(download_dir, download_file)))
+    create_directory_tree(os.path.dirname(os.path.join(temp_dir or download_dir,
+                                                       download_file)))
+    return download_file
+
+
+def listed_info(core, listed):
+    """Build file information from a list_objects_v2 entry, saving a HEAD request.
+
+    :return: file information, None for empty keys.
+    """
+    content_length = int(listed["Size"])
+    if content_length == 0:
+        return None
+    file_info = {"key": listed["Key"],
+                 "content_length": content_length,
+                 "etag": listed.get("ETag")}
+    core.set_part_size(file_info, core.object_part_size(content_length))
+    return file_info
+
+
+def collect_results(bucket, results):
+    """Split downloaded paths from errors of a prefix download."""
+    failed = ["{}: {}".format(key, result) for key, result in results.items()
+              if isinstance(result, BaseException)]
+    if failed:
+        raise S3ResumableDownloadError("Failed to download {} keys from {} bucket: {}".format(
+            len(failed), bucket, "; ".join(sorted(failed))))
+    return results
+
+
+# pylint: disable=too-many-arguments
+def download_listed(core, bucket, listed, prefix, download_dir, temp_dir, scheduler,
+                    index=None):
+    """Flow downloading a key from a list_objects_v2 entry, without requesting it
+    again."""
+    download_file = listed_download_file(listed, prefix, download_dir, temp_dir)
+    local_file_path = os.path.join(download_dir, download_file)
+    if index is not None and index.unchanged(bucket, listed, local_file_path):
+        raise Return(local_file_path)
+
+    if core.options.metadata_cache is not None:
+        core.options.metadata_cache.put_listed(bucket, listed)
+    file_info = listed_info(core, listed)
+    if file_info is None:
+        # Nothing to download in parts, truncating changed files when syncing
+        open(local_file_path, "ab" if index is None else "wb").close()
+    else:
+        file_info["scheduler"] = scheduler
+        yield core.download_file(bucket, listed["Key"], download_dir, download_file,
+                                 temp_dir, listed_info=file_info, replace=index is not None)
+    if index is not None:
+        index.update(bucket, listed, local_file_path)
+    raise Return(local_file_path)
@@ -0,0 +1,330 @@
+# -*- coding: utf-8 -*-
+# Copyright 2020 Immfly.com. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"). You
+# may not use this file except in compliance with the License. A copy of
+# the License is located at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# or in the "license" file accompanying this file. This file is
+# distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF
+# ANY KIND, either express or implied. See the License for the specific
+# language governing permissions and limitations under the License.
+"""Download S3 in parts.
+
+This modules provides the seekable file object used by S3Resumable to read ranges of
+an object on demand, keeping the blocks read in a cache, and the opening of keys as
+such file objects.
+"""
+from __future__ import absolute_import
+
+import bisect
+import collections
+import io
+import os
+import threading
+from concurrent import futures
+
+from botocore.exceptions import ClientError
+
+from .exceptions import S3ResumableTruncated
+from .stream import prepare_stream
+from .utils import create_directory_tree
+
+__all__ = ["RemoteFile", "open_key"]
+
+# Bytes of the blocks of the files opened with open, without temp_dir
+BLOCK_SIZE = 1000 * 1000
+# Bytes of the blocks cached by every file opened with open
+BLOCK_CACHE_SIZE = 64 * 1000 * 1000
+
+
+class BlockCache:
+    """Least recently used blocks of a file, by index."""
+
+    def __init__(self, max_blocks):
+        self._max_blocks = max_blocks
+        self._blocks = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, block):
+        """Data of block, None if it is not cached."""
+        with self._lock:
+            data = self._blocks.pop(block, None)
+            if data is not None:
+                # Most recently used, the last to be evicted
+                self._blocks[block] = data
+            return data
+
+    def put(self, block, data):
+        """Cache the data of block, evicting the least recently used blocks."""
+        with self._lock:
+            self._blocks.pop(block, None)
+            self._blocks[block] = data
+            while len(self._blocks) > self._max_blocks:
+                self._blocks.popitem(last=False)
+
+    def __len__(self):
+        with self._lock:
+            return len(self._blocks)
+
+
+class RemoteFile(io.RawIOBase):
+    """Read only, seekable file object over an object whose blocks are requested on
+    demand.
+
+    Blocks are aligned to block_size and kept in a cache of max_blocks blocks. Reads
+    and read_ranges request the blocks missing from the cache, requesting runs of
+    close blocks together.
+    """
+
+    # pylint: disable=too-many-arguments
+    def __init__(self, size, block_size, fetch, max_blocks, max_concurrency=1,
+                 on_close=None):
+        """Class initializator.
+
+        :param size: bytes of the object.
+        :param block_size: bytes of the blocks.
+        :param fetch: function returning the bytes of the object from a start offset up
+            to an end offset, excluded, both aligned to block_size or the end.
+        :param max_blocks: maximum blocks cached.
+        :param max_concurrency: runs of blocks requested at the same time.
+        :param on_close: function called once the file is closed, defaults to None.
+        """
+        super(RemoteFile, self).__init__()
+        if int(block_size) < 1:
+            raise ValueError('Invalid value for block_size')
+        self._size = size
+        self._block_size = int(block_size)
+        self._fetch = fetch
+        self._cache = BlockCache(max(1, int(max_blocks)))
+        self._max_concurrency = max_concurrency
+        self._on_close = on_close
+        self._position = 0
+
+    @property
+    def size(self):
+        """Bytes of the object."""
+        return self._size
+
+    @property
+    def block_size(self):
+        """Bytes of the blocks requested."""
+        return self._block_size
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_SET:
+            position = offset
+        elif whence == io.SEEK_CUR:
+            position = self._position + offset
+        elif whence == io.SEEK_END:
+            position = self._size + offset
+        else:
+            raise ValueError("Invalid whence {}".format(whence))
+        if position < 0:
+            raise ValueError("Negative seek position {}".format(position))
+        self._position = position
+        return position
+
+    def tell(self):
+        return self._position
+
+    def readinto(self, b):
+        self._check_closed()
+        data = self.read_ranges([(self._position, len(b))])[0]
+        b[:len(data)] = data
+        self._position += len(data)
+        return len(data)
+
+    def _check_closed(self):
+        if self.closed:
+            raise ValueError("I/O operation on closed file")
+
+    def _blocks_of(self, offset, length):
+        end = min(offset + length, self._size)
+        if offset >= end:
+            return range(0)
+        return range(offset // self._block_size, (end - 1) // self._block_size + 1)
+
+    def read_ranges(self, ranges, max_gap=None):
+        """Read several ranges, requesting the blocks not cached in as few requests as
+        possible.
+
+        Runs of missing blocks separated by max_gap bytes or less are requested
+        together, with the blocks between them.
+
+        :param ranges: (offset, length) pairs.
+        :param max_gap: bytes between runs of blocks to request them together,
+            defaults to block_size.
+        :return: list with the bytes of every range, shorter past the end of the object.
+        """
+        self._check_closed()
+        ranges = list(ranges)
+        if max_gap is None:
+            max_gap = self._block_size
+        needed = sorted(set(block for offset, length in ranges
+                            for block in self._blocks_of(offset, length)))
+        blocks = {}
+        runs = []
+        for block in needed:
+            data = self._cache.get(block)
+            if data is not None:
+                blocks[block] = data
+            elif runs and (block - runs[-1][1] - 1) * self._block_size <= max_gap:
+                runs[-1][1] = block
+            else:
+                runs.append([block, block])
+        blocks.update(self._fetch_runs(runs))
+
+        results = []
+        for offset, length in ranges:
+            chunks = []
+            end = min(offset + length, self._size)
+            for block in self._blocks_of(offset, length):
+                block_start = block * self._block_size
+                chunks.append(blocks[block][max(offset - block_start, 0):end - block_start])
+            results.append(b"".join(chunks))
+        return results
+
+    def _fetch_run(self, run):
+        first, last = run
+        start = first * self._block_size
+        data = self._fetch(start, min((last + 1) * self._block_size, self._size))
+        blocks = {}
+        for block in range(first, last + 1):
+            offset = (block - first) * self._block_size
+            blocks[block] = data[offset:offset + self._block_size]
+            self._cache.put(block, blocks[block])
+        return blocks
+
+    def _fetch_runs(self, runs):
+        blocks = {}
+        if len(runs) > 1 and self._max_concurrency > 1:
+            with futures.ThreadPoolExecutor(
+                    max_workers=min(self._max_concurrency, len(runs))) as executor:
+                for run_blocks in executor.map(self._fetch_run, runs):
+                    blocks.update(run_blocks)
+        else:
+            for run in runs:
+                blocks.update(self._fetch_run(run))
+        return blocks
+
+    def close(self):
+        if not self.closed and self._on_close is not None:
+            self._on_close()
+        super(RemoteFile, self).close()
+
+
+# pylint: disable=too-many-arguments
+def open_key(core, bucket, key, temp_dir, download_file, block_size, cache_size):
+    """Open a key as a RemoteFile whose blocks are requested with range requests, or
+    read from the parts downloaded to temp_dir, see S3Resumable.open."""
+    if block_size is not None and int(block_size) < 1:
+        raise ValueError('Invalid value for block_size')
+    if int(cache_size) < 0:
+        raise ValueError('Invalid value for cache_size')
+    transport = core.transport
+    if not temp_dir:
+        file_info = transport.run(core.get_file_info(bucket, key))
+        block_size = int(block_size or BLOCK_SIZE)
+        return RemoteFile(
+            file_info["content_length"], block_size,
+            lambda start, end: _fetch_range(core, bucket, key, start, end, file_info),
+            int(cache_size) // block_size, max_concurrency=core.options.max_concurrency)
+
+    if not download_file:
+        download_file = os.path.basename(key)
+    create_directory_tree(temp_dir)
+    local_file_path = os.path.join(temp_dir, download_file)
+    # Avoid other instances to download the same parts while the file is open
+    lock = transport.acquire_lock(download_file, local_file_path)
+
+    def release():
+        transport.join_notifications()
+        lock.release()
+
+    try:
+        file_info = transport.run(prepare_stream(core, bucket, key, local_file_path))
+    except Exception:
+        release()
+        raise
+    part_starts = [core.part_range(part, file_info)[0]
+                   for part in range(file_info["total_parts"])]
+    block_size = int(block_size or BLOCK_SIZE)
+    # Parts are downloaded concurrently by every request instead, since blocks of
+    # concurrent requests may share a part
+    return RemoteFile(
+        file_info["content_length"], block_size,
+        lambda start, end: _fetch_parts_range(core, bucket, key, start, end, file_info,
+                                              part_starts),
+        int(cache_size) // block_size, on_close=release)
+
+
+# pylint: disable=too-many-arguments
+def _fetch_range(core, bucket, key, start, end, file_info):
+    """Bytes of key from start up to end, excluded, retried like parts."""
+    kwargs = {"Bucket": bucket, "Key": key,
+              "Range": "bytes={start}-{end}".format(start=start, end=end - 1)}
+    if file_info.get("etag"):
+        # Never mix blocks of different versions of the object
+        kwargs["IfMatch"] = file_info["etag"]
+    # Retries are budgeted per request, a file open for long would run out of the
+    # retries of the object otherwise
+    data, _ = core.transport.run(core.retry(
+        lambda: _get_range(core, bucket, key, kwargs, end - start), {}))
+    return data
+
+
+def _get_range(core, bucket, key, kwargs, length):
+    try:
+        response = core.transport.get_object(**kwargs)
+    except ClientError as client_error:
+        core.raise_client_error(client_error, bucket, key)
+        raise
+    range_buffer = io.BytesIO()
+    body = response.get('Body')
+    if body is not None:
+        core.transport.copy_body(body, range_buffer)
+    if range_buffer.tell() != length:
+        raise S3ResumableTruncated("Failed to download {} of key {}".format(
+            kwargs["Range"], key))
+    return range_buffer.getvalue()
+
+
+# pylint: disable=too-many-arguments
+def _fetch_parts_range(core, bucket, key, start, end, file_info, part_starts):
+    """Bytes of key from start up to end, excluded, read from its parts once they are
+    downloaded."""
+    first_part = bisect.bisect_right(part_starts, start) - 1
+    parts = range(first_part, bisect.bisect_right(part_starts, end - 1))
+    max_workers = min(core.options.max_concurrency, len(parts))
+    with futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+        core.transport.wait(set(
+            executor.submit(core.transport.run,
+                            core.download_part(bucket, key, part, file_info))
+            for part in parts))
+    return b"".join(_read_part_range(core, part, file_info, start, end) for part in parts)
+
+
+def _read_part_range(core, part, file_info, start, end):
+    """Bytes of a downloaded part from start up to end, excluded, read from disk."""
+    start_range, end_range = core.part_range(part, file_info)
+    start, end = max(start, start_range), min(end, end_range + 1)
+    if "file_path" in file_info:
+        file_path, offset = file_info["file_path"], start
+    else:
+        file_path, offset = file_info["part_path"].format(part=part), start - start_range
+    with open(file_path, "rb") as part_file:
+        part_file.seek(offset)
+        data = part_file.read(end - start)
+    if len(data) != end - start:
+        raise S3ResumableTruncated("Failed to read part {} of key {}".format(
+            part, file_info["key"]))
+    return data
@@ -0,0 +1,111 @@
+# -*- coding: utf-8 -*-
+# Copyright 2020 Immfly.com. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"). You
+# may not use this file except in compliance with the License. A copy of
+# the License is located at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# or in the "license" file accompanying this file. This file is
+# distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF
+# ANY KIND, either express or implied. See the License for the specific
+# language governing permissions and limitations under the License.
+"""Download S3 in parts.
+
+This modules provides the retry policy of the parts downloaded by S3Resumable.
+"""
+import random
+import socket
+
+import botocore.exceptions
+from botocore.exceptions import ClientError
+from urllib3.exceptions import HTTPError as URLLib3HTTPError
+
+from .exceptions import S3ResumableTruncated
+
+__all__ = ["RetryPolicy"]
+
+THROTTLE_ERROR_CODES = frozenset(["SlowDown", "Throttling", "ThrottlingException",
+                                  "RequestLimitExceeded", "TooManyRequests",
+                                  "TooManyRequestsException", "429", "503"])
+TRANSIENT_ERROR_CODES = frozenset(["InternalError", "RequestTimeout", "ServiceUnavailable",
+                                   "500", "502", "504"])
+
+try:
+    SOCKET_ERRORS = (ConnectionError, socket.timeout)
+except NameError:
+    # Python 2
+    SOCKET_ERRORS = (socket.error,)
+
+# Errors raised while requesting or streaming a body over a broken connection.
+TRANSIENT_ERRORS = tuple(error for error in (
+    botocore.exceptions.ConnectionError, botocore.exceptions.HTTPClientError,
+    botocore.exceptions.IncompleteReadError,
+    # Wraps the errors of body reads in recent botocore versions
+    getattr(botocore.exceptions, "ResponseStreamingError", None),
+    URLLib3HTTPError, S3ResumableTruncated) + SOCKET_ERRORS if error is not None)
+
+
+def _error_code(error):
+    if isinstance(error, ClientError):
+        return str(error.response.get('Error', {}).get('Code'))
+    return None
+
+
+class RetryPolicy:
+    """Retry policy of parts.
+
+    Parts failing with a transient error, like a connection reset, a 5xx response or a
+    body ending before its range, are retried after an exponential backoff with full
+    jitter, up to max_attempts times per part and max_retries times per object.
+    Throttling responses, like 503 SlowDown, are retried after longer backoffs up to
+    max_throttle_attempts times per part, without taking from the retries of the object,
+    since waiting is the expected way out of them.
+    """
+
+    # pylint: disable=too-many-arguments
+    def __init__(self, max_attempts=5, max_retries=20, base_delay=0.2, max_delay=20,
+                 max_throttle_attempts=10, throttle_base_delay=1, throttle_max_delay=60):
+        """Class initializator.
+
+        :param max_attempts: attempts of a part failing with transient errors, defaults
+            to 5. 1 disables retries.
+        :param max_retries: retries of transient errors of all the parts of an object,
+            defaults to 20.
+        :param base_delay: backoff of the first retry in seconds, defaults to 0.2.
+        :param max_delay: maximum backoff in seconds, defaults to 20.
+        :param max_throttle_attempts: attempts of a part throttled by S3, defaults to 10.
+        :param throttle_base_delay: backoff of the first retry of a throttled part in
+            seconds, defaults to 1.
+        :param throttle_max_delay: maximum backoff of throttled parts in seconds, defaults
+            to 60.
+        """
+        if int(max_attempts) < 1 or int(max_throttle_attempts) < 1:
+            raise ValueError('Invalid value for max_attempts')
+        if int(max_retries) < 0:
+            raise ValueError('Invalid value for max_retries')
+        self.max_attempts = int(max_attempts)
+        self.max_retries = int(max_retries)
+        self.max_throttle_attempts = int(max_throttle_attempts)
+        self._delays = {False: (float(base_delay), float(max_delay)),
+                        True: (float(throttle_base_delay), float(throttle_max_delay))}
+
+    @staticmethod
+    def is_throttle(error):
+        """Whether error is S3 asking to slow down."""
+        return _error_code(error) in THROTTLE_ERROR_CODES
+
+    @staticmethod
+    def is_transient(error):
+        """Whether error may not happen again."""
+        error_code = _error_code(error)
+        if error_code is not None:
+            status = error.response.get('ResponseMetadata', {}).get('HTTPStatusCode')
+            return error_code in TRANSIENT_ERROR_CODES or (status or 0) >= 500
+        return isinstance(error, TRANSIENT_ERRORS)
+
+    def delay(self, attempt, throttle=False):
+        """Seconds to wait before the attempt (counting from 1) after a failed one."""
+        base_delay, max_delay = self._delays[throttle]
+        return random.uniform(0, min(max_delay, base_delay * 2 ** (attempt - 1)))
@@ -19,40 +19,314 @@ the configured size.
 """
 from __future__ import absolute_import
 
-import math
+import io
 import os
+import threading
+import time
+from concurrent import futures
 
 import filelock
 from botocore.compat import six
-from botocore.exceptions import ClientError
 
-from .exceptions import (S3ResumableBloqued, S3ResumableDownloadError,
-                         S3ResumableIncompatible)
+from .coalesce import InFlightDownloads, SharedLock
+from .cooperative import download_cooperatively
+from .core import DownloadCore, Transport, advance, is_flow, notification_download, timer
+from .exceptions import S3ResumableBloqued
+from .extract import decompress_key, extract_key
+from .options import DownloadOptions
+from .prefix import collect_results, download_listed
+from .scheduler import PartScheduler
+from .stream import ChunkReader, stream_arguments, stream_key
+from .dispatcher import NotificationDispatcher
 from .observer import S3ResumableObserver
-from .utils import create_directory_tree, get_filelock_path
+from .remote import BLOCK_CACHE_SIZE, open_key
+from .utils import get_filelock_path
 
 __all__ = ["S3Resumable"]
 
+# Seconds to wait for the lock of a file
+LOCK_TIMEOUT = 10
+# Downloads in flight in the process, shared by coalescing instances
+IN_FLIGHT = InFlightDownloads()
+
+
+class SyncTransport(Transport):
+    """Transport of the flows of S3Resumable, running them in the calling thread.
+
+    Requests and blocking calls are made at once, and parts are downloaded by worker
+    threads.
+    """
+
+    dispatcher_class = NotificationDispatcher
+
+    def __init__(self, client, options, notify):
+        # Old style class with Python 2
+        Transport.__init__(self, client, options, notify)
+        self._notify_lock = threading.Lock()
+        self._local = threading.local()
+
+    def run(self, flow):
+        """Run flow, returning its result."""
+        if not is_flow(flow):
+            # Computed already
+            return flow
+        result, error = None, None
+        try:
+            while True:
+                done, step = advance(flow, result, error)
+                if done:
+                    return step
+                try:
+                    result, error = self.run(step), None
+                except Exception as exc:  # pylint: disable=broad-except
+                    result, error = None, exc
+        finally:
+            flow.close()
+
+    def _get_chunk_buffer(self):
+        # One buffer per worker thread, reused for every part it downloads.
+        chunk_buffer = getattr(self._local, "chunk_buffer", None)
+        if chunk_buffer is None:
+            chunk_buffer = bytearray(self._options.chunk_size_bytes)
+            self._local.chunk_buffer = chunk_buffer
+        return chunk_buffer
+
+    def copy_body(self, body, output, hasher=None, metrics=None):
+        """Copy a streaming body to output in chunks, keeping memory usage flat."""
+        bandwidth_limiter = self._options.bandwidth_limiter
+        chunk_buffer = self._get_chunk_buffer()
+        chunk_view = memoryview(chunk_buffer)
+        written = 0
+        readinto = getattr(body, "readinto", None)
+        while True:
+            if readinto is not None:
+                read = readinto(chunk_buffer)
+                chunk = chunk_view[:read]
+            else:
+                chunk = body.read(len(chunk_buffer))
+                read = len(chunk)
+            if not read:
+                break
+            if metrics is not None and "first_byte" not in metrics:
+                metrics["first_byte"] = timer()
+            if bandwidth_limiter is not None:
+                bandwidth_limiter.consume(read)
+            if hasher is not None:
+                hasher.update(chunk)
+            output.write(chunk)
+            written += read
+        return written
+
+    @staticmethod
+    def sleep(seconds):
+        """Wait without downloading."""
+        time.sleep(seconds)
+
+    @staticmethod
+    def blocking(function, *args):
+        """Result of a call blocking on the filesystem."""
+        return function(*args)
+
+    def publish(self, file_info, update, extra=None):
+        """Update file_info and notify observers of a snapshot of it, with extra fields."""
+        # Parts may finish in any order when downloading concurrently, so observers
+        # receive a snapshot of file_info instead of the shared dict.
+        with self._notify_lock:
+            file_info.update(update)
+            snapshot = dict(file_info, **(extra or {}))
+            if self._dispatcher is None:
+                self._notify(snapshot)
+            else:
+                self._dispatcher.put(notification_download(snapshot), snapshot)
+
+    def join_notifications(self):
+        """Wait until every notification is delivered."""
+        if self._dispatcher is not None:
+            self._dispatcher.join()
+
+    @staticmethod
+    def wait(pending):
+        """Wait for every future of pending, cancelling the rest if one fails."""
+        try:
+            for future in futures.as_completed(pending):
+                future.result()
+        except Exception:
+            for future in pending:
+                future.cancel()
+            raise
+
+    def fetch_parts(self, file_info, download_part, resize_parts):
+        """Run the flows made by download_part for every part of file_info.
+
+        The parts not started yet are resized by resize_parts as parts are completed.
+        """
+        total_parts = file_info["total_parts"]
+        scheduler = file_info.get("scheduler")
+        if scheduler is not None:
+            self.wait(scheduler.map_parts(lambda part: self.run(download_part(part)),
+                                          range(total_parts)))
+        elif self._options.max_concurrency > 1 and total_parts > 1:
+            self._fetch_parts_concurrently(file_info, download_part, resize_parts)
+        else:
+            part = 0
+            while part < file_info["total_parts"]:
+                self.run(download_part(part))
+                part += 1
+                resize_parts(part)
+
+    def _fetch_parts_concurrently(self, file_info, download_part, resize_parts):
+        max_workers = min(self._options.max_concurrency, file_info["total_parts"])
+        # boto3 clients are thread safe, so all workers share the same client.
+        with futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+            # Parts are submitted as workers get free, so the ones not started yet can
+            # still be resized.
+            running = set()
+            next_part = 0
+            try:
+                while next_part < file_info["total_parts"] or running:
+                    while next_part < file_info["total_parts"] and len(running) < max_workers:
+                        running.add(executor.submit(self.run, download_part(next_part)))
+                        next_part += 1
+                    done, running = futures.wait(running, return_when=futures.FIRST_COMPLETED)
+                    for future in done:
+                        future.result()
+                    resize_parts(next_part)
+            except Exception:
+                for future in running:
+                    future.cancel()
+                raise
+
+    def lock_timeout(self):
+        """Seconds to wait for the lock of a file."""
+        return LOCK_TIMEOUT if self._options.lock_timeout is None else self._options.lock_timeout
+
+    def acquire_lock(self, download_file, local_file_path):
+        """Lock a file, avoiding other instances to download it.
+
+        Coalescing instances wait for the lock in the kernel instead of polling it.
+        """
+        filelock_filepath = get_filelock_path(download_file)
+        if self._options.coalesce:
+            lock = SharedLock(filelock_filepath)
+        else:
+            lock = filelock.FileLock(filelock_filepath)
+        try:
+            lock.acquire(timeout=self.lock_timeout())
+        except filelock.Timeout as exc:
+            six.raise_from(S3ResumableBloqued(
+                "Another instance is currently downloading {}".format(local_file_path)), exc)
+        return lock
+
+    def coalesce(self, target, flow, local_file_path):
+        """Run flow, or wait for the result of the flow of target running already.
+
+        Callers joining a flow in flight wait for it at most lock_timeout seconds, then
+        raise S3ResumableBloqued while the flow goes on for the caller that started it.
+        """
+        future, started = IN_FLIGHT.join(target)
+        if not started:
+            flow.close()
+            timeout = self.lock_timeout()
+            try:
+                return future.result(timeout=timeout if timeout >= 0 else None)
+            except futures.TimeoutError as exc:
+                six.raise_from(S3ResumableBloqued(
+                    "Timed out after {} seconds waiting for the download in flight of {}".format(
+                        timeout, local_file_path)), exc)
+        try:
+            downloaded_file = self.run(flow)
+        except BaseException as error:
+            IN_FLIGHT.finish(target, error=error)
+            raise
+        IN_FLIGHT.finish(target, downloaded_file)
+        return downloaded_file
+
+    @staticmethod
+    def download_cooperatively(core, *args):
+        """Download a key with the workers of other processes, see DownloadCore.download_file."""
+        return download_cooperatively(core, *args)
+
 
 class S3Resumable:
     """
     S3 resumable download class helper.
     """
-    _observers = []
 
-    def __init__(self, client, part_size_megabytes=15):
+    # pylint: disable=too-many-arguments,too-many-locals
+    def __init__(self, client, part_size_megabytes=15, max_concurrency=1,
+                 chunk_size_kilobytes=256, single_file=False, max_bandwidth=None,
+                 retry_policy=None, verify_checksums=False, observer_queue_size=1000,
+                 observer_overflow="block", cache=None, cooperative=False, lease_ttl=60,
+                 coalesce=False, lock_timeout=None, metadata_cache=None):
         """Class initializator.
 
         :param client: boto3 client, defaults to None
         :type client: boto3.Client
-        :param part_size_bytes: size of parts in bytes, defaults to 15mb.
-        :type part_size_bytes: int
+        :param part_size_megabytes: size of parts in MB, defaults to 15mb. "auto" or an
+            AutoPartSize instance choose the part size of every object from its size
+            and the measured throughput.
+        :type part_size_megabytes: int, str or AutoPartSize
+        :param max_concurrency: maximum number of parts downloaded at the same time,
+            defaults to 1.
+        :type max_concurrency: int
+        :param chunk_size_kilobytes: size of the buffer used to copy part bodies to disk,
+            defaults to 256kb.
+        :type chunk_size_kilobytes: int
+        :param single_file: write parts in place into a preallocated file instead of
+            one file per part, defaults to False.
+        :type single_file: bool
+        :param max_bandwidth: maximum bytes per second read from S3, or a
+            BandwidthLimiter shared with other instances, defaults to no limit.
+        :type max_bandwidth: int or BandwidthLimiter
+        :param retry_policy: retries of parts failing with transient errors, defaults to
+            RetryPolicy().
+        :type retry_policy: RetryPolicy
+        :param verify_checksums: verify the ETag and S3 checksums of objects with digests
+            of the parts computed while downloading them, defaults to False.
+        :type verify_checksums: bool
+        :param observer_queue_size: maximum notifications waiting to be delivered to the
+            observers by a background thread, defaults to 1000. 0 delivers them from the
+            download threads.
+        :type observer_queue_size: int
+        :param observer_overflow: policy when the queue of notifications is full: block
+            the downloads, drop_oldest or coalesce the notifications of a download,
+            defaults to block.
+        :type observer_overflow: str
+        :param cache: directory of the cache of downloaded objects, or a ContentCache
+            shared with other instances, defaults to no cache.
+        :type cache: str or ContentCache
+        :param cooperative: download parts of an object from several processes or hosts
+            sharing temp_dir, each leasing the parts not downloaded nor leased by the
+            rest, defaults to False.
+        :type cooperative: bool
+        :param lease_ttl: seconds without renewing its lease after which the part of a
+            dead worker is taken over by another one, defaults to 60.
+        :type lease_ttl: int
+        :param coalesce: callers requesting a file being downloaded wait for it and
+            share its result instead of raising S3ResumableBloqued, defaults to False.
+        :type coalesce: bool
+        :param lock_timeout: seconds to wait for a file being downloaded by another
+            instance, or with coalesce for the download in flight joined, negative to
+            wait forever, defaults to 10.
+        :type lock_timeout: float
+        :param metadata_cache: cache of the metadata of objects used instead of HEAD
+            requests, or the path of the JSON file of a new one, defaults to None.
+        :type metadata_cache: str or MetadataCache
         """
-        if int(part_size_megabytes) < 1:
-            raise ValueError('Invalid value for part_size_megabytes')
-
-        self._client = client
-        self._part_size_bytes = int(part_size_megabytes) * 1000000
+        options = DownloadOptions(
+            part_size_megabytes, max_concurrency, chunk_size_kilobytes, single_file,
+            max_bandwidth, retry_policy, verify_checksums, observer_queue_size,
+            observer_overflow, cache, cooperative, lease_ttl, coalesce, lock_timeout,
+            metadata_cache)
+        self._observers = []
+        self._transport = SyncTransport(client, options, self.notify)
+        self._core = DownloadCore(self._transport, options)
+
+    @property
+    def bandwidth_limiter(self):
+        """BandwidthLimiter of the downloads, None if the bandwidth is not limited. Its
+        max_bandwidth can be changed while downloading."""
+        return self._core.options.bandwidth_limiter
 
     def attach(self, observer):
         """Attach observer to notifications."""
@@ -67,24 +341,9 @@ class S3Resumable:
 
     def notify(self, file_info):
         """Notify file info to observers."""
-        for observer in self._observers:
+        for observer in list(self._observers):
             observer.update(file_info)
 
-    def _check_part_size(self, file_part, part, file_info):
-        total_parts = file_info["total_parts"]
-        content_length = file_info["content_length"]
-        if os.path.isfile(file_part):
-            part_size = os.path.getsize(file_part)
-            if part < (total_parts - 1):
-                if part_size != self._part_size_bytes:
-                    return False
-            else:
-                if part_size != content_length - (part * self._part_size_bytes):
-                    return False
-        else:
-            return False
-        return True
-
     def get_file_info(self, bucket, key):
         """Get file information from S3 in order to calculate the total number of parts to
         download.
@@ -95,136 +354,188 @@ class S3Resumable:
         :return: content length and total parts.
         :rtype: dict
         """
-        accept_ranges = None
-        content_length = 0
-        total_parts = 0
-        metadata = None
-        http_headers = None
-
-        head = self._client.head_object(Bucket=bucket, Key=key)
-
-        if head is not None:
-            metadata = head.get('ResponseMetadata')
-        if metadata is not None:
-            http_headers = metadata.get('HTTPHeaders')
-        if http_headers is not None:
-            content_length = int(http_headers.get('content-length', 0))
-            accept_ranges = http_headers.get('accept-ranges', 'none')
-
-        # Calculate total parts
-        if content_length != 0 and "bytes" in accept_ranges:
-            total_parts = int(math.ceil(float(content_length) / float(self._part_size_bytes)))
-        else:
-            raise S3ResumableIncompatible("Can't download key {} from {} bucket".format(
-                key, bucket))
+        return self._transport.run(self._core.get_file_info(bucket, key))
 
-        return {"key": key,
-                "content_length": content_length,
-                "total_parts": total_parts}
+    # pylint: disable=too-many-arguments
+    def download_file(self, bucket, key, download_dir, download_file=None, temp_dir=None):
+        """Download a file from s3 in parts in order to be able to resume incomplete downloads.
 
-    def _download_part(self, bucket, key, part, file_info):
-        file_part = file_info["part_path"].format(part=part)
-        content_length = file_info["content_length"]
+        :param bucket: s3 bucket.
+        :param key: s3 key.
+        :param download_dir: directory to download file.
+        :param download_file: filename for downloaded file, defaults to None.
+        :param temp_dir: directory to download file parts, defaults to None.
+        :return: string with downloaded file path.
+        """
+        self._core.check_arguments(("Bucket", bucket), ("Key", key))
 
-        if self._check_part_size(file_part, part, file_info):
-            return
-        start_range = part * self._part_size_bytes
-        end_range = start_range + self._part_size_bytes - 1
-        if end_range > content_length:
-            end_range = content_length
+        if not download_file:
+            download_file = os.path.basename(key)
 
-        part_range = 'bytes={start}-{end}'.format(start=start_range, end=end_range)
         try:
-            response = self._client.get_object(Bucket=bucket, Key=key, Range=part_range)
-        except ClientError as client_error:
-            if client_error.response['Error']['Code'] == '404':
-                raise S3ResumableDownloadError("Key {} does not exist in {} bucket".format(
-                    key, bucket))
-        body = response.get('Body')
-        if body is not None:
-            with open(file_part, "wb") as part_buffer:
-                part_buffer.write(body.read())
-
-        if not self._check_part_size(file_part, part, file_info):
-            raise S3ResumableDownloadError("Failed to download part {} of key {}".format(
-                file_part, key))
-
-        file_info.update({"part": part + 1})
-        self.notify(file_info)
-
-    def _download_parts(self, bucket, key, download_file, temp_dir):
-        local_file_path = os.path.join(temp_dir, download_file)
-
-        # Resumable download
-        part_path = "{path}.part{{part}}".format(path=local_file_path)
-
-        file_info = self.get_file_info(bucket, key)
-        file_info.update({"part_path": part_path})
-        total_parts = file_info["total_parts"]
-        content_length = file_info["content_length"]
+            return self._transport.run(self._core.download_file(
+                bucket, key, download_dir, download_file, temp_dir))
+        finally:
+            self._transport.join_notifications()
 
-        # Download parts
-        for part in range(total_parts):
-            self._download_part(bucket, key, part, file_info)
+    # pylint: disable=too-many-arguments
+    def stream(self, bucket, key, temp_dir=None, download_file=None, readahead=None):
+        """Generate the bytes of a key in order while its next parts are downloaded.
 
-        # Concatenate parts
-        with open(local_file_path, "wb") as result_file:
-            for part in range(total_parts):
-                file_part = part_path.format(part=part)
-                try:
-                    with open(file_part, "rb") as part_file:
-                        result_file.write(part_file.read())
-                finally:
-                    if os.path.exists(file_part):
-                        os.remove(file_part)
+        Parts are downloaded by max_concurrency workers up to readahead parts ahead of
+        the part being read. With temp_dir, parts are kept there until the stream ends,
+        so an interrupted stream, or download_file with the same temp_dir and
+        download_file, is resumed from them. Without it, parts are written to a
+        temporary directory and removed once read.
 
-        # Check file size
-        if os.path.getsize(local_file_path) != content_length:
-            os.remove(local_file_path)
-            raise S3ResumableDownloadError("Failed to download key {}".format(key))
+        :param bucket: s3 bucket.
+        :param key: s3 key.
+        :param temp_dir: directory to download file parts, defaults to None.
+        :param download_file: filename the parts are named after, defaults to the
+            basename of key.
+        :param readahead: maximum parts downloaded ahead of the part being read,
+            defaults to twice max_concurrency.
+        :return: generator of byte strings.
+        """
+        download_file, readahead = stream_arguments(self._core, bucket, key, download_file,
+                                                    readahead)
+        return stream_key(self._core, bucket, key, temp_dir, download_file, readahead)
+
+    # pylint: disable=too-many-arguments
+    def open_stream(self, bucket, key, temp_dir=None, download_file=None, readahead=None):
+        """Open a key as a read only file object streamed with stream.
 
-        return local_file_path
+        :return: buffered binary file object, to be closed after reading it.
+        """
+        return io.BufferedReader(ChunkReader(self.stream(
+            bucket, key, temp_dir=temp_dir, download_file=download_file,
+            readahead=readahead)), buffer_size=self._core.options.chunk_size_bytes)
 
     # pylint: disable=too-many-arguments
-    def download_file(self, bucket, key, download_dir, download_file=None, temp_dir=None):
-        """Download a file from s3 in parts in order to be able to resume incomplete downloads.
+    def open(self, bucket, key, temp_dir=None, download_file=None, block_size=None,
+             cache_size=BLOCK_CACHE_SIZE):
+        """Open a key as a seekable read only file object whose blocks are requested on
+        demand, for formats read by seeking to their footer or index.
+
+        Blocks read are kept in a least recently used cache of cache_size bytes, and
+        read_ranges of the file object requests the blocks of several ranges at once,
+        merging runs of close blocks in one request. Without temp_dir, blocks are
+        requested with range requests and only cached in memory. With temp_dir, blocks
+        are read from the parts of the object downloaded there, which are kept when the
+        file is closed, so they are reused by a later open, stream or download_file
+        with the same temp_dir and download_file.
 
         :param bucket: s3 bucket.
         :param key: s3 key.
-        :param download_dir: directory to download file.
-        :param download_file: filename for downloaded file, defaults to None.
         :param temp_dir: directory to download file parts, defaults to None.
-        :return: string with downloaded file path.
+        :param download_file: filename the parts are named after, defaults to the
+            basename of key.
+        :param block_size: bytes of the blocks, defaults to 1MB.
+        :param cache_size: bytes of the blocks cached, defaults to 64MB.
+        :return: RemoteFile, to be closed after reading it.
         """
-        for argument in [("Bucket", bucket), ("Key", key)]:
-            if not isinstance(argument[1], six.string_types):
-                raise ValueError('{} must be a string'.format(argument[0]))
+        self._core.check_arguments(("Bucket", bucket), ("Key", key))
+        return open_key(self._core, bucket, key, temp_dir, download_file, block_size,
+                        cache_size)
 
-        if not temp_dir:
-            temp_dir = download_dir
+    # pylint: disable=too-many-arguments,too-many-locals
+    def decompress_file(self, bucket, key, download_dir, download_file=None, temp_dir=None,
+                        compression=None, readahead=None):
+        """Download a compressed key, decompressing it in order while its next parts are
+        downloaded instead of once the whole key is on disk.
 
-        if not download_file:
-            download_file = os.path.basename(key)
+        Parts are streamed from temp_dir like with stream, and the decompressed bytes
+        written are checkpointed, so an interrupted download is resumed from the parts
+        on disk without writing those bytes again.
 
-        create_directory_tree(temp_dir)
-        create_directory_tree(download_dir)
+        :param bucket: s3 bucket.
+        :param key: s3 key.
+        :param download_dir: directory to write the decompressed file.
+        :param download_file: filename for the decompressed file, defaults to the
+            basename of key without its compression suffix.
+        :param temp_dir: directory to download file parts, defaults to download_dir.
+        :param compression: gzip, bz2, xz or zstd, defaults to the one of the suffix
+            of key.
+        :param readahead: maximum parts downloaded ahead of the part being decompressed,
+            defaults to twice max_concurrency.
+        :raises S3ResumableExtractError: the key can't be decompressed.
+        :return: decompressed file path.
+        """
+        self._core.check_arguments(("Bucket", bucket), ("Key", key))
+        return decompress_key(self._core, bucket, key, download_dir, download_file,
+                              temp_dir, compression, readahead)
 
-        local_file_path = os.path.join(download_dir, download_file)
+    # pylint: disable=too-many-arguments
+    def extract_archive(self, bucket, key, extract_dir, temp_dir=None, compression=None,
+                        readahead=None):
+        """Download a tar archive, extracting its members in order while its next parts
+        are downloaded instead of once the whole archive is on disk.
 
-        # The file was already downloaded
-        if os.path.isfile(local_file_path):
-            return local_file_path
+        Parts are streamed from temp_dir like with stream, and the extracted members are
+        checkpointed, so an interrupted download is resumed from the parts on disk
+        without extracting those members again. Members that would be written outside
+        of extract_dir are rejected, and devices and fifos are skipped.
 
-        # Avoid other instances to download the same file
-        filelock_filepath = get_filelock_path(download_file)
-        lock = filelock.FileLock(filelock_filepath)
+        :param bucket: s3 bucket.
+        :param key: s3 key.
+        :param extract_dir: directory to extract the members of the archive.
+        :param temp_dir: directory to download file parts, defaults to extract_dir.
+        :param compression: gzip, bz2, xz, zstd or none, defaults to the one of the
+            suffix of key.
+        :param readahead: maximum parts downloaded ahead of the part being extracted,
+            defaults to twice max_concurrency.
+        :raises S3ResumableExtractError: the key can't be extracted.
+        :return: list with the paths of the extracted members.
+        """
+        self._core.check_arguments(("Bucket", bucket), ("Key", key))
+        return extract_key(self._core, bucket, key, extract_dir, temp_dir, compression,
+                           readahead)
+
+    # pylint: disable=too-many-arguments
+    def download_prefix(self, bucket, prefix, download_dir, temp_dir=None, index=None):
+        """Download every key under prefix, keeping the tree of keys below it.
+
+        Keys are listed page by page and downloaded while the listing goes on, using the
+        size and ETag of the listing instead of requesting every key. Parts of all the
+        keys share max_concurrency workers.
+
+        With an index, keys are synced: the ones whose ETag and size match the index
+        are not requested, and the rest are downloaded again even if their file exists.
+
+        :param bucket: s3 bucket.
+        :param prefix: s3 prefix, an empty string for the whole bucket.
+        :param download_dir: directory to download files.
+        :param temp_dir: directory to download file parts, defaults to None.
+        :param index: SyncIndex of the downloaded keys, defaults to None.
+        :raises S3ResumableDownloadError: some keys could not be downloaded, once the
+            rest of keys are done.
+        :return: dict with the downloaded file path of every key.
+        """
+        self._core.check_arguments(("Bucket", bucket), ("Prefix", prefix))
+
+        # Objects in flight, more than part workers so that workers always have parts
+        # queued while some objects are being listed or assembled.
+        max_objects = self._core.options.max_concurrency * 2
+        object_slots = threading.BoundedSemaphore(max_objects)
+        pending = {}
+        paginator = self._transport.client.get_paginator('list_objects_v2')
         try:
-            with lock.acquire(timeout=10):
-                downloaded_file = self._download_parts(bucket, key, download_file, temp_dir)
-                if downloaded_file is not None and downloaded_file != local_file_path:
-                    os.rename(downloaded_file, local_file_path)
-        except filelock.Timeout:
-            raise S3ResumableBloqued("Another instance is currently downloading {}".format(
-                local_file_path))
-
-        return local_file_path
+            with PartScheduler(self._core.options.max_concurrency) as scheduler, \
+                    futures.ThreadPoolExecutor(max_workers=max_objects) as executor:
+                for page in paginator.paginate(Bucket=bucket, Prefix=prefix):
+                    for listed in page.get('Contents', []):
+                        if listed["Key"].endswith("/"):
+                            continue
+                        object_slots.acquire()
+                        future = executor.submit(self._transport.run, download_listed(
+                            self._core, bucket, listed, prefix, download_dir, temp_dir,
+                            scheduler, index))
+                        future.add_done_callback(lambda _: object_slots.release())
+                        pending[listed["Key"]] = future
+        finally:
+            self._transport.join_notifications()
+            if index is not None:
+                index.flush()
+
+        return collect_results(bucket, dict(
+            (key, future.exception() or future.result()) for key, future in pending.items()))
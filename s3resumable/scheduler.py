@@ -0,0 +1,91 @@
+# -*- coding: utf-8 -*-
+# Copyright 2020 Immfly.com. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"). You
+# may not use this file except in compliance with the License. A copy of
+# the License is located at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# or in the "license" file accompanying this file. This file is
+# distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF
+# ANY KIND, either express or implied. See the License for the specific
+# language governing permissions and limitations under the License.
+"""Download S3 in parts.
+
+This modules provides the part scheduler shared by the objects of a prefix
+download.
+"""
+import itertools
+import threading
+from concurrent import futures
+
+from botocore.compat import six
+
+__all__ = ["PartScheduler"]
+
+
+class PartScheduler:
+    """Fixed pool of workers downloading the parts of many objects.
+
+    Every object gets an arrival number when its parts are submitted, and part N of
+    an object is scheduled at arrival + N. Parts of the objects in flight are
+    interleaved, so small objects are not stuck behind the parts of a large one, and
+    a large object is not starved by the small objects submitted after it.
+    """
+
+    def __init__(self, max_workers):
+        self._queue = six.moves.queue.PriorityQueue()  # pylint: disable=no-member
+        self._lock = threading.Lock()
+        self._arrivals = 0
+        self._sequence = itertools.count()
+        self._workers = []
+        for _ in range(max_workers):
+            worker = threading.Thread(target=self._work)
+            worker.daemon = True
+            worker.start()
+            self._workers.append(worker)
+
+    def _work(self):
+        while True:
+            _, _, task = self._queue.get()
+            if task is None:
+                return
+            future, func, part = task
+            if not future.set_running_or_notify_cancel():
+                continue
+            try:
+                result = func(part)
+            except BaseException as exc:  # pylint: disable=broad-except
+                future.set_exception(exc)
+            else:
+                future.set_result(result)
+
+    def map_parts(self, func, parts):
+        """Schedule func(part) for every part of one object.
+
+        :return: list of futures, one per part.
+        """
+        with self._lock:
+            arrival = self._arrivals
+            self._arrivals += 1
+        pending = []
+        for part in parts:
+            future = futures.Future()
+            self._queue.put(((arrival + part, arrival), next(self._sequence),
+                             (future, func, part)))
+            pending.append(future)
+        return pending
+
+    def shutdown(self):
+        """Stop the workers once the queued parts are done."""
+        for _ in self._workers:
+            self._queue.put(((float("inf"), 0), next(self._sequence), None))
+        for worker in self._workers:
+            worker.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.shutdown()
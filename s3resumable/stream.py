@@ -0,0 +1,212 @@
+# -*- coding: utf-8 -*-
+# Copyright 2020 Immfly.com. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"). You
+# may not use this file except in compliance with the License. A copy of
+# the License is located at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# or in the "license" file accompanying this file. This file is
+# distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF
+# ANY KIND, either express or implied. See the License for the specific
+# language governing permissions and limitations under the License.
+"""Download S3 in parts.
+
+This modules provides the steps of the streams of S3Resumable and AsyncS3Resumable,
+the stream of S3Resumable, and the file object reading the bytes of an object streamed
+while its next parts are downloaded.
+"""
+from __future__ import absolute_import
+
+import io
+import os
+import shutil
+import tempfile
+from concurrent import futures
+
+from .core import Return
+from .exceptions import S3ResumableTruncated
+from .layout import discard_parts, prepare_single_file
+from .manifest import ResumeManifest
+from .utils import create_directory_tree
+from .verify import object_hasher, verify_object
+
+__all__ = ["ChunkReader", "finish_stream", "lock_stream", "parts_ahead", "prepare_stream",
+           "read_part", "release_stream", "stream_arguments", "stream_key"]
+
+
+# pylint: disable=too-many-arguments
+def stream_arguments(core, bucket, key, download_file, readahead):
+    """Check the arguments of a stream.
+
+    :return: filename the parts are named after and readahead of the stream.
+    """
+    core.check_arguments(("Bucket", bucket), ("Key", key))
+    return download_file or os.path.basename(key), core.get_readahead(readahead)
+
+
+def lock_stream(core, temp_dir, download_file):
+    """Flow of the directory of the parts of a stream and its lock.
+
+    With temp_dir, the lock avoids other instances to download the same parts.
+    Otherwise parts go to a new temporary directory, without lock.
+    """
+    if not temp_dir:
+        raise Return((tempfile.mkdtemp(prefix="s3resumable"), None))
+    create_directory_tree(temp_dir)
+    lock = yield core.transport.acquire_lock(download_file,
+                                             os.path.join(temp_dir, download_file))
+    raise Return((temp_dir, lock))
+
+
+def release_stream(temp_dir, lock):
+    """Release the lock of the parts of a stream, or remove its temporary directory."""
+    if lock is not None:
+        lock.release()
+    else:
+        shutil.rmtree(temp_dir, ignore_errors=True)
+
+
+def parts_ahead(part, readahead, total_parts, pending):
+    """Parts to start downloading when part is read, up to readahead parts ahead."""
+    return [next_part for next_part in range(part, min(part + readahead, total_parts))
+            if next_part not in pending]
+
+
+def prepare_stream(core, bucket, key, local_file_path):
+    """Flow of the file information of a stream, keeping the parts of a previous run.
+
+    The object is always requested, since bytes of a stale version could be read
+    before a range request detects the change.
+    """
+    manifest = ResumeManifest("{path}.manifest".format(path=local_file_path))
+    manifest.load()
+    file_info = yield core.get_file_info(bucket, key)
+    yield core.transport.blocking(core.prepare_manifest, bucket, key, local_file_path,
+                                  manifest, file_info)
+    # Parts are read in order, so the whole object is hashed while it is streamed
+    file_info.update({"manifest": manifest, "digests": manifest.digests,
+                      "object_hasher": object_hasher(file_info)})
+    if core.options.single_file:
+        yield core.transport.blocking(prepare_single_file, bucket, key,
+                                      local_file_path, file_info)
+    else:
+        file_info["part_path"] = "{path}.part{{part}}".format(path=local_file_path)
+    raise Return(file_info)
+
+
+def read_part(core, part, file_info, keep_parts):
+    """Generate the bytes of a downloaded part."""
+    start_range, end_range = core.part_range(part, file_info)
+    remaining = end_range - start_range + 1
+    whole_hasher = file_info.get("object_hasher")
+    hasher = whole_hasher.part_hasher(start_range) if whole_hasher is not None else None
+    if "file_path" in file_info:
+        file_path = file_info["file_path"]
+    else:
+        file_path, start_range = file_info["part_path"].format(part=part), 0
+    with open(file_path, "rb") as part_file:
+        part_file.seek(start_range)
+        while remaining > 0:
+            chunk = part_file.read(min(remaining, core.options.chunk_size_bytes))
+            if not chunk:
+                raise S3ResumableTruncated("Failed to read part {} of key {}".format(
+                    part, file_info["key"]))
+            remaining -= len(chunk)
+            if hasher is not None:
+                hasher.update(chunk)
+            yield chunk
+    if not keep_parts and "file_path" not in file_info:
+        os.remove(file_path)
+
+
+def finish_stream(core, key, local_file_path, file_info):
+    """Verify a streamed object and remove its parts."""
+    manifest = file_info["manifest"]
+    verify_object(core, key, local_file_path, file_info)
+    discard_parts(core, local_file_path, manifest)
+    manifest.remove()
+
+
+# pylint: disable=too-many-arguments
+def stream_key(core, bucket, key, temp_dir, download_file, readahead, started=None):
+    """Generate the bytes of a key in order while its next parts are downloaded by the
+    worker threads of a SyncTransport, see S3Resumable.stream.
+
+    :param started: function called with the file information once the parts are laid
+        out, before the first byte, defaults to None.
+    """
+    transport = core.transport
+    temp_dir, lock = transport.run(lock_stream(core, temp_dir, download_file))
+    local_file_path = os.path.join(temp_dir, download_file)
+    try:
+        file_info = transport.run(prepare_stream(core, bucket, key, local_file_path))
+        if started is not None:
+            started(file_info)
+        parts = _stream_parts(core, bucket, key, file_info, readahead,
+                              keep_parts=lock is not None)
+        try:
+            for chunk in parts:
+                yield chunk
+        finally:
+            # Stop the downloads now when the stream is closed early
+            parts.close()
+        finish_stream(core, key, local_file_path, file_info)
+    finally:
+        transport.join_notifications()
+        release_stream(temp_dir, lock)
+
+
+# pylint: disable=too-many-arguments
+def _stream_parts(core, bucket, key, file_info, readahead, keep_parts):
+    total_parts = file_info["total_parts"]
+    max_workers = min(core.options.max_concurrency, total_parts)
+    with futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+        pending = {}
+        try:
+            for part in range(total_parts):
+                for next_part in parts_ahead(part, readahead, total_parts, pending):
+                    pending[next_part] = executor.submit(
+                        core.transport.run,
+                        core.download_part(bucket, key, next_part, file_info))
+                pending.pop(part).result()
+                for chunk in read_part(core, part, file_info, keep_parts):
+                    yield chunk
+        finally:
+            # Stop the parts not started when the stream fails or is closed early
+            for future in pending.values():
+                future.cancel()
+
+
+class ChunkReader(io.RawIOBase):
+    """Read only file object over an iterator of byte strings.
+
+    Closing the reader closes the iterator, stopping the downloads of a stream.
+    """
+
+    def __init__(self, chunks):
+        super(ChunkReader, self).__init__()
+        self._chunks = chunks
+        self._chunk = b""
+        self._offset = 0
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        while self._offset >= len(self._chunk):
+            try:
+                self._chunk = next(self._chunks)
+            except StopIteration:
+                return 0
+            self._offset = 0
+        size = min(len(b), len(self._chunk) - self._offset)
+        b[:size] = self._chunk[self._offset:self._offset + size]
+        self._offset += size
+        return size
+
+    def close(self):
+        if not self.closed and hasattr(self._chunks, "close"):
+            self._chunks.close()
+        super(ChunkReader, self).close()
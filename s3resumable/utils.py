@@ -18,7 +18,23 @@ This modules provides functions utils for S3Resumable.
 import errno
 import hashlib
 import os
+import shutil
+import sys
 import tempfile
+import uuid
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover
+    fcntl = None
+
+# ioctl request to clone a whole file on filesystems with reflink support (Linux).
+FICLONE = 0x40049409
+# Bytes copied per system call.
+COPY_CHUNK_SIZE = 8 * 1024 * 1024
+# Errors meaning that a kernel side copy is not possible between two files.
+KERNEL_COPY_ERRORS = (errno.EXDEV, errno.ENOSYS, errno.EOPNOTSUPP, errno.EINVAL,
+                      errno.EBADF, errno.ETXTBSY)
 
 
 def create_directory_tree(path):
@@ -33,8 +49,193 @@ def create_directory_tree(path):
                 raise
 
 
+def remove_if_exists(path):
+    """Remove the file at path, if it was not removed already."""
+    try:
+        os.remove(path)
+    except OSError as exc:
+        if exc.errno != errno.ENOENT:
+            raise
+
+
 def get_filelock_path(filename):
     """Calculate filelock path from filename."""
     basename = "s3resumable_{}".format(hashlib.md5(filename.encode('utf-8')).hexdigest())
     basedir = tempfile.gettempdir()
     return os.path.join(basedir, basename)
+
+
+def free_space(path):
+    """Bytes available to unprivileged users in the filesystem of path, None if unknown."""
+    if hasattr(os, "statvfs"):
+        stat = os.statvfs(path)
+        return stat.f_bavail * stat.f_frsize
+    if hasattr(shutil, "disk_usage"):
+        return shutil.disk_usage(path).free
+    return None  # pragma: no cover
+
+
+def preallocate_file(fileno, size):
+    """Grow the file behind fileno to size bytes, reserving the blocks when possible."""
+    if hasattr(os, "posix_fallocate"):
+        try:
+            os.posix_fallocate(fileno, 0, size)
+            return
+        except OSError as exc:
+            if exc.errno not in (errno.EOPNOTSUPP, errno.ENOSYS, errno.EINVAL):
+                raise
+    os.ftruncate(fileno, size)
+
+
+def sync_file(file_obj):
+    """Flush file_obj and write its data to disk."""
+    file_obj.flush()
+    os.fsync(file_obj.fileno())
+
+
+def _kernel_copy(copy, count):
+    """Copy up to count bytes with copy, a kernel copy call taking the bytes to copy.
+
+    :return: number of bytes copied, None if the kernel can't copy between the files.
+    """
+    copied = 0
+    try:
+        while copied < count:
+            sent = copy(min(count - copied, COPY_CHUNK_SIZE))
+            if not sent:
+                break
+            copied += sent
+    except OSError as exc:
+        if copied or exc.errno not in KERNEL_COPY_ERRORS:
+            raise
+        return None
+    return copied
+
+
+def _copy_file_range(src_fd, dst_fd, count):
+    """Copy with copy_file_range, None if it is not available for the files."""
+    if not hasattr(os, "copy_file_range"):
+        return None
+    return _kernel_copy(lambda size: os.copy_file_range(src_fd, dst_fd, size), count)
+
+
+def _sendfile(src_fd, dst_fd, count):
+    """Copy with sendfile, None if it is not available for the files."""
+    if not hasattr(os, "sendfile") or not sys.platform.startswith("linux"):
+        return None
+    return _kernel_copy(lambda size: os.sendfile(dst_fd, src_fd, None, size), count)
+
+
+def _read_write(src_fd, dst_fd, count):
+    """Copy in chunks read and written in userspace."""
+    copied = 0
+    while copied < count:
+        chunk = os.read(src_fd, min(count - copied, COPY_CHUNK_SIZE))
+        if not chunk:
+            break
+        view = memoryview(chunk)
+        while view:
+            view = view[os.write(dst_fd, view):]
+        copied += len(chunk)
+    return copied
+
+
+def copy_fd(src_fd, dst_fd, count):
+    """Copy count bytes from the current offset of src_fd to the current offset of dst_fd.
+
+    The copy is done in the kernel with copy_file_range or sendfile when possible,
+    falling back to a chunked userspace copy.
+
+    :return: number of bytes copied, less than count if src_fd reached end of file.
+    """
+    for kernel_copy in (_copy_file_range, _sendfile):
+        copied = kernel_copy(src_fd, dst_fd, count)
+        if copied is not None:
+            return copied
+    return _read_write(src_fd, dst_fd, count)
+
+
+def copy_fileobj(source, destination):
+    """Append the rest of the source file object to the destination file object."""
+    destination.flush()
+    src_fd = source.fileno()
+    count = os.fstat(src_fd).st_size - source.tell()
+    return copy_fd(src_fd, destination.fileno(), count)
+
+
+def reflink_fd(src_fd, dst_fd):
+    """Make dst_fd share the blocks of src_fd (copy on write).
+
+    :return: False if the filesystem does not support reflinks.
+    """
+    if fcntl is None or not sys.platform.startswith("linux"):
+        return False
+    try:
+        fcntl.ioctl(dst_fd, FICLONE, src_fd)
+    except (IOError, OSError) as exc:
+        if exc.errno in KERNEL_COPY_ERRORS + (errno.ENOTTY,):
+            return False
+        raise
+    return True
+
+
+def move_file(src, dst):
+    """Move src to dst, copying the data when they are on different filesystems.
+
+    Cross device moves copy into a temporary file next to dst, using a reflink or a
+    kernel side copy, and rename it so dst never contains a partial file.
+    """
+    try:
+        os.rename(src, dst)
+        return
+    except OSError as exc:
+        if exc.errno != errno.EXDEV:
+            raise
+    temp_dst = "{path}.moving".format(path=dst)
+    try:
+        with open(src, "rb") as src_file, open(temp_dst, "wb") as dst_file:
+            if not reflink_fd(src_file.fileno(), dst_file.fileno()):
+                # Reserve the blocks at once, so the copy is contiguous
+                preallocate_file(dst_file.fileno(), os.fstat(src_file.fileno()).st_size)
+                copy_fileobj(src_file, dst_file)
+            dst_file.flush()
+            os.fsync(dst_file.fileno())
+        shutil.copystat(src, temp_dst)
+        os.rename(temp_dst, dst)
+    except BaseException:
+        if os.path.exists(temp_dst):
+            os.remove(temp_dst)
+        raise
+    os.remove(src)
+
+
+def link_file(src, dst, hardlink=True):
+    """Make dst a hard link, reflink or copy of src, in this order of preference.
+
+    The file is created with a unique name next to dst and renamed, so dst is replaced
+    atomically, never contains a partial file and several processes can link the same
+    dst at once.
+    """
+    temp_dst = "{path}.{id}.linking".format(path=dst, id=uuid.uuid4().hex)
+    try:
+        if hardlink:
+            try:
+                os.link(src, temp_dst)
+                os.rename(temp_dst, dst)
+                return
+            except OSError as exc:
+                if exc.errno == errno.ENOENT and not os.path.exists(src):
+                    raise
+                if os.path.exists(temp_dst):
+                    os.remove(temp_dst)
+        with open(src, "rb") as src_file, open(temp_dst, "wb") as dst_file:
+            if not reflink_fd(src_file.fileno(), dst_file.fileno()):
+                copy_fileobj(src_file, dst_file)
+            dst_file.flush()
+            os.fsync(dst_file.fileno())
+        shutil.copystat(src, temp_dst)
+        os.rename(temp_dst, dst)
+    except BaseException:
+        if os.path.exists(temp_dst):
+            os.remove(temp_dst)
+        raise
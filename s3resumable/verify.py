@@ -0,0 +1,137 @@
+# -*- coding: utf-8 -*-
+# Copyright 2020 Immfly.com. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"). You
+# may not use this file except in compliance with the License. A copy of
+# the License is located at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# or in the "license" file accompanying this file. This file is
+# distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF
+# ANY KIND, either express or implied. See the License for the specific
+# language governing permissions and limitations under the License.
+"""Download S3 in parts.
+
+This modules provides the verification of the checksums of the objects downloaded
+by S3Resumable and AsyncS3Resumable, from the digests of their parts.
+"""
+from __future__ import absolute_import
+
+import logging
+
+from .checksum import (CRC_PARAMETERS, ObjectHasher, PartHasher, available_algorithms,
+                       object_checksum)
+from .exceptions import S3ResumableChecksumMismatch
+from .layout import discard_parts
+
+__all__ = ["add_digests", "object_hasher", "part_hasher", "read_part", "verify_object"]
+
+LOGGER = logging.getLogger(__name__)
+
+
+def part_hasher(file_info):
+    """Hasher of the checksums of the object that can be verified, None if there are
+    none."""
+    algorithms = set(file_info.get("checksums", ())) & available_algorithms()
+    return PartHasher(algorithms) if algorithms else None
+
+
+def object_hasher(file_info):
+    """Hasher of the checksums of the object that can't be computed from the digests
+    of its parts, like a plain MD5 ETag, None if there are none."""
+    checksums = file_info.get("checksums") or {}
+    algorithms = [algorithm for algorithm in set(checksums) & available_algorithms()
+                  if algorithm not in CRC_PARAMETERS and "-" not in checksums[algorithm]]
+    if not algorithms or file_info["total_parts"] < 2:
+        return None
+    return ObjectHasher(algorithms)
+
+
+def add_digests(part, file_info, hasher):
+    """Record the digests of part computed by hasher."""
+    if hasher is not None:
+        file_info.setdefault("digests", {})[part] = hasher.digests()
+
+
+def read_part(core, part, file_info, hasher, offset=0):
+    """Add the bytes of a part from offset, read from disk, to hasher."""
+    start_range, end_range = core.part_range(part, file_info)
+    if "file_path" in file_info:
+        file_path, file_offset = file_info["file_path"], start_range
+    else:
+        file_path, file_offset = file_info["part_path"].format(part=part), 0
+    with open(file_path, "rb") as part_file:
+        part_file.seek(file_offset + offset)
+        hasher.update_file(part_file, end_range - start_range + 1 - offset)
+
+
+def _object_checksums(core, file_info):
+    """Checksums of the object that can't be computed from the digests of its parts,
+    reading the bytes not hashed while the parts were written."""
+    hasher = file_info.get("object_hasher") or object_hasher(file_info)
+    if hasher is None:
+        return {}
+    for part in range(file_info["total_parts"]):
+        start_range, end_range = core.part_range(part, file_info)
+        if end_range >= hasher.position:
+            offset = hasher.position - start_range
+            read_part(core, part, file_info, hasher.part_hasher(start_range + offset), offset)
+    return hasher.checksums()
+
+
+def _part_digests(core, file_info, algorithms):
+    """Digests and lengths of every part, reading again the parts without digests of
+    algorithms."""
+    digests = file_info.setdefault("digests", {})
+    part_digests = []
+    part_lengths = []
+    for part in range(file_info["total_parts"]):
+        if not algorithms.issubset(digests.get(part, ())):
+            hasher = PartHasher(algorithms)
+            read_part(core, part, file_info, hasher)
+            digests[part] = hasher.digests()
+        start_range, end_range = core.part_range(part, file_info)
+        part_digests.append(digests[part])
+        part_lengths.append(end_range - start_range + 1)
+    return part_digests, part_lengths
+
+
+def _downloaded_checksums(core, file_info, algorithms):
+    """Checksums of algorithms of the bytes downloaded, None for the ones that can't be
+    combined from the parts downloaded."""
+    part_digests, part_lengths = _part_digests(core, file_info, algorithms)
+    upload_parts = file_info.get("upload_part_size") == file_info["part_size"] and \
+        not file_info.get("segments")
+    object_checksums = _object_checksums(core, file_info)
+    checksums = {}
+    for algorithm in algorithms:
+        checksums[algorithm] = object_checksums.get(algorithm) or object_checksum(
+            algorithm, file_info["checksums"][algorithm], part_digests, part_lengths,
+            upload_parts)
+    return checksums
+
+
+def verify_object(core, key, local_file_path, file_info):
+    """Check the ETag and checksums of the object combining the digests of its parts.
+
+    Parts completed without digests, like the ones left by a run that did not verify
+    checksums, are read again. The parts are discarded if a checksum doesn't match.
+
+    :raises S3ResumableChecksumMismatch: a checksum doesn't match.
+    """
+    checksums = file_info.get("checksums")
+    algorithms = set(checksums or ()) & available_algorithms()
+    if not algorithms:
+        return
+    downloaded = _downloaded_checksums(core, file_info, algorithms)
+    for algorithm in sorted(algorithms):
+        if downloaded[algorithm] is None:
+            LOGGER.warning("Can't verify the %s checksum of key %s: the parts "
+                           "downloaded are not the uploaded ones", algorithm, key)
+        elif downloaded[algorithm] != checksums[algorithm]:
+            manifest = file_info["manifest"]
+            discard_parts(core, local_file_path, manifest)
+            manifest.remove()
+            raise S3ResumableChecksumMismatch(
+                "{} checksum of key {} does not match".format(algorithm, key))
@@ -33,8 +33,12 @@ setuptools.setup(
     install_requires=[
         'six',
         'boto3',
-        'filelock==3.0.12'],
+        'filelock==3.0.12',
+        'urllib3',
+        'futures ; python_version<"3"'],
     extras_require={
+        'checksums': ['crc32c'],
+        'zstd': ['zstandard'],
         'dev': [
             'pylint',
             'flake8',
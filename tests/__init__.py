@@ -13,13 +13,52 @@
 # language governing permissions and limitations under the License.
 from __future__ import absolute_import
 
+import sys
+
 from .s3resumable_test import S3ResumableTests
-from .utils_test import UtilsTests
+from .utils_test import FileCopyTests, UtilsTests
 from .cli_test import CliTests
+from .manifest_test import JournalTests, ResumeManifestTests
+from .scheduler_test import PartSchedulerTests
+from .partsize_test import AutoPartSizeTests
+from .bandwidth_test import BandwidthLimiterTests
+from .retry_test import RetryPolicyTests
+from .checksum_test import ChecksumTests
+from .metrics_test import MetricsObserverTests
+from .dispatcher_test import NotificationDispatcherTests
+from .index_test import SyncIndexTests
+from .cache_test import ContentCacheTests
+from .lease_test import PartLeasesTests
+from .coalesce_test import InFlightDownloadsTests, SharedLockTests
+from .metadata_test import MetadataCacheTests
+from .extract_test import ExtractTests
+from .remote_test import RemoteFileTests
 
 
 __all__ = [
     "S3ResumableTests",
     "UtilsTests",
-    "CliTests"
+    "FileCopyTests",
+    "CliTests",
+    "ResumeManifestTests",
+    "JournalTests",
+    "PartSchedulerTests",
+    "AutoPartSizeTests",
+    "BandwidthLimiterTests",
+    "RetryPolicyTests",
+    "ChecksumTests",
+    "MetricsObserverTests",
+    "NotificationDispatcherTests",
+    "SyncIndexTests",
+    "ContentCacheTests",
+    "PartLeasesTests",
+    "InFlightDownloadsTests",
+    "SharedLockTests",
+    "MetadataCacheTests",
+    "ExtractTests",
+    "RemoteFileTests"
 ]
+
+if sys.version_info >= (3, 5):
+    from .aio_test import AsyncS3ResumableTests  # noqa: F401
+    __all__.append("AsyncS3ResumableTests")
@@ -0,0 +1,285 @@
+# -*- coding: utf-8 -*-
+# Copyright 2020 Immfly.com. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"). You
+# may not use this file except in compliance with the License. A copy of
+# the License is located at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# or in the "license" file accompanying this file. This file is
+# distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF
+# ANY KIND, either express or implied. See the License for the specific
+# language governing permissions and limitations under the License.
+from __future__ import absolute_import
+
+import asyncio
+import io
+import os
+import shutil
+import tempfile
+import unittest
+from mock import patch
+
+from botocore.exceptions import ClientError
+
+from s3resumable import AsyncS3Resumable
+from s3resumable import S3ResumableBloqued
+from s3resumable import S3ResumableDownloadError
+from s3resumable import S3ResumableObserver
+from s3resumable.utils import get_filelock_path
+
+import filelock
+
+
+def run(coroutine):
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(coroutine)
+    finally:
+        loop.close()
+
+
+class AsyncBody:
+    def __init__(self, data):
+        self._data = io.BytesIO(data)
+
+    async def read(self, amt=-1):
+        return self._data.read(amt)
+
+
+class AsyncClient:
+    def __init__(self, objects):
+        self.objects = objects
+        self.requests = []
+
+    async def head_object(self, Bucket, Key):
+        self.requests.append(("head_object", Key))
+        return {"ResponseMetadata": {"HTTPHeaders": {
+            "content-length": str(len(self.objects[Key])),
+            "accept-ranges": "bytes",
+            "etag": '"etag"'}}}
+
+    async def get_object(self, Bucket, Key, Range, IfMatch=None):
+        self.requests.append(("get_object", Key, Range))
+        if Key not in self.objects:
+            raise ClientError({'Error': {'Code': '404'}}, 'GetObject')
+        start, end = Range[len('bytes='):].split('-')
+        return {'Body': AsyncBody(self.objects[Key][int(start):int(end) + 1])}
+
+    async def list_objects_v2(self, Bucket, Prefix, ContinuationToken=None):
+        keys = sorted(key for key in self.objects if key.startswith(Prefix))
+        page = int(ContinuationToken or 0)
+        return {"Contents": [{"Key": key, "Size": len(self.objects[key]), "ETag": '"etag"'}
+                             for key in keys[page * 2:page * 2 + 2]],
+                "IsTruncated": page * 2 + 2 < len(keys),
+                "NextContinuationToken": str(page + 1)}
+
+
+class AsyncObserver(S3ResumableObserver):
+    def __init__(self):
+        self.parts = []
+
+    async def update(self, file_info):
+        self.parts.append(file_info["part"])
+
+
+class AsyncS3ResumableTests(unittest.TestCase):
+    def setUp(self):
+        self.download_dir = tempfile.mkdtemp()
+        self.objects = {"data/a.bin": os.urandom(35), "data/sub/b.bin": os.urandom(5),
+                        "data/empty": b""}
+
+    def tearDown(self):
+        shutil.rmtree(self.download_dir)
+
+    def s3resumable(self, client, **kwargs):
+        s3r = AsyncS3Resumable(client, part_size_megabytes=1, max_concurrency=2, **kwargs)
+        self.set_part_size(s3r, 10)
+        return s3r
+
+    @staticmethod
+    def set_part_size(s3r, part_size_bytes):
+        s3r._core.options = s3r._core.options._replace(part_size_bytes=part_size_bytes)
+
+    def test_download_file(self):
+        for single_file in (False, True):
+            client = AsyncClient(self.objects)
+            s3r = self.s3resumable(client, single_file=single_file)
+            observer = AsyncObserver()
+            s3r.attach(observer)
+            try:
+                local_file_path = run(s3r.download_file("my_bucket", "data/a.bin",
+                                                        self.download_dir))
+            finally:
+                s3r.detach(observer)
+            with open(local_file_path, "rb") as result_file:
+                self.assertEqual(result_file.read(), self.objects["data/a.bin"])
+            self.assertEqual(sorted(observer.parts), [1, 2, 3, 4])
+            self.assertEqual(os.listdir(self.download_dir), ["a.bin"])
+            os.remove(local_file_path)
+
+    def test_stream(self):
+        data = self.objects["data/a.bin"]
+        client = AsyncClient(self.objects)
+        s3r = self.s3resumable(client)
+
+        async def collect(**kwargs):
+            return b"".join([chunk async for chunk in s3r.stream("my_bucket", "data/a.bin",
+                                                                 **kwargs)])
+
+        async def interrupt():
+            chunks = s3r.stream("my_bucket", "data/a.bin", temp_dir=self.download_dir,
+                                readahead=1)
+            first = await chunks.__anext__()
+            await chunks.aclose()
+            return first
+
+        self.assertEqual(run(collect()), data)
+        self.assertEqual(run(interrupt()), data[:10])
+        client.requests = []
+        self.assertEqual(run(collect(temp_dir=self.download_dir)), data)
+        self.assertNotIn(("get_object", "data/a.bin", "bytes=0-9"), client.requests)
+        self.assertEqual(os.listdir(self.download_dir), [])
+
+    def test_sync_only_methods(self):
+        s3r = self.s3resumable(AsyncClient(self.objects))
+        for method in ("open_stream", "decompress_file", "extract_archive", "open"):
+            self.assertFalse(hasattr(s3r, method))
+
+    def test_download_file_errors(self):
+        s3r = self.s3resumable(AsyncClient(self.objects))
+        self.set_part_size(s3r, 100)
+        s3r._transport.client.objects = {"data/a.bin": b"x"}
+        run(s3r.get_file_info("my_bucket", "data/a.bin"))
+        s3r._transport.client.objects = {}
+        with self.assertRaises(S3ResumableDownloadError):
+            run(s3r._transport.run(s3r._core.download_parts(
+                "my_bucket", "data/a.bin", "a.bin", self.download_dir,
+                listed_info={"key": "data/a.bin", "content_length": 1, "part_size": 100,
+                             "total_parts": 1})))
+
+    def test_download_file_executor(self):
+        s3r = self.s3resumable(AsyncClient(self.objects))
+        blocking = []
+
+        async def download():
+            loop = asyncio.get_event_loop()
+            run_in_executor = loop.run_in_executor
+
+            def record(executor, function, *args):
+                blocking.append(getattr(function, "__name__", None))
+                return run_in_executor(executor, function, *args)
+
+            with patch.object(loop, "run_in_executor", side_effect=record):
+                return await s3r.download_file("my_bucket", "data/a.bin", self.download_dir)
+
+        run(download())
+        # Disk writes of the parts are made out of the loop
+        self.assertEqual(blocking.count("sync_file"), 4)
+        self.assertEqual(blocking.count("open_output"), 4)
+        self.assertEqual(blocking.count("write"), 4)
+        for name in ("create_directory_tree", "isfile", "resume_file_info",
+                     "check_free_space", "join_parts", "remove"):
+            self.assertIn(name, blocking)
+
+    def test_download_file_locked(self):
+        s3r = self.s3resumable(AsyncClient(self.objects))
+        lock = filelock.FileLock(get_filelock_path("a.bin"))
+        with lock.acquire(), patch("s3resumable.aio.LOCK_TIMEOUT", 0.2):
+            with self.assertRaises(S3ResumableBloqued):
+                run(s3r.download_file("my_bucket", "data/a.bin", self.download_dir))
+
+    def test_download_file_coalesce(self):
+        client = AsyncClient(self.objects)
+        workers = [self.s3resumable(client, coalesce=True) for _ in range(2)]
+
+        async def download():
+            return await asyncio.gather(*[
+                worker.download_file("my_bucket", "data/a.bin", self.download_dir)
+                for worker in workers])
+
+        local_file_path = os.path.join(self.download_dir, "a.bin")
+        self.assertEqual(run(download()), [local_file_path, local_file_path])
+        self.assertEqual(len([request for request in client.requests
+                              if request[0] == "head_object"]), 1)
+        with open(local_file_path, "rb") as result_file:
+            self.assertEqual(result_file.read(), self.objects["data/a.bin"])
+
+    def test_download_file_coalesce_timeout(self):
+        client = AsyncClient(self.objects)
+        get_object = client.get_object
+        workers = [self.s3resumable(client, coalesce=True, lock_timeout=0.1)
+                   for _ in range(2)]
+
+        async def download():
+            resume = asyncio.Event()
+
+            async def slow_get_object(**kwargs):
+                await resume.wait()
+                return await get_object(**kwargs)
+
+            client.get_object = slow_get_object
+            task = asyncio.ensure_future(
+                workers[0].download_file("my_bucket", "data/a.bin", self.download_dir))
+            await asyncio.sleep(0.01)
+            # The joiner gives up after lock_timeout, the download in flight goes on
+            with self.assertRaises(S3ResumableBloqued):
+                await workers[1].download_file("my_bucket", "data/a.bin", self.download_dir)
+            self.assertFalse(task.done())
+            resume.set()
+            return await task
+
+        local_file_path = os.path.join(self.download_dir, "a.bin")
+        self.assertEqual(run(download()), local_file_path)
+        with open(local_file_path, "rb") as result_file:
+            self.assertEqual(result_file.read(), self.objects["data/a.bin"])
+
+    def test_download_prefix(self):
+        client = AsyncClient(self.objects)
+        s3r = self.s3resumable(client)
+        downloaded = run(s3r.download_prefix("my_bucket", "data/", self.download_dir))
+        self.assertEqual(sorted(downloaded), sorted(self.objects))
+        self.assertEqual(downloaded["data/sub/b.bin"],
+                         os.path.join(self.download_dir, "sub", "b.bin"))
+        for key, local_file_path in downloaded.items():
+            with open(local_file_path, "rb") as result_file:
+                self.assertEqual(result_file.read(), self.objects[key])
+        self.assertFalse([request for request in client.requests
+                          if request[0] == "head_object"])
+
+    def test_download_prefix_listing_error(self):
+        client = AsyncClient(self.objects)
+        list_objects_v2 = client.list_objects_v2
+        s3r = self.s3resumable(client)
+        cancelled = []
+
+        async def download():
+            started = asyncio.Event()
+
+            async def stalled_get_object(**kwargs):
+                started.set()
+                try:
+                    await asyncio.Event().wait()
+                except asyncio.CancelledError:
+                    cancelled.append(kwargs["Key"])
+                    raise
+
+            async def failing_list_objects_v2(**kwargs):
+                if kwargs.get("ContinuationToken"):
+                    await started.wait()
+                    raise ClientError({'Error': {'Code': '500'}}, 'ListObjectsV2')
+                return await list_objects_v2(**kwargs)
+
+            client.get_object = stalled_get_object
+            client.list_objects_v2 = failing_list_objects_v2
+            await s3r.download_prefix("my_bucket", "data/", self.download_dir)
+
+        with self.assertRaises(ClientError):
+            run(download())
+        # Downloads of the first page do not outlive the listing
+        self.assertTrue(cancelled)
+
+
+if __name__ == '__main__':
+    unittest.main()
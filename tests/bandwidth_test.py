@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -*-
+# Copyright 2020 Immfly.com. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"). You
+# may not use this file except in compliance with the License. A copy of
+# the License is located at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# or in the "license" file accompanying this file. This file is
+# distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF
+# ANY KIND, either express or implied. See the License for the specific
+# language governing permissions and limitations under the License.
+from __future__ import absolute_import
+
+import unittest
+
+from mock import patch
+
+from s3resumable.bandwidth import BandwidthLimiter
+
+
+class BandwidthLimiterTests(unittest.TestCase):
+    def test_init(self):
+        with self.assertRaises(ValueError):
+            BandwidthLimiter(0)
+        with self.assertRaises(ValueError):
+            BandwidthLimiter(100, burst=0)
+        self.assertEqual(BandwidthLimiter(100).burst, 100)
+        self.assertEqual(BandwidthLimiter(100, burst=10).burst, 10)
+
+    @patch('s3resumable.bandwidth.timer')
+    def test_reserve(self, mock_timer):
+        mock_timer.return_value = 0
+        limiter = BandwidthLimiter(100)
+        self.assertEqual(limiter.reserve(60), 0)
+        self.assertEqual(limiter.reserve(60), 0.2)
+        self.assertEqual(limiter.reserve(100), 1.2)
+        # Debt is paid back at max_bandwidth
+        mock_timer.return_value = 2.2
+        self.assertEqual(limiter.reserve(50), 0)
+        # Idle time refills up to burst
+        mock_timer.return_value = 100
+        self.assertEqual(limiter.reserve(150), 0.5)
+
+    @patch('s3resumable.bandwidth.timer')
+    def test_max_bandwidth(self, mock_timer):
+        mock_timer.return_value = 0
+        limiter = BandwidthLimiter(100, burst=100)
+        limiter.reserve(300)
+        mock_timer.return_value = 1
+        limiter.max_bandwidth = 1000
+        self.assertEqual(limiter.max_bandwidth, 1000)
+        self.assertEqual(limiter.reserve(0), 0.1)
+        with self.assertRaises(ValueError):
+            limiter.max_bandwidth = -1
+
+    @patch('s3resumable.bandwidth.time.sleep')
+    @patch('s3resumable.bandwidth.timer')
+    def test_consume(self, mock_timer, mock_sleep):
+        mock_timer.return_value = 0
+        limiter = BandwidthLimiter(100)
+        limiter.consume(100)
+        mock_sleep.assert_not_called()
+        limiter.consume(50)
+        mock_sleep.assert_called_once_with(0.5)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+# Copyright 2020 Immfly.com. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"). You
+# may not use this file except in compliance with the License. A copy of
+# the License is located at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# or in the "license" file accompanying this file. This file is
+# distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF
+# ANY KIND, either express or implied. See the License for the specific
+# language governing permissions and limitations under the License.
+from __future__ import absolute_import
+
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+from s3resumable.cache import ContentCache
+
+
+class ContentCacheTests(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.cache_dir = os.path.join(self.temp_dir, "cache")
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def write(self, name, data):
+        path = os.path.join(self.temp_dir, name)
+        with open(path, "wb") as data_file:
+            data_file.write(data)
+        return path
+
+    def test_get_put(self):
+        cache = ContentCache(self.cache_dir)
+        src = self.write("src", b"a" * 10)
+        dst = os.path.join(self.temp_dir, "dst")
+        self.assertFalse(cache.get('"a"', 10, dst))
+        cache.put('"a"', 10, src)
+        self.assertTrue(cache.get('"a"', 10, dst))
+        with open(dst, "rb") as dst_file:
+            self.assertEqual(dst_file.read(), b"a" * 10)
+        self.assertEqual(os.stat(src).st_ino, os.stat(dst).st_ino)
+        self.assertFalse(cache.get('"a"', 11, dst))
+        self.assertFalse(cache.get(None, 10, dst))
+
+        # Truncated entries are discarded
+        with open(cache.entry_path('"a"', 10), "r+b") as entry:
+            entry.truncate(5)
+        self.assertFalse(cache.get('"a"', 10, dst))
+        self.assertFalse(os.path.exists(cache.entry_path('"a"', 10)))
+
+    def test_copies(self):
+        cache = ContentCache(self.cache_dir, hardlinks=False)
+        src = self.write("src", b"a" * 10)
+        cache.put('"a"', 10, src)
+        self.assertNotEqual(os.stat(src).st_ino, os.stat(cache.entry_path('"a"', 10)).st_ino)
+
+    def test_evict(self):
+        cache = ContentCache(self.cache_dir, max_size=25)
+        for name in ("a", "b"):
+            cache.put('"{}"'.format(name), 10, self.write(name, name.encode() * 10))
+        # a is the most recently used entry
+        os.utime(cache.entry_path('"b"', 10), (time.time() - 60, time.time()))
+        self.assertTrue(cache.get('"a"', 10, os.path.join(self.temp_dir, "dst")))
+        cache.put('"c"', 10, self.write("c", b"c" * 10))
+        self.assertTrue(os.path.exists(cache.entry_path('"a"', 10)))
+        self.assertFalse(os.path.exists(cache.entry_path('"b"', 10)))
+        self.assertTrue(os.path.exists(cache.entry_path('"c"', 10)))
+        # Downloaded files are kept
+        self.assertTrue(os.path.exists(os.path.join(self.temp_dir, "b")))
+        self.assertRaises(ValueError, ContentCache, self.cache_dir, max_size=-1)
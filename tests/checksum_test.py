@@ -0,0 +1,119 @@
+# -*- coding: utf-8 -*-
+# Copyright 2020 Immfly.com. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"). You
+# may not use this file except in compliance with the License. A copy of
+# the License is located at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# or in the "license" file accompanying this file. This file is
+# distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF
+# ANY KIND, either express or implied. See the License for the specific
+# language governing permissions and limitations under the License.
+from __future__ import absolute_import
+
+import base64
+import hashlib
+import io
+import struct
+import unittest
+import zlib
+
+from s3resumable.checksum import (ObjectHasher, PartHasher, combine_crc, head_checksums,
+                                  object_checksum)
+
+PARTS = [b'a' * 1000, b'b' * 777, b'c' * 10]
+
+
+def crc(data, polynomial, width):
+    mask = (1 << width) - 1
+    value = mask
+    for byte in bytearray(data):
+        value ^= byte
+        for _ in range(8):
+            value = (value >> 1) ^ polynomial if value & 1 else value >> 1
+    return value ^ mask
+
+
+class ChecksumTests(unittest.TestCase):
+    def test_part_hasher(self):
+        hasher = PartHasher(["md5", "crc32", "sha256", "unknown"])
+        hasher.update(b'abc')
+        hasher.update_file(io.BytesIO(b'defghi'), 3)
+        self.assertEqual(hasher.digests(), {
+            "md5": hashlib.md5(b'abcdef').hexdigest(),
+            "sha256": hashlib.sha256(b'abcdef').hexdigest(),
+            "crc32": zlib.crc32(b'abcdef') & 0xFFFFFFFF})
+
+    def test_combine_crc(self):
+        data = b''.join(PARTS)
+        self.assertEqual(combine_crc("crc32", zlib.crc32(PARTS[0]), zlib.crc32(PARTS[1]),
+                                     len(PARTS[1])), zlib.crc32(PARTS[0] + PARTS[1]))
+        self.assertEqual(combine_crc("crc32", 5, 0, 0), 5)
+        for algorithm, polynomial, width, check in (
+                ("crc32c", 0x82F63B78, 32, 0xE3069283),
+                ("crc64nvme", 0x9A6C9329AC4BC9B5, 64, 0xAE8B14860A799888)):
+            self.assertEqual(crc(b'123456789', polynomial, width), check)
+            self.assertEqual(combine_crc(algorithm, crc(data[:500], polynomial, width),
+                                         crc(data[500:], polynomial, width), len(data) - 500),
+                             crc(data, polynomial, width))
+
+    def test_head_checksums(self):
+        self.assertEqual(head_checksums({"ChecksumCRC32C": "abc=", "ChecksumSHA1": None},
+                                        '"etag"'),
+                         {"crc32c": "abc=", "md5": "etag"})
+        self.assertEqual(head_checksums({"ServerSideEncryption": "aws:kms"}, '"etag"'), {})
+        self.assertEqual(head_checksums({"SSECustomerAlgorithm": "AES256"}, '"etag"'), {})
+
+    def test_object_checksum(self):
+        digests = []
+        for part in PARTS:
+            hasher = PartHasher(["md5", "crc32", "sha256"])
+            hasher.update(part)
+            digests.append(hasher.digests())
+        lengths = [len(part) for part in PARTS]
+        data = b''.join(PARTS)
+
+        crc32 = base64.b64encode(struct.pack(">I", zlib.crc32(data) & 0xFFFFFFFF)).decode()
+        self.assertEqual(object_checksum("crc32", crc32, digests, lengths), crc32)
+
+        etag = hashlib.md5(b''.join(hashlib.md5(part).digest() for part in PARTS)).hexdigest()
+        etag += "-3"
+        self.assertEqual(object_checksum("md5", etag, digests, lengths, True), etag)
+        self.assertIsNone(object_checksum("md5", etag, digests, lengths, False))
+        self.assertIsNone(object_checksum("md5", etag[:-1] + "4", digests, lengths, True))
+        self.assertIsNone(object_checksum("md5", "etag", digests, lengths))
+        self.assertEqual(object_checksum("md5", "etag", digests[:1], lengths[:1]),
+                         hashlib.md5(PARTS[0]).hexdigest())
+
+        sha256 = base64.b64encode(hashlib.sha256(b''.join(
+            hashlib.sha256(part).digest() for part in PARTS)).digest()).decode() + "-3"
+        self.assertEqual(object_checksum("sha256", sha256, digests, lengths, True), sha256)
+
+        crc32 = base64.b64encode(struct.pack(">I", zlib.crc32(b''.join(
+            struct.pack(">I", zlib.crc32(part) & 0xFFFFFFFF) for part in PARTS)) & 0xFFFFFFFF))
+        crc32 = crc32.decode() + "-3"
+        self.assertEqual(object_checksum("crc32", crc32, digests, lengths, True), crc32)
+
+    def test_object_hasher(self):
+        data = b''.join(PARTS)
+        object_hasher = ObjectHasher(["md5", "sha256"])
+        part_hasher = PartHasher(["md5"])
+        # Bytes after a gap are not hashed, bytes hashed already are skipped
+        object_hasher.update(1000, PARTS[1])
+        writer = object_hasher.part_hasher(0, part_hasher)
+        writer.update(PARTS[0][:600])
+        object_hasher.part_hasher(0).update(PARTS[0][:700])
+        writer.update(PARTS[0][600:])
+        self.assertEqual(object_hasher.position, 1000)
+        self.assertEqual(writer.digests(), {"md5": hashlib.md5(PARTS[0]).hexdigest()})
+        object_hasher.part_hasher(1000).update_file(io.BytesIO(data[1000:]), 787)
+        self.assertEqual(object_hasher.position, len(data))
+        self.assertEqual(object_hasher.checksums(), {
+            "md5": hashlib.md5(data).hexdigest(),
+            "sha256": base64.b64encode(hashlib.sha256(data).digest()).decode()})
+
+
+if __name__ == '__main__':
+    unittest.main()
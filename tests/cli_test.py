@@ -13,7 +13,11 @@
 # language governing permissions and limitations under the License.
 from __future__ import absolute_import
 
+import argparse
+import os
+import shutil
 import sys
+import tempfile
 
 try:
     import unittest2 as unittest
@@ -24,8 +28,11 @@ from mock import patch
 from mock import MagicMock
 from mock import mock_open
 
+from s3resumable import S3ResumableDownloadError
 from s3resumable.cli import Cli
 from s3resumable.cli import main
+from s3resumable.cli import read_batch
+from s3resumable.cli import size_parser
 
 from botocore.exceptions import ClientError
 from filelock import Timeout
@@ -64,6 +71,209 @@ class CliTests(unittest.TestCase):
             cli.start()
         self.assertIn('downloaded', cm.output[0])
 
+    @patch('s3resumable.cli.S3Resumable')
+    def test_main(self, mock_s3r):
+        # An invalid single source exits with 0, like before batches
+        with patch('argparse._sys.argv', ['s3resumable', 's://my_bucket/test']),\
+                self.assertLogs():
+            main()
+        with patch('s3resumable.cli.Cli.start', return_value=1):
+            with self.assertRaises(SystemExit) as cm:
+                main()
+        self.assertEqual(cm.exception.code, 1)
+
+    @patch('s3resumable.cli.S3Resumable')
+    def test_start_file_name(self, mock_s3r):
+        cli = Cli()
+        with patch('argparse._sys.argv', ['s3resumable', 's3://my_bucket/test', 'out.bin']),\
+                self.assertLogs():
+            cli.start()
+        # A bare file name is downloaded into the working directory
+        mock_s3r.return_value.download_file.assert_called_once_with(
+            'my_bucket', 'test', '.', download_file='out.bin', temp_dir=None)
+
+    @patch('s3resumable.cli.S3Resumable')
+    def test_start_recursive(self, mock_s3r):
+        cli = Cli()
+        mock_s3r.return_value.download_prefix.return_value = {"a": "/tmp/a", "b": "/tmp/b"}
+        with patch('argparse._sys.argv', ['s3resumable', '--recursive', 's3://my_bucket/logs/',
+                                          '/tmp/logs']), self.assertLogs() as cm:
+            cli.start()
+        mock_s3r.return_value.download_prefix.assert_called_once_with(
+            'my_bucket', 'logs/', '/tmp/logs', temp_dir=None, index=None)
+        self.assertEqual(cm.output, ['INFO:s3resumable.cli:2 files downloaded'])
+
+    @patch('s3resumable.cli.SyncIndex')
+    @patch('s3resumable.cli.S3Resumable')
+    def test_start_sync_index(self, mock_s3r, mock_index):
+        cli = Cli()
+        with patch('argparse._sys.argv', ['s3resumable', '--recursive', '--sync-index',
+                                          '/tmp/logs.db', 's3://my_bucket/logs/',
+                                          '/tmp/logs']), self.assertLogs():
+            cli.start()
+        mock_index.assert_called_once_with('/tmp/logs.db')
+        mock_s3r.return_value.download_prefix.assert_called_once_with(
+            'my_bucket', 'logs/', '/tmp/logs', temp_dir=None, index=mock_index.return_value)
+        mock_index.return_value.close.assert_called_once_with()
+
+    @patch('s3resumable.cli.boto3')
+    @patch('s3resumable.cli.S3Resumable')
+    def test_start_batch(self, mock_s3r, mock_boto3):
+        temp_dir = tempfile.mkdtemp()
+        try:
+            batch_path = os.path.join(temp_dir, 'batch.txt')
+            with open(batch_path, 'w') as batch_file:
+                batch_file.write('# nightly\n'
+                                 's3://my_bucket/a.bin\n'
+                                 's3://my_bucket/b.bin /tmp/b/\n'
+                                 '{"source": "s3://my_bucket/c.bin", "target": "/tmp/c.bin"}\n'
+                                 's://my_bucket/d.bin\n')
+
+            def download_file(bucket, key, download_dir, download_file=None, temp_dir=None):
+                if key == 'b.bin':
+                    raise S3ResumableDownloadError('failed')
+                return os.path.join(download_dir, download_file or key)
+
+            mock_s3r.return_value.download_file.side_effect = download_file
+            cli = Cli()
+            with patch('argparse._sys.argv', ['s3resumable', '--from-file', batch_path,
+                                              '--jobs', '4', '--concurrency', '4',
+                                              temp_dir]), self.assertLogs() as cm:
+                self.assertEqual(cli.start(), 1)
+            # One client and one instance for the whole batch
+            mock_boto3.client.assert_called_once()
+            self.assertEqual(
+                mock_boto3.client.call_args[1]['config'].max_pool_connections, 16)
+            mock_s3r.assert_called_once()
+            mock_s3r.return_value.download_file.assert_any_call(
+                'my_bucket', 'a.bin', temp_dir, download_file=None, temp_dir=None)
+            mock_s3r.return_value.download_file.assert_any_call(
+                'my_bucket', 'c.bin', '/tmp', download_file='c.bin', temp_dir=None)
+            self.assertIn('ERROR:s3resumable.cli:s3://my_bucket/b.bin failed: failed', cm.output)
+            self.assertIn('ERROR:s3resumable.cli:s://my_bucket/d.bin failed: invalid s3 url',
+                          cm.output)
+            self.assertEqual(cm.output[-1], 'INFO:s3resumable.cli:2 downloaded, 2 failed')
+        finally:
+            shutil.rmtree(temp_dir)
+
+    def test_read_batch(self):
+        self.assertEqual(list(read_batch(['', 's3://b/a /tmp/a b.bin', '{"source": "s3://b/c"}'],
+                                         '/tmp')),
+                         [('s3://b/a', '/tmp/a b.bin'), ('s3://b/c', '/tmp')])
+        self.assertRaises(ValueError, list, read_batch(['{"target": "/tmp"}'], '/tmp'))
+        self.assertRaises(ValueError, list, read_batch(['{"source": '], '/tmp'))
+
+    def test_size_parser(self):
+        size_type = size_parser("size", 0)
+        self.assertEqual(size_type("0"), 0)
+        self.assertEqual(size_type("1.5k"), 1500)
+        self.assertEqual(size_type("10G"), 10000000000)
+        self.assertRaises(argparse.ArgumentTypeError, size_type, "-1")
+        self.assertRaises(ValueError, size_type, "M")
+        bandwidth_type = size_parser("bandwidth", 1)
+        self.assertEqual(bandwidth_type.__name__, "bandwidth_type")
+        self.assertRaises(argparse.ArgumentTypeError, bandwidth_type, "0")
+
+    @patch('s3resumable.cli.S3Resumable')
+    def test_start_auto_part_size(self, mock_s3r):
+        cli = Cli()
+        with patch('argparse._sys.argv', ['s3resumable', '--part-size', 'auto',
+                                          's3://my_bucket/test']), self.assertLogs():
+            cli.start()
+        self.assertEqual(mock_s3r.call_args[1]['part_size_megabytes'], 'auto')
+
+    @patch('s3resumable.cli.S3Resumable')
+    def test_start_max_bandwidth(self, mock_s3r):
+        cli = Cli()
+        with patch('argparse._sys.argv', ['s3resumable', '--max-bandwidth', '2.5M',
+                                          's3://my_bucket/test']), self.assertLogs():
+            cli.start()
+        self.assertEqual(mock_s3r.call_args[1]['max_bandwidth'], 2500000)
+
+    @patch('s3resumable.cli.sys')
+    @patch('s3resumable.cli.S3Resumable')
+    def test_start_stream(self, mock_s3r, mock_sys):
+        cli = Cli()
+        mock_s3r.return_value.stream.return_value = [b"a", b"b"]
+        with patch('argparse._sys.argv', ['s3resumable', 's3://my_bucket/test', '-']):
+            cli.start()
+        mock_s3r.return_value.stream.assert_called_once_with('my_bucket', 'test', temp_dir=None)
+        mock_sys.stdout.buffer.write.assert_any_call(b"a")
+        mock_sys.stdout.buffer.write.assert_called_with(b"b")
+
+    @patch('s3resumable.cli.S3Resumable')
+    def test_start_cooperative(self, mock_s3r):
+        cli = Cli()
+        with patch('argparse._sys.argv', ['s3resumable', '--cooperative', '--lease-ttl', '30',
+                                          '--temp-dir', '/shared/parts',
+                                          's3://my_bucket/test']), self.assertLogs():
+            cli.start()
+        self.assertTrue(mock_s3r.call_args[1]['cooperative'])
+        self.assertEqual(mock_s3r.call_args[1]['lease_ttl'], 30)
+
+    @patch('s3resumable.cli.MetadataCache')
+    @patch('s3resumable.cli.S3Resumable')
+    def test_start_metadata_cache(self, mock_s3r, mock_cache):
+        cli = Cli()
+        with patch('argparse._sys.argv', ['s3resumable', '--metadata-cache', '/tmp/meta.json',
+                                          '--metadata-ttl', '60', 's3://my_bucket/test']), \
+                self.assertLogs():
+            cli.start()
+        mock_cache.assert_called_once_with(ttl=60, path='/tmp/meta.json')
+        self.assertEqual(mock_s3r.call_args[1]['metadata_cache'], mock_cache.return_value)
+        mock_cache.return_value.flush.assert_called_once_with()
+
+    @patch('s3resumable.cli.S3Resumable')
+    def test_start_decompress(self, mock_s3r):
+        cli = Cli()
+        mock_s3r.return_value.extract_archive.return_value = ['/tmp/x/a', '/tmp/x/b']
+        with patch('argparse._sys.argv', ['s3resumable', '--decompress',
+                                          's3://my_bucket/a.csv.gz', '/tmp/']), \
+                self.assertLogs():
+            cli.start()
+        mock_s3r.return_value.decompress_file.assert_called_once_with(
+            'my_bucket', 'a.csv.gz', '/tmp/', download_file=None, temp_dir=None)
+        with patch('argparse._sys.argv', ['s3resumable', '--extract',
+                                          's3://my_bucket/x.tar.gz', '/tmp/x']), \
+                self.assertLogs() as cm:
+            cli.start()
+        mock_s3r.return_value.extract_archive.assert_called_once_with(
+            'my_bucket', 'x.tar.gz', '/tmp/x', temp_dir=None)
+        self.assertEqual(cm.output, ['INFO:s3resumable.cli:2 files extracted to /tmp/x'])
+
+    @patch('s3resumable.cli.S3Resumable')
+    def test_start_coalesce(self, mock_s3r):
+        cli = Cli()
+        with patch('argparse._sys.argv', ['s3resumable', '--coalesce', '--lock-timeout', '-1',
+                                          's3://my_bucket/test']), self.assertLogs():
+            cli.start()
+        self.assertTrue(mock_s3r.call_args[1]['coalesce'])
+        self.assertEqual(mock_s3r.call_args[1]['lock_timeout'], -1)
+
+    @patch('s3resumable.cli.ContentCache')
+    @patch('s3resumable.cli.S3Resumable')
+    def test_start_cache(self, mock_s3r, mock_cache):
+        cli = Cli()
+        with patch('argparse._sys.argv', ['s3resumable', '--cache-dir', '/tmp/cache',
+                                          '--cache-size', '10G', 's3://my_bucket/test']), \
+                self.assertLogs():
+            cli.start()
+        mock_cache.assert_called_once_with('/tmp/cache', max_size=10000000000)
+        self.assertEqual(mock_s3r.call_args[1]['cache'], mock_cache.return_value)
+
+    @patch('s3resumable.cli.MetricsObserver')
+    @patch('s3resumable.cli.S3Resumable')
+    def test_start_metrics(self, mock_s3r, mock_metrics):
+        cli = Cli()
+        with patch('argparse._sys.argv', ['s3resumable', '--prometheus-file', '/tmp/s3r.prom',
+                                          '--statsd', 'localhost:8125',
+                                          's3://my_bucket/test']), self.assertLogs():
+            cli.start()
+        mock_metrics.assert_called_once_with(prometheus_file='/tmp/s3r.prom',
+                                             statsd_address=('localhost', 8125))
+        mock_s3r.return_value.attach.assert_called_with(mock_metrics.return_value)
+        mock_metrics.return_value.flush.assert_called_once_with()
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+# Copyright 2020 Immfly.com. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"). You
+# may not use this file except in compliance with the License. A copy of
+# the License is located at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# or in the "license" file accompanying this file. This file is
+# distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF
+# ANY KIND, either express or implied. See the License for the specific
+# language governing permissions and limitations under the License.
+from __future__ import absolute_import
+
+import fcntl
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+
+import filelock
+from mock import patch
+
+from s3resumable.coalesce import InFlightDownloads, SharedLock
+
+
+class InFlightDownloadsTests(unittest.TestCase):
+    def test_join(self):
+        in_flight = InFlightDownloads()
+        future, started = in_flight.join("a")
+        self.assertTrue(started)
+        self.assertEqual(in_flight.join("a"), (future, False))
+        in_flight.finish("a", result="a.bin")
+        self.assertEqual(future.result(), "a.bin")
+
+        # Finished downloads are not shared anymore
+        future, started = in_flight.join("a")
+        self.assertTrue(started)
+        in_flight.finish("a", error=IOError("failed"))
+        self.assertRaises(IOError, future.result)
+
+
+class SharedLockTests(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.temp_dir, "a.bin.lock")
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def test_acquire(self):
+        first = SharedLock(self.path)
+        second = SharedLock(self.path)
+        first.acquire()
+        # The waiter blocks in the kernel instead of polling the lock
+        with patch("s3resumable.coalesce.fcntl.flock", wraps=fcntl.flock) as flock:
+            self.assertRaises(filelock.Timeout, second.acquire, 0.3)
+        self.assertEqual([call[0][1] for call in flock.call_args_list],
+                         [fcntl.LOCK_EX | fcntl.LOCK_NB, fcntl.LOCK_EX])
+        self.assertIsNone(second._file)
+
+        # Waiters get the lock when it is released, with or without timeout
+        for timeout in (-1, 5):
+            acquired = threading.Event()
+
+            def wait(timeout=timeout, acquired=acquired):
+                lock = SharedLock(self.path)
+                lock.acquire(timeout)
+                acquired.set()
+                lock.release()
+
+            waiter = threading.Thread(target=wait)
+            waiter.start()
+            self.assertFalse(acquired.wait(0.1))
+            first.release()
+            waiter.join(5)
+            self.assertTrue(acquired.is_set())
+            first.acquire()
+        first.release()
+
+        # The lock taken by the cancelled waiter was dropped at once
+        second.acquire(1)
+        second.release()
@@ -0,0 +1,81 @@
+# -*- coding: utf-8 -*-
+# Copyright 2020 Immfly.com. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"). You
+# may not use this file except in compliance with the License. A copy of
+# the License is located at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# or in the "license" file accompanying this file. This file is
+# distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF
+# ANY KIND, either express or implied. See the License for the specific
+# language governing permissions and limitations under the License.
+from __future__ import absolute_import
+
+import threading
+import unittest
+from mock import patch
+
+from s3resumable.dispatcher import NotificationDispatcher, NotificationQueue
+
+
+class NotificationDispatcherTests(unittest.TestCase):
+    def test_queue_overflow(self):
+        queue = NotificationQueue(2, "block")
+        self.assertTrue(queue.offer("a", 1))
+        self.assertTrue(queue.offer("b", 1))
+        self.assertFalse(queue.offer("a", 2))
+        self.assertEqual(queue.dropped, 0)
+
+        queue = NotificationQueue(2, "drop_oldest")
+        for part in range(3):
+            queue.offer("a", part)
+        self.assertEqual([queue.pop(), queue.pop()], [1, 2])
+        self.assertEqual(queue.dropped, 1)
+
+        queue = NotificationQueue(3, "coalesce")
+        for download, part in (("a", 1), ("b", 1), ("a", 2), ("b", 2), ("c", 1)):
+            queue.offer(download, (download, part))
+        self.assertEqual([queue.pop() for _ in range(len(queue))],
+                         [("b", 2), ("a", 2), ("c", 1)])
+        self.assertEqual(queue.dropped, 2)
+
+        self.assertRaises(ValueError, NotificationQueue, 0, "block")
+        self.assertRaises(ValueError, NotificationQueue, 1, "wait")
+
+    def test_dispatch_in_order(self):
+        delivered = []
+        release = threading.Event()
+
+        def notify(notification):
+            release.wait()
+            delivered.append(notification)
+
+        dispatcher = NotificationDispatcher(notify, max_size=2)
+        putter = threading.Thread(target=lambda: [dispatcher.put("a", part)
+                                                  for part in range(10)])
+        putter.start()
+        putter.join(0.1)
+        # Blocked while the observer is busy
+        self.assertTrue(putter.is_alive())
+        release.set()
+        putter.join()
+        dispatcher.join()
+        self.assertEqual(delivered, list(range(10)))
+        self.assertEqual(dispatcher.dropped, 0)
+
+    @patch('s3resumable.dispatcher.LOGGER')
+    def test_dispatch_errors(self, mock_logger):
+        delivered = []
+
+        def notify(notification):
+            delivered.append(notification)
+            raise ValueError(notification)
+
+        dispatcher = NotificationDispatcher(notify)
+        dispatcher.put("a", 1)
+        dispatcher.put("a", 2)
+        dispatcher.join()
+        self.assertEqual(delivered, [1, 2])
+        self.assertEqual(mock_logger.exception.call_count, 2)
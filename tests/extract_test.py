@@ -0,0 +1,121 @@
+# -*- coding: utf-8 -*-
+# Copyright 2020 Immfly.com. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"). You
+# may not use this file except in compliance with the License. A copy of
+# the License is located at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# or in the "license" file accompanying this file. This file is
+# distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF
+# ANY KIND, either express or implied. See the License for the specific
+# language governing permissions and limitations under the License.
+from __future__ import absolute_import
+
+import bz2
+import gzip
+import io
+import os
+import shutil
+import tarfile
+import tempfile
+import unittest
+
+from s3resumable.exceptions import S3ResumableExtractError
+from s3resumable.extract import (ExtractCheckpoint, archive_compression, checkpoint_path,
+                                 compression_of, decompress_chunks, member_path)
+
+
+def gzip_data(data):
+    buf = io.BytesIO()
+    with gzip.GzipFile(fileobj=buf, mode="wb") as gzip_file:
+        gzip_file.write(data)
+    return buf.getvalue()
+
+
+def split(data, size):
+    return [data[offset:offset + size] for offset in range(0, len(data), size)]
+
+
+class ExtractTests(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def test_compression_of(self):
+        self.assertEqual(compression_of("a.csv.gz"), ("gzip", "a.csv"))
+        self.assertEqual(compression_of("a.zst"), ("zstd", "a"))
+        self.assertEqual(compression_of("a.csv"), (None, "a.csv"))
+        self.assertEqual(compression_of(".gz"), (None, ".gz"))
+        self.assertEqual(archive_compression("a.tar.bz2"), "bz2")
+        self.assertEqual(archive_compression("a.tgz"), "gzip")
+        self.assertIsNone(archive_compression("a.tar"))
+        self.assertRaises(ValueError, archive_compression, "a.csv.gz")
+
+    def test_decompress_chunks(self):
+        data = os.urandom(1000) * 20
+        # Concatenated streams, split anywhere
+        compressed = gzip_data(data[:5000]) + gzip_data(data[5000:])
+        self.assertEqual(b"".join(decompress_chunks(split(compressed, 7), "gzip")), data)
+        compressed = bz2.compress(data[:5000]) + bz2.compress(data[5000:])
+        self.assertEqual(b"".join(decompress_chunks(split(compressed, 100), "bz2")), data)
+
+        with self.assertRaises(S3ResumableExtractError):
+            list(decompress_chunks([compressed[:-10]], "bz2"))
+        with self.assertRaises(S3ResumableExtractError):
+            list(decompress_chunks([b"not gzip data"], "gzip"))
+        self.assertRaises(ValueError, list, decompress_chunks([], "rar"))
+
+    def test_member_path(self):
+        member = tarfile.TarInfo("dir/a.bin")
+        self.assertEqual(member_path(self.temp_dir, member),
+                         os.path.join(os.path.realpath(self.temp_dir), "dir", "a.bin"))
+        for name in ("../a.bin", "/etc/passwd"):
+            self.assertRaises(S3ResumableExtractError, member_path, self.temp_dir,
+                              tarfile.TarInfo(name))
+        link = tarfile.TarInfo("dir/link")
+        link.type = tarfile.SYMTYPE
+        link.linkname = "../a.bin"
+        member_path(self.temp_dir, link)
+        link.linkname = "../../a.bin"
+        self.assertRaises(S3ResumableExtractError, member_path, self.temp_dir, link)
+
+    def test_checkpoint(self):
+        path = os.path.join(self.temp_dir, "a.tar.checkpoint")
+        checkpoint = ExtractCheckpoint(path)
+        self.assertIsNone(checkpoint.load())
+        checkpoint.start('"a"', 100)
+        checkpoint.add_written(10)
+        checkpoint.add_member("a.bin", 5)
+        with open(path, "a") as checkpoint_file:
+            checkpoint_file.write('{"member": "b.b')
+
+        checkpoint = ExtractCheckpoint(path)
+        self.assertEqual(checkpoint.load(), {"etag": '"a"', "content_length": 100})
+        self.assertTrue(checkpoint.matches('"a"', 100))
+        self.assertFalse(checkpoint.matches('"b"', 100))
+        self.assertEqual(checkpoint.written, 10)
+        self.assertTrue(checkpoint.extracted("a.bin", 5))
+        self.assertFalse(checkpoint.extracted("a.bin", 6))
+        self.assertFalse(checkpoint.extracted("b.bin", 5))
+        checkpoint.remove()
+        self.assertFalse(os.path.exists(path))
+
+    def test_checkpoint_path(self):
+        path = checkpoint_path(self.temp_dir, "my_bucket", "a/data.gz", "out/data")
+        self.assertEqual(os.path.dirname(path), self.temp_dir)
+        self.assertTrue(os.path.basename(path).startswith("data.gz."))
+        self.assertEqual(path, checkpoint_path(self.temp_dir, "my_bucket", "a/data.gz",
+                                               os.path.abspath("out/data")))
+        # Keys with the same name, or the same key to other targets, don't collide
+        for bucket, key, target in (("my_bucket", "b/data.gz", "out/data"),
+                                    ("other_bucket", "a/data.gz", "out/data"),
+                                    ("my_bucket", "a/data.gz", "other/data")):
+            self.assertNotEqual(path, checkpoint_path(self.temp_dir, bucket, key, target))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+# Copyright 2020 Immfly.com. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"). You
+# may not use this file except in compliance with the License. A copy of
+# the License is located at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# or in the "license" file accompanying this file. This file is
+# distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF
+# ANY KIND, either express or implied. See the License for the specific
+# language governing permissions and limitations under the License.
+from __future__ import absolute_import
+
+import datetime
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+from dateutil.tz import tzutc
+
+from s3resumable.index import SyncIndex
+
+
+class SyncIndexTests(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.local_file_path = os.path.join(self.temp_dir, 'a.txt')
+        with open(self.local_file_path, 'wb') as local_file:
+            local_file.write(b'a' * 10)
+        self.listed = {'Key': 'logs/a.txt', 'Size': 10, 'ETag': '"a"',
+                       'LastModified': datetime.datetime(2020, 1, 1, tzinfo=tzutc())}
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def test_unchanged(self):
+        index_path = os.path.join(self.temp_dir, 'index.db')
+        with SyncIndex(index_path) as index:
+            index.update('my_bucket', self.listed, self.local_file_path)
+            self.assertTrue(index.unchanged('my_bucket', self.listed, self.local_file_path))
+            self.assertFalse(index.unchanged('other_bucket', dict(self.listed, LastModified=None),
+                                             self.local_file_path))
+            self.assertFalse(index.unchanged('my_bucket', dict(self.listed, ETag='"b"'),
+                                             self.local_file_path))
+            self.assertFalse(index.unchanged('my_bucket', self.listed,
+                                             os.path.join(self.temp_dir, 'b.txt')))
+            with open(self.local_file_path, 'ab') as local_file:
+                local_file.write(b'a')
+            self.assertFalse(index.unchanged('my_bucket', dict(self.listed, Size=10),
+                                             self.local_file_path))
+
+        # Changes are kept by close
+        with SyncIndex(index_path) as index:
+            self.assertEqual(index.get('my_bucket', 'logs/a.txt'),
+                             {'etag': '"a"', 'size': 10, 'local_path': self.local_file_path,
+                              'last_modified': '2020-01-01T00:00:00+00:00'})
+
+    def test_adopt(self):
+        with SyncIndex(os.path.join(self.temp_dir, 'index.db')) as index:
+            self.assertTrue(index.unchanged('my_bucket', self.listed, self.local_file_path))
+            self.assertEqual(index.get('my_bucket', 'logs/a.txt')['etag'], '"a"')
+
+            # Objects newer than the local file are downloaded again
+            newer = dict(self.listed, Key='logs/b.txt',
+                         LastModified=datetime.datetime.fromtimestamp(time.time() + 60,
+                                                                      tzutc()))
+            self.assertFalse(index.unchanged('my_bucket', newer, self.local_file_path))
+            self.assertIsNone(index.get('my_bucket', 'logs/b.txt'))
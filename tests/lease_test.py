@@ -0,0 +1,95 @@
+# -*- coding: utf-8 -*-
+# Copyright 2020 Immfly.com. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"). You
+# may not use this file except in compliance with the License. A copy of
+# the License is located at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# or in the "license" file accompanying this file. This file is
+# distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF
+# ANY KIND, either express or implied. See the License for the specific
+# language governing permissions and limitations under the License.
+from __future__ import absolute_import
+
+import errno
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+from mock import patch
+
+from s3resumable.lease import PartLeases
+
+
+class PartLeasesTests(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.part_path = os.path.join(self.temp_dir, "a.bin.part{part}")
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def test_acquire(self):
+        first = PartLeases(self.part_path, owner="first")
+        second = PartLeases(self.part_path, owner="second")
+        self.assertTrue(first.acquire(0))
+        self.assertFalse(second.acquire(0))
+        self.assertTrue(second.acquire(1))
+        with open(first.lease_path(0)) as lease_file:
+            self.assertEqual(lease_file.read(), "first")
+        self.assertEqual(first.owner_part_path.format(part=0),
+                         os.path.join(self.temp_dir, "a.bin.part0.first"))
+
+        first.release(0)
+        self.assertFalse(first.held(0))
+        self.assertFalse(os.path.exists(first.lease_path(0)))
+        self.assertTrue(second.acquire(0))
+        self.assertRaises(ValueError, PartLeases, self.part_path, ttl=0)
+
+    def test_take_over(self):
+        dead = PartLeases(self.part_path, ttl=10, owner="dead")
+        alive = PartLeases(self.part_path, ttl=10, owner="alive")
+        self.assertTrue(dead.acquire(0))
+        dead_part = dead.owner_part_path.format(part=0)
+        open(dead_part, "wb").close()
+        self.assertFalse(alive.acquire(0))
+
+        expired = time.time() - 20
+        os.utime(dead.lease_path(0), (expired, expired))
+        self.assertTrue(dead.held(0))
+        self.assertTrue(alive.acquire(0))
+        # Seen by the dead owner before it renews the lease
+        self.assertFalse(dead.held(0))
+        self.assertTrue(alive.held(0))
+        self.assertFalse(os.path.exists(dead_part))
+        self.assertEqual(sorted(os.listdir(self.temp_dir)), ["a.bin.part0.lease"])
+
+        # The dead owner does not release the lease taken over
+        dead.release(0)
+        self.assertTrue(os.path.exists(alive.lease_path(0)))
+
+    def test_renew(self):
+        with PartLeases(self.part_path, ttl=0.3, owner="first") as leases:
+            self.assertTrue(leases.acquire(0))
+            expired = time.time() - 20
+            os.utime(leases.lease_path(0), (expired, expired))
+            time.sleep(0.25)
+            self.assertGreater(os.path.getmtime(leases.lease_path(0)), expired)
+        self.assertFalse(os.path.exists(leases.lease_path(0)))
+
+    def test_renew_error(self):
+        error = OSError(errno.EACCES, "Permission denied")
+        leases = PartLeases(self.part_path, ttl=0.03, owner="first")
+        with patch("s3resumable.lease.os.utime", side_effect=error):
+            with self.assertRaises(OSError):
+                with leases:
+                    self.assertTrue(leases.acquire(0))
+                    time.sleep(0.1)
+                    # Raised in the downloading thread once the renewal stopped
+                    self.assertRaises(OSError, leases.held, 0)
+                    self.assertRaises(OSError, leases.acquire, 1)
+        self.assertFalse(os.path.exists(leases.lease_path(0)))
@@ -0,0 +1,119 @@
+# -*- coding: utf-8 -*-
+# Copyright 2020 Immfly.com. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"). You
+# may not use this file except in compliance with the License. A copy of
+# the License is located at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# or in the "license" file accompanying this file. This file is
+# distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF
+# ANY KIND, either express or implied. See the License for the specific
+# language governing permissions and limitations under the License.
+from __future__ import absolute_import
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from s3resumable.manifest import Journal, ResumeManifest
+
+FILE_INFO = {
+    "etag": '"etag"',
+    "content_length": 100,
+    "part_size": 10
+}
+
+
+class ResumeManifestTests(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.temp_dir, "test.manifest")
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def test_start_and_load(self):
+        manifest = ResumeManifest(self.path)
+        self.assertIsNone(manifest.load())
+        manifest.start("my_bucket", "my_key", FILE_INFO)
+        manifest.add(0)
+        manifest.add(9)
+        self.assertTrue(manifest.is_complete(9))
+        self.assertFalse(manifest.is_complete(1))
+
+        manifest = ResumeManifest(self.path)
+        header = manifest.load()
+        self.assertEqual(header["part_size"], 10)
+        self.assertEqual(manifest.completed, frozenset([0, 9]))
+        self.assertTrue(manifest.matches("my_bucket", "my_key", '"etag"', 100))
+        self.assertFalse(manifest.matches("my_bucket", "my_key", '"other"', 100))
+        self.assertFalse(manifest.matches("my_bucket", "other_key", '"etag"', 100))
+        manifest.add_segment(3, 30, 20)
+        self.assertEqual(ResumeManifest(self.path).segments, [])
+        manifest = ResumeManifest(self.path)
+        manifest.load()
+        self.assertEqual(manifest.segments, [[3, 30, 20]])
+        manifest.start("my_bucket", "my_key", FILE_INFO)
+        self.assertEqual(manifest.completed, frozenset())
+        self.assertEqual(manifest.segments, [])
+        manifest.remove()
+        self.assertFalse(os.path.exists(self.path))
+
+    def test_digests(self):
+        manifest = ResumeManifest(self.path)
+        file_info = dict(FILE_INFO, checksums={"md5": "etag"}, upload_part_size=10)
+        manifest.start("my_bucket", "my_key", file_info)
+        manifest.add(0, {"md5": "part0"})
+        manifest.add(1)
+        self.assertEqual(manifest.digests, {0: {"md5": "part0"}})
+
+        manifest = ResumeManifest(self.path)
+        header = manifest.load()
+        self.assertEqual(header["checksums"], {"md5": "etag"})
+        self.assertEqual(header["upload_part_size"], 10)
+        self.assertEqual(manifest.completed, frozenset([0, 1]))
+        self.assertEqual(manifest.digests, {0: {"md5": "part0"}})
+        manifest.start("my_bucket", "my_key", FILE_INFO)
+        self.assertEqual(manifest.digests, {})
+        self.assertNotIn("checksums", manifest.header)
+
+    def test_load_torn_write(self):
+        manifest = ResumeManifest(self.path)
+        manifest.start("my_bucket", "my_key", FILE_INFO)
+        manifest.add(3)
+        with open(self.path, "a") as manifest_file:
+            manifest_file.write('{"par')
+        manifest = ResumeManifest(self.path)
+        manifest.load()
+        self.assertEqual(manifest.completed, frozenset([3]))
+
+
+
+class JournalTests(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.temp_dir, "test.journal")
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def test_journal(self):
+        journal = Journal(self.path)
+        self.assertEqual(journal.read(), (None, []))
+        journal.start({"etag": '"a"'})
+        journal.append({"part": 0})
+        with open(self.path, "a") as journal_file:
+            journal_file.write('{"par')
+        self.assertEqual(Journal(self.path).read(), ({"etag": '"a"'}, [{"part": 0}]))
+        journal.start({"etag": '"b"'})
+        self.assertEqual(journal.read(), ({"etag": '"b"'}, []))
+        journal.remove()
+        journal.remove()
+        self.assertFalse(os.path.exists(self.path))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,81 @@
+# -*- coding: utf-8 -*-
+# Copyright 2020 Immfly.com. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"). You
+# may not use this file except in compliance with the License. A copy of
+# the License is located at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# or in the "license" file accompanying this file. This file is
+# distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF
+# ANY KIND, either express or implied. See the License for the specific
+# language governing permissions and limitations under the License.
+from __future__ import absolute_import
+
+import os
+import shutil
+import tempfile
+import unittest
+from mock import patch
+
+from s3resumable import MetadataCache
+
+
+class MetadataCacheTests(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def test_get(self):
+        cache = MetadataCache(max_entries=2, ttl=60)
+        cache.put("my_bucket", "a", {"key": "a", "content_length": 10, "etag": '"a"',
+                                     "part_size": 5})
+        self.assertEqual(cache.get("my_bucket", "a"), {"content_length": 10, "etag": '"a"'})
+        self.assertIsNone(cache.get("other_bucket", "a"))
+
+        # The least recently used entry is evicted
+        cache.put("my_bucket", "b", {"content_length": 20, "etag": '"b"'})
+        cache.get("my_bucket", "a")
+        cache.put("my_bucket", "c", {"content_length": 30, "etag": '"c"'})
+        self.assertEqual(len(cache), 2)
+        self.assertIsNone(cache.get("my_bucket", "b"))
+        cache.discard("my_bucket", "a")
+        self.assertIsNone(cache.get("my_bucket", "a"))
+
+        with patch("s3resumable.metadata.time.time", return_value=1e10):
+            self.assertIsNone(cache.get("my_bucket", "c"))
+        self.assertRaises(ValueError, MetadataCache, max_entries=0)
+        self.assertRaises(ValueError, MetadataCache, ttl=0)
+
+    def test_put_listed(self):
+        cache = MetadataCache()
+        cache.put("my_bucket", "a", {"content_length": 10, "etag": '"a"',
+                                     "checksums": {"sha256": "x"}})
+        cache.put_listed("my_bucket", {"Key": "a", "Size": 10, "ETag": '"a"'})
+        self.assertEqual(cache.get("my_bucket", "a")["checksums"], {"sha256": "x"})
+        cache.put_listed("my_bucket", {"Key": "a", "Size": 11, "ETag": '"a2"'})
+        self.assertEqual(cache.get("my_bucket", "a"), {"content_length": 11, "etag": '"a2"'})
+        cache.put_listed("my_bucket", {"Key": "dir/", "Size": 0})
+        cache.put_listed("my_bucket", {"Key": "empty", "Size": 0, "ETag": '"e"'})
+        self.assertEqual(len(cache), 1)
+
+    def test_flush(self):
+        path = os.path.join(self.temp_dir, "metadata.json")
+        with MetadataCache(path=path) as cache:
+            cache.put("my_bucket", "a", {"content_length": 10, "etag": '"a"'})
+        self.assertEqual(os.listdir(self.temp_dir), ["metadata.json"])
+        self.assertEqual(MetadataCache(path=path).get("my_bucket", "a"),
+                         {"content_length": 10, "etag": '"a"'})
+        with patch("s3resumable.metadata.time.time", return_value=1e10):
+            self.assertEqual(len(MetadataCache(path=path)), 0)
+
+        with open(path, "w") as cache_file:
+            cache_file.write('[["my_bucket", "a"')
+        self.assertEqual(len(MetadataCache(path=path)), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
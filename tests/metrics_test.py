@@ -0,0 +1,86 @@
+# -*- coding: utf-8 -*-
+# Copyright 2020 Immfly.com. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"). You
+# may not use this file except in compliance with the License. A copy of
+# the License is located at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# or in the "license" file accompanying this file. This file is
+# distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF
+# ANY KIND, either express or implied. See the License for the specific
+# language governing permissions and limitations under the License.
+from __future__ import absolute_import
+
+import os
+import shutil
+import socket
+import tempfile
+import unittest
+
+from s3resumable.metrics import MetricsObserver
+
+PART_METRICS = {"part": 0, "bytes": 1000000, "request_latency": 0.02,
+                "time_to_first_byte": 0.03, "transfer_time": 0.5, "retries": 2,
+                "throttled": 1}
+
+
+class MetricsObserverTests(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.temp_dir, "s3resumable.prom")
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def test_prometheus(self):
+        observer = MetricsObserver(prometheus_file=self.path, write_interval=3600)
+        observer.update({"part": 1})
+        self.assertFalse(os.path.exists(self.path))
+        observer.update({"part": 1, "part_metrics": PART_METRICS})
+        observer.update({"part": 2, "part_metrics": dict(PART_METRICS, retries=0,
+                                                         request_latency=7)})
+        with open(self.path) as prometheus_file:
+            written = prometheus_file.read()
+        # Written by the first part only, until the write interval
+        self.assertIn("s3resumable_parts_total 1\n", written)
+        observer.flush()
+        with open(self.path) as prometheus_file:
+            text = prometheus_file.read()
+        self.assertEqual(text, observer.prometheus_text())
+        self.assertEqual(os.listdir(self.temp_dir), ["s3resumable.prom"])
+        for line in ("# TYPE s3resumable_parts_total counter",
+                     "s3resumable_parts_total 2",
+                     "s3resumable_bytes_total 2000000",
+                     "s3resumable_part_retries_total 2",
+                     "s3resumable_part_throttled_total 2",
+                     "# TYPE s3resumable_part_request_latency_seconds histogram",
+                     's3resumable_part_request_latency_seconds_bucket{le="0.025"} 1',
+                     's3resumable_part_request_latency_seconds_bucket{le="5"} 1',
+                     's3resumable_part_request_latency_seconds_bucket{le="10"} 2',
+                     's3resumable_part_request_latency_seconds_bucket{le="+Inf"} 2',
+                     "s3resumable_part_request_latency_seconds_sum 7.02",
+                     "s3resumable_part_request_latency_seconds_count 2",
+                     's3resumable_part_throughput_bytes_per_second_bucket{le="1000000.0"} 0',
+                     's3resumable_part_throughput_bytes_per_second_bucket{le="5000000.0"} 2'):
+            self.assertIn(line + "\n", text)
+
+    def test_statsd(self):
+        server = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        server.bind(("127.0.0.1", 0))
+        server.settimeout(5)
+        try:
+            observer = MetricsObserver(statsd_address=server.getsockname(), prefix="dl")
+            observer.update({"part": 1, "part_metrics": PART_METRICS})
+            lines = server.recv(4096).decode("utf-8").split("\n")
+        finally:
+            server.close()
+        self.assertEqual(lines, ["dl.parts:1|c", "dl.bytes:1000000|c", "dl.retries:2|c",
+                                 "dl.throttled:1|c", "dl.request_latency:20.000|ms",
+                                 "dl.time_to_first_byte:30.000|ms",
+                                 "dl.transfer_time:500.000|ms", "dl.throughput:2000000|h"])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,55 @@
+# -*- coding: utf-8 -*-
+# Copyright 2020 Immfly.com. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"). You
+# may not use this file except in compliance with the License. A copy of
+# the License is located at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# or in the "license" file accompanying this file. This file is
+# distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF
+# ANY KIND, either express or implied. See the License for the specific
+# language governing permissions and limitations under the License.
+from __future__ import absolute_import
+
+import unittest
+
+from s3resumable.partsize import AutoPartSize
+
+
+class AutoPartSizeTests(unittest.TestCase):
+    def test_init(self):
+        with self.assertRaises(ValueError):
+            AutoPartSize(min_part_size_megabytes=0)
+        with self.assertRaises(ValueError):
+            AutoPartSize(min_part_size_megabytes=10, max_part_size_megabytes=5)
+        with self.assertRaises(ValueError):
+            AutoPartSize(target_parts=0)
+        with self.assertRaises(ValueError):
+            AutoPartSize(target_overhead=1)
+
+    def test_part_size(self):
+        policy = AutoPartSize(min_part_size_megabytes=5, max_part_size_megabytes=100,
+                              target_parts=10)
+        self.assertEqual(policy.part_size(1000), 5000000)
+        self.assertEqual(policy.part_size(200000000), 20000000)
+        self.assertEqual(policy.part_size(200000001), 21000000)
+        self.assertEqual(policy.part_size(10 ** 10), 100000000)
+
+    def test_resize(self):
+        policy = AutoPartSize(min_part_size_megabytes=1, max_part_size_megabytes=100,
+                              target_overhead=0.5, smoothing=1)
+        self.assertEqual(policy.resize(5000000), 5000000)
+        # 10MB/s and 1s of latency: parts of 10MB spend half the time waiting
+        policy.observe(10000000, 1, 2)
+        self.assertEqual(policy.resize(5000000), 10000000)
+        self.assertEqual(policy.resize(9000000), 9000000)
+        policy.observe(1000000, 0.01, 0.11)
+        self.assertEqual(policy.resize(10000000), 1000000)
+        policy.observe(0, 1, 1)
+        self.assertEqual(policy.resize(10000000), 1000000)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,91 @@
+# -*- coding: utf-8 -*-
+# Copyright 2020 Immfly.com. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"). You
+# may not use this file except in compliance with the License. A copy of
+# the License is located at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# or in the "license" file accompanying this file. This file is
+# distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF
+# ANY KIND, either express or implied. See the License for the specific
+# language governing permissions and limitations under the License.
+from __future__ import absolute_import
+from __future__ import absolute_import
+
+import io
+import os
+import unittest
+
+from s3resumable.remote import BlockCache, RemoteFile
+
+
+class RemoteFileTests(unittest.TestCase):
+    def remote_file(self, data, block_size=10, max_blocks=4, max_concurrency=1):
+        fetched = []
+
+        def fetch(start, end):
+            fetched.append((start, end))
+            return data[start:end]
+
+        return RemoteFile(len(data), block_size, fetch, max_blocks,
+                          max_concurrency=max_concurrency), fetched
+
+    def test_read(self):
+        data = os.urandom(95)
+        remote_file, fetched = self.remote_file(data)
+        self.assertTrue(remote_file.seekable())
+        self.assertEqual(remote_file.size, 95)
+        self.assertEqual(remote_file.seek(-5, io.SEEK_END), 90)
+        self.assertEqual(remote_file.read(), data[90:])
+        self.assertEqual(fetched, [(90, 95)])
+        self.assertEqual(remote_file.read(), b"")
+
+        # Reads spanning several blocks request them at once
+        remote_file.seek(5)
+        self.assertEqual(remote_file.read(30), data[5:35])
+        self.assertEqual(remote_file.tell(), 35)
+        self.assertEqual(fetched[1:], [(0, 40)])
+        remote_file.seek(-10, io.SEEK_CUR)
+        self.assertEqual(remote_file.read(10), data[25:35])
+        self.assertEqual(len(fetched), 2)
+        self.assertRaises(ValueError, remote_file.seek, -1)
+
+        with io.BufferedReader(self.remote_file(data)[0], buffer_size=7) as buffered:
+            buffered.seek(42)
+            self.assertEqual(buffered.read(), data[42:])
+
+    def test_read_ranges(self):
+        data = os.urandom(200)
+        remote_file, fetched = self.remote_file(data, max_blocks=20, max_concurrency=2)
+        self.assertEqual(remote_file.read_ranges([(150, 5), (2, 3), (25, 10), (195, 20)]),
+                         [data[150:155], data[2:5], data[25:35], data[195:200]])
+        # Runs of close blocks are merged, the blocks between them included
+        self.assertEqual(sorted(fetched), [(0, 40), (150, 160), (190, 200)])
+
+        del fetched[:]
+        self.assertEqual(remote_file.read_ranges([(30, 5), (60, 5), (100, 5)], max_gap=0),
+                         [data[30:35], data[60:65], data[100:105]])
+        self.assertEqual(sorted(fetched), [(60, 70), (100, 110)])
+        self.assertEqual(remote_file.read_ranges([(300, 5)]), [b""])
+
+    def test_block_cache(self):
+        cache = BlockCache(2)
+        cache.put(0, b"a")
+        cache.put(1, b"b")
+        self.assertEqual(cache.get(0), b"a")
+        # The least recently used block is evicted
+        cache.put(2, b"c")
+        self.assertIsNone(cache.get(1))
+        self.assertEqual(cache.get(0), b"a")
+        self.assertEqual(len(cache), 2)
+
+    def test_close(self):
+        closed = []
+        remote_file = RemoteFile(0, 10, None, 1, on_close=lambda: closed.append(True))
+        self.assertEqual(remote_file.read(), b"")
+        remote_file.close()
+        remote_file.close()
+        self.assertEqual(closed, [True])
+        self.assertRaises(ValueError, RemoteFile, 10, 0, None, 1)
@@ -0,0 +1,65 @@
+# -*- coding: utf-8 -*-
+# Copyright 2020 Immfly.com. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"). You
+# may not use this file except in compliance with the License. A copy of
+# the License is located at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# or in the "license" file accompanying this file. This file is
+# distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF
+# ANY KIND, either express or implied. See the License for the specific
+# language governing permissions and limitations under the License.
+from __future__ import absolute_import
+
+import unittest
+
+from botocore.exceptions import ClientError, ReadTimeoutError
+
+from s3resumable.exceptions import S3ResumableDownloadError, S3ResumableTruncated
+from s3resumable.retry import RetryPolicy
+
+
+def client_error(code, status):
+    return ClientError({'Error': {'Code': code},
+                        'ResponseMetadata': {'HTTPStatusCode': status}}, 'GetObject')
+
+
+class RetryPolicyTests(unittest.TestCase):
+    def test_init(self):
+        with self.assertRaises(ValueError):
+            RetryPolicy(max_attempts=0)
+        with self.assertRaises(ValueError):
+            RetryPolicy(max_throttle_attempts=0)
+        with self.assertRaises(ValueError):
+            RetryPolicy(max_retries=-1)
+
+    def test_is_throttle(self):
+        self.assertTrue(RetryPolicy.is_throttle(client_error('SlowDown', 503)))
+        self.assertTrue(RetryPolicy.is_throttle(client_error('Throttling', 400)))
+        self.assertFalse(RetryPolicy.is_throttle(client_error('InternalError', 500)))
+        self.assertFalse(RetryPolicy.is_throttle(ValueError()))
+
+    def test_is_transient(self):
+        self.assertTrue(RetryPolicy.is_transient(client_error('InternalError', 500)))
+        self.assertTrue(RetryPolicy.is_transient(client_error('BadGateway', 502)))
+        self.assertFalse(RetryPolicy.is_transient(client_error('AccessDenied', 403)))
+        self.assertTrue(RetryPolicy.is_transient(ReadTimeoutError(endpoint_url='url')))
+        self.assertTrue(RetryPolicy.is_transient(S3ResumableTruncated()))
+        self.assertFalse(RetryPolicy.is_transient(S3ResumableDownloadError()))
+        self.assertFalse(RetryPolicy.is_transient(IOError(28, 'No space left on device')))
+
+    def test_delay(self):
+        policy = RetryPolicy(base_delay=1, max_delay=5, throttle_base_delay=10,
+                             throttle_max_delay=30)
+        for _ in range(20):
+            self.assertTrue(0 <= policy.delay(1) <= 1)
+            self.assertTrue(0 <= policy.delay(3) <= 4)
+            self.assertTrue(0 <= policy.delay(10) <= 5)
+            self.assertTrue(0 <= policy.delay(2, throttle=True) <= 20)
+            self.assertTrue(0 <= policy.delay(10, throttle=True) <= 30)
+
+
+if __name__ == '__main__':
+    unittest.main()
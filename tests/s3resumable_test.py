@@ -13,7 +13,16 @@
 # language governing permissions and limitations under the License.
 from __future__ import absolute_import
 
+import gzip
+import hashlib
+import io
+import os
+import shutil
 import sys
+import tarfile
+import tempfile
+import threading
+import time
 
 import unittest
 from mock import patch
@@ -25,13 +34,40 @@ from s3resumable import S3ResumableIncompatible
 from s3resumable import S3ResumableObserver
 from s3resumable import S3ResumableDownloadError
 from s3resumable import S3ResumableBloqued
+from s3resumable import S3ResumableChecksumMismatch
+from s3resumable import S3ResumableNoSpace
+from s3resumable import S3ResumableExtractError
+from s3resumable import SyncIndex
+from s3resumable import MetadataCache
+from s3resumable import cooperative
+from s3resumable.bandwidth import BandwidthLimiter
+from s3resumable.extract import checkpoint_path
+from s3resumable.layout import check_part_size, join_parts
+from s3resumable.lease import PartLeases
+from s3resumable.manifest import ResumeManifest
+from s3resumable.partsize import AutoPartSize
+from s3resumable.retry import RetryPolicy
+from s3resumable.utils import remove_if_exists
 
 from botocore.exceptions import ClientError
+from botocore.exceptions import ConnectionError as BotocoreConnectionError
 from filelock import Timeout
 
 BUILTIN_OPEN = '__builtin__.open' if sys.version_info.major < 3 else 'builtins.open'
 
 
+def set_part_size(s3r, part_size_bytes):
+    s3r._core.options = s3r._core.options._replace(part_size_bytes=part_size_bytes)
+
+
+def download_parts(s3r, *args, **kwargs):
+    return s3r._transport.run(s3r._core.download_parts(*args, **kwargs))
+
+
+def download_part(s3r, *args):
+    return s3r._transport.run(s3r._core.download_part(*args))
+
+
 class ObserverTest(S3ResumableObserver):
     def __init__(self):
         self.file_info = None
@@ -43,12 +79,22 @@ class ObserverTest(S3ResumableObserver):
 class S3ResumableTests(unittest.TestCase):
     def test_init_class(self):
         s3r = S3Resumable(None, part_size_megabytes=1)
-        self.assertEqual(s3r._part_size_bytes, 1000000)
+        self.assertEqual(s3r._core.options.part_size_bytes, 1000000)
         s3r = S3Resumable(None)
-        self.assertEqual(s3r._part_size_bytes, 15000000)
+        self.assertEqual(s3r._core.options.part_size_bytes, 15000000)
         with self.assertRaises(ValueError):
             S3Resumable(None, -1)
             S3Resumable(None, "fail")
+        with self.assertRaises(ValueError):
+            S3Resumable(None, max_concurrency=0)
+
+    def test_init_auto_part_size(self):
+        s3r = S3Resumable(None, part_size_megabytes="auto")
+        self.assertIsInstance(s3r._core.options.part_size_policy, AutoPartSize)
+        policy = AutoPartSize(min_part_size_megabytes=2)
+        s3r = S3Resumable(None, part_size_megabytes=policy)
+        self.assertIs(s3r._core.options.part_size_policy, policy)
+        self.assertEqual(s3r._core.options.part_size_bytes, 2000000)
 
     def test_attach_observer(self):
         s3r = S3Resumable(None)
@@ -61,6 +107,25 @@ class S3ResumableTests(unittest.TestCase):
         s3r.detach(observer)
         self.assertEqual(0, len(s3r._observers))
 
+    def test_observers_per_instance(self):
+        s3r = S3Resumable(None)
+        other = S3Resumable(None)
+        s3r.attach(ObserverTest())
+        self.assertEqual(1, len(s3r._observers))
+        self.assertEqual(0, len(other._observers))
+
+    def test_publish_observer(self):
+        s3r = S3Resumable(None, observer_queue_size=2, observer_overflow="coalesce")
+        observer = MagicMock(spec=S3ResumableObserver)
+        s3r.attach(observer)
+        for part in range(1, 4):
+            s3r._transport.publish({"key": "key", "part_path": "key.part{part}"},
+                                   {"part": part})
+        s3r._transport.join_notifications()
+        self.assertEqual([call[0][0]["part"] for call in observer.update.call_args_list][-1], 3)
+        self.assertRaises(ValueError, S3Resumable, None, observer_overflow="wait")
+        self.assertRaises(ValueError, S3Resumable, None, observer_queue_size=-1)
+
     def test_notify_observer(self):
         s3r = S3Resumable(None)
         observer = ObserverTest()
@@ -69,23 +134,23 @@ class S3ResumableTests(unittest.TestCase):
         s3r.notify(True)
         self.assertTrue(observer.file_info)
 
-    @patch('s3resumable.s3resumable.os')
+    @patch('s3resumable.layout.os')
     def test_check_part_size(self, mock_os):
         s3r = S3Resumable(None)
         file_info = {
             "total_parts": 4,
-            "content_length": s3r._part_size_bytes * 3 + 1
+            "content_length": s3r._core.options.part_size_bytes * 3 + 1
         }
         mock_os.path.isfile.return_value = False
-        self.assertFalse(s3r._check_part_size("test", 1, file_info))
+        self.assertFalse(check_part_size(s3r._core, "test", 1, file_info))
         mock_os.path.isfile.return_value = True
         mock_os.path.getsize.return_value = 10
-        self.assertFalse(s3r._check_part_size("test", 1, file_info))
-        mock_os.path.getsize.return_value = s3r._part_size_bytes
-        self.assertTrue(s3r._check_part_size("test", 1, file_info))
-        self.assertFalse(s3r._check_part_size("test", 3, file_info))
+        self.assertFalse(check_part_size(s3r._core, "test", 1, file_info))
+        mock_os.path.getsize.return_value = s3r._core.options.part_size_bytes
+        self.assertTrue(check_part_size(s3r._core, "test", 1, file_info))
+        self.assertFalse(check_part_size(s3r._core, "test", 3, file_info))
         mock_os.path.getsize.return_value = 1
-        self.assertTrue(s3r._check_part_size("test", 3, file_info))
+        self.assertTrue(check_part_size(s3r._core, "test", 3, file_info))
 
     def test_get_file_info(self):
         boto3 = MagicMock()
@@ -106,13 +171,13 @@ class S3ResumableTests(unittest.TestCase):
         boto3.head_object.return_value = {
             "ResponseMetadata": {
                 "HTTPHeaders": {
-                    "content-length": s3r._part_size_bytes + 1,
+                    "content-length": s3r._core.options.part_size_bytes + 1,
                     "accept-ranges": "bytes"
                 }
             }
         }
         file_info = s3r.get_file_info("my_bucket", "my_key")
-        self.assertEqual(file_info["content_length"], s3r._part_size_bytes + 1)
+        self.assertEqual(file_info["content_length"], s3r._core.options.part_size_bytes + 1)
         self.assertEqual(file_info["total_parts"], 2)
 
         boto3.head_object.return_value = {
@@ -126,60 +191,1057 @@ class S3ResumableTests(unittest.TestCase):
         with self.assertRaises(S3ResumableIncompatible):
             s3r.get_file_info("my_bucket", "my_key")
 
+    def test_resize_parts(self):
+        policy = MagicMock(spec=AutoPartSize, min_part_size_bytes=5)
+        s3r = S3Resumable(None, part_size_megabytes=policy)
+        file_info = {"content_length": 100, "manifest": MagicMock()}
+        s3r._core.set_part_size(file_info, 10)
+        self.assertEqual(file_info["total_parts"], 10)
+        policy.resize.return_value = 10
+        s3r._core.resize_parts(file_info, 2)
+        self.assertEqual(file_info["segments"], [])
+        policy.resize.return_value = 30
+        s3r._core.resize_parts(file_info, 2)
+        self.assertEqual(file_info["segments"], [[2, 20, 30]])
+        self.assertEqual(file_info["total_parts"], 5)
+        self.assertEqual(s3r._core.part_range(1, file_info), (10, 19))
+        self.assertEqual(s3r._core.part_range(3, file_info), (50, 79))
+        self.assertEqual(s3r._core.part_range(4, file_info), (80, 99))
+        file_info["manifest"].add_segment.assert_called_once_with(2, 20, 30)
+        s3r._core.resize_parts(file_info, 5)
+        self.assertEqual(len(file_info["segments"]), 1)
+
+    def test_download_parts_checksums(self):
+        data = bytearray(b'0123456789abcdefghij')
+        uploaded = [bytes(data[:8]), bytes(data[8:16]), bytes(data[16:])]
+        etag = '"{}-3"'.format(hashlib.md5(b''.join(
+            hashlib.md5(part).digest() for part in uploaded)).hexdigest())
+        boto3 = MagicMock()
+        s3r = S3Resumable(boto3, verify_checksums=True)
+        temp_dir = tempfile.mkdtemp()
+
+        def head_object(Bucket, Key, PartNumber=None, **kwargs):
+            if PartNumber:
+                return {'ContentLength': 8}
+            self.assertEqual(kwargs, {'ChecksumMode': 'ENABLED'})
+            return {'ResponseMetadata': {'HTTPHeaders': {
+                'content-length': '20', 'accept-ranges': 'bytes', 'etag': etag}}}
+
+        def get_object(Key, Range, **kwargs):
+            start, end = Range[len('bytes='):].split('-')
+            return {'Body': io.BytesIO(bytes(data[int(start):int(end) + 1]))}
+
+        boto3.head_object.side_effect = head_object
+        boto3.get_object.side_effect = get_object
+        try:
+            # Parts are the uploaded ones, so the multipart ETag can be checked
+            local_file_path = download_parts(s3r, "my_bucket", "my_key", "file", temp_dir)
+            with open(local_file_path, "rb") as result_file:
+                self.assertEqual(result_file.read(), data)
+            self.assertEqual([call[1]['Range'] for call in boto3.get_object.call_args_list],
+                             ['bytes=0-7', 'bytes=8-15', 'bytes=16-19'])
+
+            data[10:11] = b'X'
+            with self.assertRaises(S3ResumableChecksumMismatch):
+                download_parts(s3r, "my_bucket", "my_key", "corrupt", temp_dir)
+            self.assertEqual(os.listdir(temp_dir), ['file'])
+        finally:
+            shutil.rmtree(temp_dir)
+
+    def test_download_parts_object_checksum(self):
+        data = bytearray(b'0123456789abcdefghij')
+        etags = {"plain": hashlib.md5(bytes(data)).hexdigest(),
+                 "multipart": hashlib.md5(b'parts').hexdigest() + "-2"}
+        temp_dir = tempfile.mkdtemp()
+
+        def head_object(Bucket, Key, PartNumber=None, **kwargs):
+            if PartNumber:
+                # Not the size of the uploaded parts, which can't be downloaded
+                return {'ContentLength': 7}
+            return {'ResponseMetadata': {'HTTPHeaders': {
+                'content-length': '20', 'accept-ranges': 'bytes',
+                'etag': '"{}"'.format(etags[Key])}}}
+
+        def get_object(Key, Range, **kwargs):
+            start, end = Range[len('bytes='):].split('-')
+            return {'Body': io.BytesIO(bytes(data[int(start):int(end) + 1]))}
+
+        try:
+            for single_file in (False, True):
+                boto3 = MagicMock()
+                boto3.head_object.side_effect = head_object
+                boto3.get_object.side_effect = get_object
+                s3r = S3Resumable(boto3, verify_checksums=True, max_concurrency=2,
+                                  single_file=single_file)
+                set_part_size(s3r, 8)
+                # A plain ETag is the MD5 of the whole object, hashed while it's written
+                local_file_path = download_parts(s3r, "my_bucket", "plain", "plain", temp_dir)
+                with open(local_file_path, "rb") as result_file:
+                    self.assertEqual(result_file.read(), data)
+                os.remove(local_file_path)
+                self.assertEqual(b''.join(s3r.stream("my_bucket", "plain")), data)
+
+                data[10:11] = b'X'
+                with self.assertRaises(S3ResumableChecksumMismatch):
+                    download_parts(s3r, "my_bucket", "plain", "plain", temp_dir)
+                with self.assertRaises(S3ResumableChecksumMismatch):
+                    b''.join(s3r.stream("my_bucket", "plain"))
+                data[10:11] = b'a'
+
+                # Verification that is not possible is reported
+                with self.assertLogs('s3resumable.verify', 'WARNING') as logs:
+                    local_file_path = download_parts(s3r, "my_bucket", "multipart",
+                                                     "multipart", temp_dir)
+                self.assertIn("md5 checksum of key multipart", logs.output[0])
+                os.remove(local_file_path)
+                self.assertEqual(os.listdir(temp_dir), [])
+        finally:
+            shutil.rmtree(temp_dir)
+
+    def test_download_parts_probe(self):
+        data = b'0123456789abcdefghij'
+        boto3 = MagicMock()
+        policy = AutoPartSize(min_part_size_megabytes=1, target_parts=2)
+        policy.min_part_size_bytes = 8
+        s3r = S3Resumable(boto3, part_size_megabytes=policy)
+        temp_dir = tempfile.mkdtemp()
+
+        bodies = []
+        etags = {}
+
+        def get_object(Key, Range, **kwargs):
+            start, end = Range[len('bytes='):].split('-')
+            bodies.append(io.BytesIO(data[:size][int(start):int(end) + 1]))
+            return {'Body': bodies[-1], 'ETag': etags.get(Key, '"etag"'),
+                    'ContentRange': 'bytes {}-{}/{}'.format(start, end, size)}
+
+        boto3.get_object.side_effect = get_object
+        try:
+            # The whole object fits in the first request
+            size = 5
+            local_file_path = download_parts(s3r, "my_bucket", "my_key", "small", temp_dir)
+            with open(local_file_path, "rb") as result_file:
+                self.assertEqual(result_file.read(), data[:5])
+            self.assertEqual(boto3.get_object.call_count, 1)
+            boto3.head_object.assert_not_called()
+
+            # The first request is kept as the beginning of the first part
+            size = 20
+            policy.part_size = MagicMock(return_value=10)
+            boto3.get_object.reset_mock()
+            local_file_path = download_parts(s3r, "my_bucket", "my_key", "large", temp_dir)
+            with open(local_file_path, "rb") as result_file:
+                self.assertEqual(result_file.read(), data)
+            self.assertEqual([call[1]['Range'] for call in boto3.get_object.call_args_list],
+                             ['bytes=0-7', 'bytes=8-9', 'bytes=10-19'])
+            self.assertEqual(sorted(os.listdir(temp_dir)), ['large', 'small'])
+
+            # A first part the manifest does not vouch for is written over
+            with open(os.path.join(temp_dir, 'stray.part0'), 'wb') as part_file:
+                part_file.write(b'XYZ')
+            boto3.get_object.reset_mock()
+            local_file_path = download_parts(s3r, "my_bucket", "my_key", "stray", temp_dir)
+            with open(local_file_path, "rb") as result_file:
+                self.assertEqual(result_file.read(), data)
+            self.assertEqual([call[1]['Range'] for call in boto3.get_object.call_args_list],
+                             ['bytes=0-7', 'bytes=8-9', 'bytes=10-19'])
+
+            # The first request is closed unread when the manifest vouches for the first
+            # part, here of an object without ETag
+            etags['no_etag'] = None
+            local_file_path = os.path.join(temp_dir, 'resumed')
+            manifest = ResumeManifest('{}.manifest'.format(local_file_path))
+            manifest.start('my_bucket', 'no_etag',
+                           {'etag': None, 'content_length': 20, 'part_size': 10})
+            with open('{}.part0'.format(local_file_path), 'wb') as part_file:
+                part_file.write(data[:9])
+            boto3.get_object.reset_mock()
+            del bodies[:]
+            local_file_path = download_parts(s3r, "my_bucket", "no_etag", "resumed", temp_dir)
+            with open(local_file_path, "rb") as result_file:
+                self.assertEqual(result_file.read(), data)
+            self.assertEqual([call[1]['Range'] for call in boto3.get_object.call_args_list],
+                             ['bytes=0-7', 'bytes=9-9', 'bytes=10-19'])
+            self.assertTrue(bodies[0].closed)
+        finally:
+            shutil.rmtree(temp_dir)
+
     def test_download_part(self):
         boto3 = MagicMock()
-        s3r = S3Resumable(boto3)
-        s3r._check_part_size = MagicMock()
-        s3r.notify = MagicMock()
+        s3r = S3Resumable(boto3, part_size_megabytes=1,
+                          retry_policy=RetryPolicy(max_attempts=1))
+        temp_dir = tempfile.mkdtemp()
         file_info = {
-            'part_path': '/tmp/test.part{{part}}',
-            'content_length': 100000
+            'part_path': os.path.join(temp_dir, 'test.part{part}'),
+            'content_length': 2000000
         }
-        s3r._download_part("my_bucket", "my_key", 1, file_info)
-        s3r._check_part_size.return_value = False
-        boto3.get_object.side_effect = ClientError({'Error': {'Code': '404'}}, '')
-        with self.assertRaises(S3ResumableDownloadError):
-            s3r._download_part("my_bucket", "my_key", 1, file_info)
-        boto3.get_object.side_effect = None
-        body_mock = MagicMock()
-        boto3.get_object.return_value = {'Body': body_mock}
-        body_mock.read.return_value = b'1233455666'
-        with self.assertRaises(S3ResumableDownloadError):
-            s3r._download_part("my_bucket", "my_key", 1, file_info)
-        s3r._check_part_size.side_effect = [False, True]
-        s3r._download_part("my_bucket", "my_key", 1, file_info)
-        self.assertEqual(file_info['part'], 2)
+        try:
+            with patch('s3resumable.layout.check_part_size', return_value=True):
+                download_part(s3r, "my_bucket", "my_key", 1, file_info)
+            boto3.get_object.assert_not_called()
+            boto3.get_object.side_effect = ClientError({'Error': {'Code': '404'}}, '')
+            with self.assertRaises(S3ResumableDownloadError):
+                download_part(s3r, "my_bucket", "my_key", 1, file_info)
+            boto3.get_object.side_effect = None
+            boto3.get_object.return_value = {'Body': io.BytesIO(b'1233455666')}
+            with self.assertRaises(S3ResumableDownloadError):
+                download_part(s3r, "my_bucket", "my_key", 1, file_info)
+            self.assertEqual(boto3.get_object.call_args[1]['Range'], 'bytes=1000000-1999999')
+            boto3.get_object.return_value = {'Body': io.BytesIO(b'x' * 999990)}
+            download_part(s3r, "my_bucket", "my_key", 1, file_info)
+            self.assertEqual(file_info['part'], 2)
+            # The short part file is continued, not downloaded again
+            self.assertEqual(boto3.get_object.call_args[1]['Range'], 'bytes=1000010-1999999')
+            with open(file_info['part_path'].format(part=1), "rb") as part_file:
+                self.assertEqual(part_file.read(), b'1233455666' + b'x' * 999990)
+        finally:
+            shutil.rmtree(temp_dir)
 
+    @patch('s3resumable.s3resumable.time.sleep')
+    def test_download_part_retry(self, mock_sleep):
+        boto3 = MagicMock()
+        s3r = S3Resumable(boto3, part_size_megabytes=1, chunk_size_kilobytes=1,
+                          retry_policy=RetryPolicy(max_attempts=3, max_retries=3),
+                          observer_queue_size=0)
+        observer = MagicMock(spec=S3ResumableObserver)
+        s3r.attach(observer)
+        temp_dir = tempfile.mkdtemp()
+        file_info = {
+            'part_path': os.path.join(temp_dir, 'test.part{part}'),
+            'content_length': 1000010
+        }
+        slow_down = ClientError({'Error': {'Code': 'SlowDown'},
+                                 'ResponseMetadata': {'HTTPStatusCode': 503}}, '')
+        internal_error = ClientError({'Error': {'Code': 'InternalError'},
+                                      'ResponseMetadata': {'HTTPStatusCode': 500}}, '')
+        try:
+            # Truncated bodies are continued, throttling is not counted as attempts
+            boto3.get_object.side_effect = [
+                {'Body': io.BytesIO(b'x' * 400000)}, slow_down, slow_down, slow_down,
+                {'Body': io.BytesIO(b'x' * 600000)}]
+            download_part(s3r, "my_bucket", "my_key", 0, file_info)
+            self.assertEqual([call[1]['Range'] for call in boto3.get_object.call_args_list],
+                             ['bytes=0-999999', 'bytes=400000-999999', 'bytes=400000-999999',
+                              'bytes=400000-999999', 'bytes=400000-999999'])
+            self.assertEqual(os.path.getsize(file_info['part_path'].format(part=0)), 1000000)
+            self.assertEqual(mock_sleep.call_count, 4)
+            self.assertEqual(file_info['retries'], 1)
+            self.assertEqual(file_info['part'], 1)
+            part_metrics = observer.update.call_args[0][0]['part_metrics']
+            self.assertEqual(part_metrics['bytes'], 600000)
+            self.assertEqual(part_metrics['retries'], 4)
+            self.assertEqual(part_metrics['throttled'], 3)
+            self.assertGreaterEqual(part_metrics['transfer_time'], 0)
+            self.assertNotIn('part_metrics', file_info)
+
+            # Retries of a part
+            boto3.get_object.side_effect = [internal_error, internal_error, internal_error]
+            with self.assertRaises(ClientError):
+                download_part(s3r, "my_bucket", "my_key", 1, file_info)
+            self.assertEqual(file_info['retries'], 3)
+
+            # Retries of the object
+            boto3.get_object.side_effect = [internal_error,
+                                            {'Body': io.BytesIO(b'x' * 10)}]
+            with self.assertRaises(ClientError):
+                download_part(s3r, "my_bucket", "my_key", 1, file_info)
+
+            # Errors that are not transient
+            file_info['retries'] = 0
+            boto3.get_object.side_effect = ClientError({'Error': {'Code': 'AccessDenied'}}, '')
+            with self.assertRaises(ClientError):
+                download_part(s3r, "my_bucket", "my_key", 1, file_info)
+            self.assertEqual(file_info['retries'], 0)
+        finally:
+            shutil.rmtree(temp_dir)
+
+    def test_download_part_truncate(self):
+        boto3 = MagicMock()
+        s3r = S3Resumable(boto3, part_size_megabytes=1)
+        temp_dir = tempfile.mkdtemp()
+        boto3.get_object.side_effect = lambda **kwargs: {'Body': io.BytesIO(b'y' * 500000)}
+        file_info = {
+            'part_path': os.path.join(temp_dir, 'test.part{part}'),
+            'content_length': 1500000,
+            'total_parts': 2,
+            'resumed': True
+        }
+        file_part = file_info['part_path'].format(part=1)
+        try:
+            # The manifest of a previous run confirms the part size
+            with open(file_part, "wb") as part_file:
+                part_file.write(b'x' * 600000)
+            download_part(s3r, "my_bucket", "my_key", 1, file_info)
+            self.assertEqual(os.path.getsize(file_part), 500000)
+            boto3.get_object.assert_not_called()
+
+            # The part file may have been written with another part size
+            del file_info['resumed']
+            with open(file_part, "wb") as part_file:
+                part_file.write(b'x' * 600000)
+            download_part(s3r, "my_bucket", "my_key", 1, file_info)
+            with open(file_part, "rb") as part_file:
+                self.assertEqual(part_file.read(), b'y' * 500000)
+            self.assertEqual(boto3.get_object.call_args[1]['Range'], 'bytes=1000000-1499999')
+        finally:
+            shutil.rmtree(temp_dir)
+
+    def test_download_file_resume_truncate(self):
+        data = os.urandom(20)
+        boto3 = MagicMock()
+
+        def get_object(Key, Range, **kwargs):
+            start, end = Range[len('bytes='):].split('-')
+            return {'Body': io.BytesIO(data[int(start):int(end) + 1])}
+
+        boto3.get_object.side_effect = get_object
+        temp_dir = tempfile.mkdtemp()
+        try:
+            local_file_path = os.path.join(temp_dir, 'a.bin')
+            manifest = ResumeManifest('{}.manifest'.format(local_file_path))
+            manifest.start('my_bucket', 'a.bin',
+                           {'etag': '"a"', 'content_length': 20, 'part_size': 10})
+            manifest.add(0)
+            with open('{}.part0'.format(local_file_path), 'wb') as part_file:
+                part_file.write(data[:10])
+            with open('{}.part1'.format(local_file_path), 'wb') as part_file:
+                part_file.write(data[10:] + b'garbage')
+            s3r = S3Resumable(boto3)
+            set_part_size(s3r, 10)
+            s3r.download_file('my_bucket', 'a.bin', temp_dir)
+            with open(local_file_path, 'rb') as result_file:
+                self.assertEqual(result_file.read(), data)
+            # The part confirmed by the manifest is truncated, not requested again
+            boto3.get_object.assert_not_called()
+            boto3.head_object.assert_not_called()
+        finally:
+            shutil.rmtree(temp_dir)
+
+    def test_write_body(self):
+        s3r = S3Resumable(None, chunk_size_kilobytes=1)
+        data = b'x' * 2500
+        output = io.BytesIO()
+        s3r._transport.copy_body(io.BytesIO(data), output)
+        self.assertEqual(output.getvalue(), data)
+        body = MagicMock(spec=['read'])
+        body.read.side_effect = [data[:1000], data[1000:2000], data[2000:], b'']
+        output = io.BytesIO()
+        s3r._transport.copy_body(body, output)
+        self.assertEqual(output.getvalue(), data)
+        body.read.assert_called_with(1000)
+        self.assertIs(s3r._transport._get_chunk_buffer(), s3r._transport._get_chunk_buffer())
+
+    def test_write_body_bandwidth(self):
+        limiter = BandwidthLimiter(1000)
+        s3r = S3Resumable(None, chunk_size_kilobytes=1, max_bandwidth=limiter)
+        self.assertIs(s3r.bandwidth_limiter, limiter)
+        self.assertEqual(S3Resumable(None, max_bandwidth=10).bandwidth_limiter.max_bandwidth, 10)
+        self.assertIsNone(S3Resumable(None).bandwidth_limiter)
+        output = io.BytesIO()
+        with patch.object(limiter, 'consume') as mock_consume:
+            s3r._transport.copy_body(io.BytesIO(b'x' * 2500), output)
+        self.assertEqual([call[0][0] for call in mock_consume.call_args_list], [1000, 1000, 500])
+
+    @patch('s3resumable.core.ResumeManifest')
+    @patch('s3resumable.layout.copy_fileobj')
     @patch(BUILTIN_OPEN, new_callable=mock_open, read_data="se")
-    @patch('s3resumable.s3resumable.os')
-    def test_download_parts(self, mock_os, m_open):
+    @patch('s3resumable.layout.os')
+    def test_download_parts(self, mock_os, m_open, mock_copy, mock_manifest):
+        mock_manifest.return_value.load.return_value = None
+        mock_manifest.return_value.header = None
         s3r = S3Resumable(None)
-        s3r.get_file_info = MagicMock()
-        s3r._download_part = MagicMock()
-        s3r.get_file_info.return_value = {
+        s3r._core.get_file_info = MagicMock()
+        s3r._core.download_part = MagicMock()
+        s3r._core.get_file_info.return_value = {
             "total_parts": 2,
-            "content_length": 10
+            "content_length": 10,
+            "part_size": 5
         }
         mock_os.path.getsize.return_value = 9
         with self.assertRaises(S3ResumableDownloadError):
-            s3r._download_parts("my_bucket", "my_key", "/tmp/download_file", "/tmp")
+            download_parts(s3r, "my_bucket", "my_key", "/tmp/download_file", "/tmp")
+        mock_os.path.getsize.return_value = 10
+        download_parts(s3r, "my_bucket", "my_key", "/tmp/download_file", "/tmp")
+
+    @patch('s3resumable.core.ResumeManifest')
+    @patch('s3resumable.layout.copy_fileobj')
+    @patch(BUILTIN_OPEN, new_callable=mock_open, read_data="se")
+    @patch('s3resumable.layout.os')
+    def test_download_parts_concurrently(self, mock_os, m_open, mock_copy, mock_manifest):
+        mock_manifest.return_value.load.return_value = None
+        mock_manifest.return_value.header = None
+        s3r = S3Resumable(None, max_concurrency=4)
+        s3r._core.get_file_info = MagicMock()
+        s3r._core.download_part = MagicMock()
+        s3r._core.get_file_info.return_value = {
+            "total_parts": 8,
+            "content_length": 10,
+            "part_size": 2
+        }
         mock_os.path.getsize.return_value = 10
-        s3r._download_parts("my_bucket", "my_key", "/tmp/download_file", "/tmp")
+        download_parts(s3r, "my_bucket", "my_key", "/tmp/download_file", "/tmp")
+        parts = sorted(call[0][2] for call in s3r._core.download_part.call_args_list)
+        self.assertEqual(parts, list(range(8)))
+        s3r._core.download_part.reset_mock()
+        s3r._core.download_part.side_effect = S3ResumableDownloadError("failed")
+        with self.assertRaises(S3ResumableDownloadError):
+            download_parts(s3r, "my_bucket", "my_key", "/tmp/download_file", "/tmp")
+
+    def test_download_single_file(self):
+        data = b'0123456789abcdefghij'
+        boto3 = MagicMock()
+        boto3.get_object.side_effect = [{'Body': io.BytesIO(data[:10])},
+                                        IOError("connection reset"),
+                                        {'Body': io.BytesIO(data[10:])}]
+        s3r = S3Resumable(boto3, part_size_megabytes=1, single_file=True)
+        set_part_size(s3r, 10)
+        s3r._core.get_file_info = MagicMock()
+        s3r._core.get_file_info.side_effect = lambda bucket, key: {
+            "key": key, "content_length": 20, "total_parts": 2, "part_size": 10}
+        temp_dir = tempfile.mkdtemp()
+        try:
+            with self.assertRaises(IOError):
+                download_parts(s3r, "my_bucket", "my_key", "download_file", temp_dir)
+            self.assertEqual(sorted(os.listdir(temp_dir)),
+                             ['download_file.manifest', 'download_file.partial'])
+            local_file_path = download_parts(s3r, "my_bucket", "my_key", "download_file",
+                                                  temp_dir)
+            self.assertEqual(os.listdir(temp_dir), ['download_file'])
+            with open(local_file_path, "rb") as result_file:
+                self.assertEqual(result_file.read(), data)
+            self.assertEqual(boto3.get_object.call_args[1]['Range'], 'bytes=10-19')
+        finally:
+            shutil.rmtree(temp_dir)
+
+    def test_download_parts_manifest(self):
+        data = b'0123456789abcdefghij'
+        boto3 = MagicMock()
+        boto3.head_object.return_value = {
+            "ResponseMetadata": {
+                "HTTPHeaders": {
+                    "content-length": "20",
+                    "accept-ranges": "bytes",
+                    "etag": '"v1"'
+                }
+            }
+        }
+        boto3.get_object.side_effect = [{'Body': io.BytesIO(data[:10])},
+                                        IOError("connection reset")]
+        s3r = S3Resumable(boto3, part_size_megabytes=1)
+        set_part_size(s3r, 10)
+        temp_dir = tempfile.mkdtemp()
+        try:
+            with self.assertRaises(IOError):
+                download_parts(s3r, "my_bucket", "my_key", "download_file", temp_dir)
+            self.assertEqual(boto3.get_object.call_args[1]['IfMatch'], '"v1"')
+
+            # Resumed from the manifest, with the part size of the first run
+            set_part_size(s3r, 4)
+            boto3.head_object.reset_mock()
+            boto3.get_object.side_effect = [{'Body': io.BytesIO(data[10:])}]
+            local_file_path = download_parts(s3r, "my_bucket", "my_key", "download_file",
+                                                  temp_dir)
+            boto3.head_object.assert_not_called()
+            self.assertEqual(boto3.get_object.call_args[1]['Range'], 'bytes=10-19')
+            with open(local_file_path, "rb") as result_file:
+                self.assertEqual(result_file.read(), data)
+            self.assertEqual(os.listdir(temp_dir), ['download_file'])
+        finally:
+            shutil.rmtree(temp_dir)
+
+    def test_download_parts_changed(self):
+        data = b'0123456789abcdefghij'
+        boto3 = MagicMock()
+        boto3.head_object.return_value = {
+            "ResponseMetadata": {
+                "HTTPHeaders": {
+                    "content-length": "20",
+                    "accept-ranges": "bytes",
+                    "etag": '"v1"'
+                }
+            }
+        }
+        boto3.get_object.side_effect = [{'Body': io.BytesIO(b'x' * 10)},
+                                        IOError("connection reset")]
+        s3r = S3Resumable(boto3, part_size_megabytes=1)
+        set_part_size(s3r, 10)
+        temp_dir = tempfile.mkdtemp()
+        try:
+            with self.assertRaises(IOError):
+                download_parts(s3r, "my_bucket", "my_key", "download_file", temp_dir)
+            boto3.head_object.return_value["ResponseMetadata"]["HTTPHeaders"]["etag"] = '"v2"'
+            boto3.get_object.side_effect = [
+                ClientError({'Error': {'Code': 'PreconditionFailed'}}, ''),
+                {'Body': io.BytesIO(data[:10])},
+                {'Body': io.BytesIO(data[10:])}]
+            local_file_path = download_parts(s3r, "my_bucket", "my_key", "download_file",
+                                                  temp_dir)
+            self.assertEqual(boto3.get_object.call_args[1]['IfMatch'], '"v2"')
+            with open(local_file_path, "rb") as result_file:
+                self.assertEqual(result_file.read(), data)
+        finally:
+            shutil.rmtree(temp_dir)
+
+    def test_download_prefix(self):
+        objects = {'logs/a.txt': b'a' * 25, 'logs/2020/b.txt': b'b' * 5, 'logs/empty': b''}
+        boto3 = MagicMock()
+        boto3.get_paginator.return_value.paginate.return_value = [
+            {'Contents': [{'Key': 'logs/', 'Size': 0},
+                          {'Key': 'logs/a.txt', 'Size': 25, 'ETag': '"a"'}]},
+            {'Contents': [{'Key': 'logs/2020/b.txt', 'Size': 5, 'ETag': '"b"'},
+                          {'Key': 'logs/empty', 'Size': 0, 'ETag': '"e"'}]}]
+
+        def get_object(Key, Range, **kwargs):
+            start, end = Range[len('bytes='):].split('-')
+            return {'Body': io.BytesIO(objects[Key][int(start):int(end) + 1])}
+
+        boto3.get_object.side_effect = get_object
+        s3r = S3Resumable(boto3, part_size_megabytes=1, max_concurrency=2)
+        set_part_size(s3r, 10)
+        download_dir = tempfile.mkdtemp()
+        try:
+            downloaded = s3r.download_prefix("my_bucket", "logs/", download_dir)
+            self.assertEqual(sorted(downloaded), sorted(objects))
+            self.assertEqual(downloaded['logs/2020/b.txt'],
+                             os.path.join(download_dir, '2020', 'b.txt'))
+            for key, local_file_path in downloaded.items():
+                with open(local_file_path, "rb") as result_file:
+                    self.assertEqual(result_file.read(), objects[key])
+            boto3.head_object.assert_not_called()
+            boto3.get_paginator.return_value.paginate.assert_called_once_with(
+                Bucket="my_bucket", Prefix="logs/")
+
+            boto3.get_paginator.return_value.paginate.return_value = [
+                {'Contents': [{'Key': 'logs/../../passwd', 'Size': 5, 'ETag': '"p"'}]}]
+            with self.assertRaises(S3ResumableDownloadError):
+                s3r.download_prefix("my_bucket", "logs/", download_dir)
+        finally:
+            shutil.rmtree(download_dir)
+
+    def test_download_prefix_sync(self):
+        objects = {'logs/a.txt': b'a' * 25, 'logs/b.txt': b'b' * 5}
+        listing = [{'Key': 'logs/a.txt', 'Size': 25, 'ETag': '"a"'},
+                    {'Key': 'logs/b.txt', 'Size': 5, 'ETag': '"b"'}]
+        boto3 = MagicMock()
+        boto3.get_paginator.return_value.paginate.return_value = [{'Contents': listing}]
+
+        def get_object(Key, Range, **kwargs):
+            start, end = Range[len('bytes='):].split('-')
+            return {'Body': io.BytesIO(objects[Key][int(start):int(end) + 1])}
+
+        boto3.get_object.side_effect = get_object
+        s3r = S3Resumable(boto3, part_size_megabytes=1)
+        download_dir = tempfile.mkdtemp()
+        try:
+            with SyncIndex(os.path.join(download_dir, 'index.db')) as index:
+                s3r.download_prefix("my_bucket", "logs/", download_dir, index=index)
+                self.assertEqual(boto3.get_object.call_count, 2)
+
+                # Unchanged keys are not requested
+                s3r.download_prefix("my_bucket", "logs/", download_dir, index=index)
+                self.assertEqual(boto3.get_object.call_count, 2)
+
+                # Changed keys are downloaded again over their files
+                objects['logs/b.txt'] = b'c' * 5
+                listing[1]['ETag'] = '"c"'
+                downloaded = s3r.download_prefix("my_bucket", "logs/", download_dir,
+                                                 index=index)
+                self.assertEqual(boto3.get_object.call_count, 3)
+                with open(downloaded['logs/b.txt'], "rb") as result_file:
+                    self.assertEqual(result_file.read(), b'c' * 5)
+                self.assertEqual(index.get("my_bucket", "logs/b.txt")['etag'], '"c"')
+        finally:
+            shutil.rmtree(download_dir)
+
+    def test_download_file_cache(self):
+        data = os.urandom(25)
+        boto3 = MagicMock()
+        boto3.head_object.return_value = {'ResponseMetadata': {'HTTPHeaders': {
+            'content-length': '25', 'accept-ranges': 'bytes', 'etag': '"a"'}}}
+
+        def get_object(Key, Range, **kwargs):
+            start, end = Range[len('bytes='):].split('-')
+            return {'Body': io.BytesIO(data[int(start):int(end) + 1])}
+
+        boto3.get_object.side_effect = get_object
+        temp_dir = tempfile.mkdtemp()
+        try:
+            s3r = S3Resumable(boto3, cache=os.path.join(temp_dir, 'cache'))
+            set_part_size(s3r, 10)
+            first = s3r.download_file('my_bucket', 'a.bin', os.path.join(temp_dir, 'first'))
+            self.assertEqual(boto3.head_object.call_count, 1)
+            self.assertEqual(boto3.get_object.call_count, 3)
+
+            # The same content under another key is materialized from the cache
+            second = s3r.download_file('my_bucket', 'b.bin', os.path.join(temp_dir, 'second'))
+            self.assertEqual(boto3.get_object.call_count, 3)
+            with open(second, "rb") as result_file:
+                self.assertEqual(result_file.read(), data)
+            self.assertEqual(os.stat(first).st_ino, os.stat(second).st_ino)
+        finally:
+            shutil.rmtree(temp_dir)
+
+    @patch('s3resumable.cooperative.LEASE_POLL_INTERVAL', 0.01)
+    def test_download_file_cooperative(self):
+        data = os.urandom(95)
+        boto3 = MagicMock()
+        boto3.head_object.return_value = {'ResponseMetadata': {'HTTPHeaders': {
+            'content-length': '95', 'accept-ranges': 'bytes', 'etag': '"a"'}}}
+
+        def get_object(Key, Range, **kwargs):
+            start, end = Range[len('bytes='):].split('-')
+            return {'Body': io.BytesIO(data[int(start):int(end) + 1])}
+
+        boto3.get_object.side_effect = get_object
+        temp_dir = tempfile.mkdtemp()
+        try:
+            workers = [S3Resumable(boto3, max_concurrency=2, cooperative=True)
+                       for _ in range(2)]
+            for worker in workers:
+                set_part_size(worker, 10)
+            # A dead worker left the lease of a part
+            lease_path = os.path.join(temp_dir, 'a.bin.part3.lease')
+            with open(lease_path, 'w') as lease_file:
+                lease_file.write('dead')
+            expired = time.time() - 120
+            os.utime(lease_path, (expired, expired))
+
+            threads = [threading.Thread(target=worker.download_file,
+                                        args=('my_bucket', 'a.bin', temp_dir))
+                       for worker in workers]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            with open(os.path.join(temp_dir, 'a.bin'), 'rb') as result_file:
+                self.assertEqual(result_file.read(), data)
+            self.assertEqual(boto3.get_object.call_count, 10)
+            # Leases and the lock of the download are removed with the parts
+            self.assertEqual(os.listdir(temp_dir), ['a.bin'])
+            self.assertRaises(ValueError, S3Resumable, None, cooperative=True,
+                              single_file=True)
+
+            # A part whose lease was taken over while downloading it is not renamed
+            os.remove(os.path.join(temp_dir, 'a.bin'))
+            held = PartLeases.held
+            taken_over = []
+
+            def lease_held(leases, part):
+                if part == 2 and not taken_over:
+                    taken_over.append(part)
+                    return False
+                return held(leases, part)
+
+            with patch.object(PartLeases, 'held', lease_held):
+                workers[0].download_file('my_bucket', 'a.bin', temp_dir)
+            with open(os.path.join(temp_dir, 'a.bin'), 'rb') as result_file:
+                self.assertEqual(result_file.read(), data)
+            self.assertEqual(boto3.get_object.call_count, 21)
+            self.assertEqual(os.listdir(temp_dir), ['a.bin'])
+
+            # Another worker assembled the file where download_dir is not shared, so
+            # the key is downloaded again
+            os.remove(os.path.join(temp_dir, 'a.bin'))
+            cooperate = cooperative._cooperate
+            assembled = []
+
+            def assembled_elsewhere(core, bucket, key, file_info, leases, part_path,
+                                    manifest_path):
+                if not assembled:
+                    assembled.append(key)
+                    remove_if_exists(manifest_path)
+                    return None
+                return cooperate(core, bucket, key, file_info, leases, part_path,
+                                 manifest_path)
+
+            with patch.object(cooperative, '_cooperate', assembled_elsewhere):
+                workers[0].download_file('my_bucket', 'a.bin', temp_dir)
+            with open(os.path.join(temp_dir, 'a.bin'), 'rb') as result_file:
+                self.assertEqual(result_file.read(), data)
+            self.assertEqual(boto3.get_object.call_count, 31)
+            self.assertEqual(os.listdir(temp_dir), ['a.bin'])
+
+            # Until the rounds run out
+            os.remove(os.path.join(temp_dir, 'a.bin'))
+            with patch.object(cooperative, '_cooperate', lambda *args: remove_if_exists(args[-1])):
+                self.assertRaises(S3ResumableDownloadError, workers[0].download_file,
+                                  'my_bucket', 'a.bin', temp_dir)
+        finally:
+            shutil.rmtree(temp_dir)
+
+    def test_join_parts_preallocate(self):
+        data = os.urandom(25)
+        temp_dir = tempfile.mkdtemp()
+        try:
+            local_file_path = os.path.join(temp_dir, 'a.bin')
+            file_info = {'total_parts': 3, 'content_length': 25,
+                         'part_path': local_file_path + '.part{part}'}
+            for available, reserved in ((None, False), (24, False), (25, True)):
+                for part in range(3):
+                    with open(file_info['part_path'].format(part=part), 'wb') as part_file:
+                        part_file.write(data[part * 10:part * 10 + 10])
+                with patch('s3resumable.layout.free_space', return_value=available), \
+                        patch('s3resumable.layout.preallocate_file') as mock_preallocate:
+                    join_parts('a.bin', local_file_path, file_info)
+                # The joined file is reserved at once only with room for it besides
+                # the parts
+                self.assertEqual(mock_preallocate.called, reserved)
+                if reserved:
+                    self.assertEqual(mock_preallocate.call_args[0][1], 25)
+                with open(local_file_path, 'rb') as result_file:
+                    self.assertEqual(result_file.read(), data)
+                self.assertEqual(os.listdir(temp_dir), ['a.bin'])
+
+            # Short parts are not hidden by the reserved size
+            with open(file_info['part_path'].format(part=0), 'wb') as part_file:
+                part_file.write(data[:10])
+            file_info['total_parts'] = 1
+            with self.assertRaises(S3ResumableDownloadError):
+                join_parts('a.bin', local_file_path, file_info)
+            self.assertEqual(os.listdir(temp_dir), [])
+        finally:
+            shutil.rmtree(temp_dir)
+
+    def test_download_file_no_space(self):
+        data = os.urandom(25)
+        boto3 = MagicMock()
+        boto3.head_object.return_value = {'ResponseMetadata': {'HTTPHeaders': {
+            'content-length': '25', 'accept-ranges': 'bytes', 'etag': '"a"'}}}
+
+        def get_object(Key, Range, **kwargs):
+            start, end = Range[len('bytes='):].split('-')
+            return {'Body': io.BytesIO(data[int(start):int(end) + 1])}
+
+        boto3.get_object.side_effect = get_object
+        temp_dir = tempfile.mkdtemp()
+        try:
+            # Part files need the object and its largest part, single files the object
+            for single_file, needed in ((False, 35), (True, 25)):
+                s3r = S3Resumable(boto3, single_file=single_file)
+                set_part_size(s3r, 10)
+                with patch('s3resumable.layout.free_space', return_value=needed - 1):
+                    self.assertRaises(S3ResumableNoSpace, s3r.download_file, 'my_bucket',
+                                      'a.bin', temp_dir)
+                self.assertEqual(boto3.get_object.call_count, 0)
+                self.assertFalse(os.path.exists(os.path.join(temp_dir, 'a.bin')))
+                with patch('s3resumable.layout.free_space', return_value=needed):
+                    local_file_path = s3r.download_file('my_bucket', 'a.bin', temp_dir)
+                with open(local_file_path, 'rb') as result_file:
+                    self.assertEqual(result_file.read(), data)
+                os.remove(local_file_path)
+                boto3.get_object.reset_mock()
+
+            # Parts recorded as complete by the manifest are not needed again, the
+            # bytes of a part file the manifest does not record are
+            local_file_path = os.path.join(temp_dir, 'a.bin')
+            manifest = ResumeManifest('{}.manifest'.format(local_file_path))
+            manifest.start('my_bucket', 'a.bin',
+                           {'etag': '"a"', 'content_length': 25, 'part_size': 10})
+            for part, part_data in enumerate((data[:10], data[10:20], data[20:23])):
+                with open('{}.part{}'.format(local_file_path, part), 'wb') as part_file:
+                    part_file.write(part_data)
+                if part < 2:
+                    manifest.add(part)
+            s3r = S3Resumable(boto3)
+            set_part_size(s3r, 10)
+            with patch('s3resumable.layout.free_space', return_value=14):
+                self.assertRaises(S3ResumableNoSpace, s3r.download_file, 'my_bucket',
+                                  'a.bin', temp_dir)
+            with patch('s3resumable.layout.free_space', return_value=15):
+                s3r.download_file('my_bucket', 'a.bin', temp_dir)
+            with open(local_file_path, 'rb') as result_file:
+                self.assertEqual(result_file.read(), data)
+            self.assertEqual(boto3.get_object.call_count, 1)
+        finally:
+            shutil.rmtree(temp_dir)
+
+    def objects_client(self, objects, failures=()):
+        """Client of objects whose get_object calls in failures raise."""
+        boto3 = MagicMock()
+        boto3.head_object.side_effect = lambda Bucket, Key, **kwargs: {
+            'ResponseMetadata': {'HTTPHeaders': {
+                'content-length': str(len(objects[Key])), 'accept-ranges': 'bytes',
+                'etag': '"a"'}}}
+
+        def get_object(Key, Range, **kwargs):
+            if boto3.get_object.call_count in failures:
+                raise IOError("connection reset")
+            start, end = Range[len('bytes='):].split('-')
+            return {'Body': io.BytesIO(objects[Key][int(start):int(end) + 1])}
+
+        boto3.get_object.side_effect = get_object
+        return boto3
+
+    @patch('s3resumable.extract.EXTRACT_CHECKPOINT_BYTES', 1000)
+    def test_decompress_file(self):
+        data = os.urandom(5000) * 2
+        compressed = io.BytesIO()
+        with gzip.GzipFile(fileobj=compressed, mode='wb') as gzip_file:
+            gzip_file.write(data)
+        boto3 = self.objects_client({'data.csv.gz': compressed.getvalue()}, failures=(4,))
+        temp_dir = tempfile.mkdtemp()
+        try:
+            s3r = S3Resumable(boto3, retry_policy=RetryPolicy(max_attempts=1))
+            set_part_size(s3r, 1000)
+            total_parts = (len(compressed.getvalue()) + 999) // 1000
+            self.assertRaises(IOError, s3r.decompress_file, 'my_bucket', 'data.csv.gz',
+                              temp_dir)
+            with open(checkpoint_path(temp_dir, 'my_bucket', 'data.csv.gz',
+                                      os.path.join(temp_dir, 'data.csv'))) as checkpoint_file:
+                self.assertIn('written', checkpoint_file.read())
+
+            # Resumed from the parts and the bytes already decompressed
+            local_file_path = s3r.decompress_file('my_bucket', 'data.csv.gz', temp_dir)
+            self.assertEqual(local_file_path, os.path.join(temp_dir, 'data.csv'))
+            with open(local_file_path, 'rb') as result_file:
+                self.assertEqual(result_file.read(), data)
+            self.assertEqual(boto3.get_object.call_count, total_parts + 1)
+            self.assertEqual(os.listdir(temp_dir), ['data.csv'])
+            self.assertRaises(ValueError, s3r.decompress_file, 'my_bucket', 'data.csv',
+                              temp_dir)
+        finally:
+            shutil.rmtree(temp_dir)
+
+    def test_extract_archive(self):
+        members = [('dir/a.bin', os.urandom(3000)), ('b.txt', b'hello')]
+        archive = io.BytesIO()
+        with tarfile.open(fileobj=archive, mode='w:gz') as tar_file:
+            for name, data in members:
+                member = tarfile.TarInfo(name)
+                member.size = len(data)
+                tar_file.addfile(member, io.BytesIO(data))
+        unsafe = io.BytesIO()
+        with tarfile.open(fileobj=unsafe, mode='w') as tar_file:
+            member = tarfile.TarInfo('../evil')
+            tar_file.addfile(member, io.BytesIO())
+        boto3 = self.objects_client({'bundle.tgz': archive.getvalue(),
+                                     'unsafe.tar': unsafe.getvalue()})
+        temp_dir = tempfile.mkdtemp()
+        try:
+            extract_dir = os.path.join(temp_dir, 'bundle')
+            s3r = S3Resumable(boto3)
+            set_part_size(s3r, 1000)
+            # A previous run extracted a member before it was interrupted
+            os.makedirs(os.path.join(extract_dir, 'dir'))
+            with open(os.path.join(extract_dir, 'dir', 'a.bin'), 'wb') as member_file:
+                member_file.write(b'x' * 3000)
+            with open(checkpoint_path(extract_dir, 'my_bucket', 'bundle.tgz', extract_dir),
+                      'w') as checkpoint:
+                checkpoint.write('{"etag": "\\"a\\"", "content_length": %d}\n'
+                                 '{"member": "dir/a.bin", "size": 3000}\n'
+                                 % len(archive.getvalue()))
+
+            extracted = s3r.extract_archive('my_bucket', 'bundle.tgz', extract_dir)
+            self.assertEqual(extracted, [os.path.join(os.path.realpath(extract_dir), name)
+                                         for name, _ in members])
+            with open(os.path.join(extract_dir, 'dir', 'a.bin'), 'rb') as member_file:
+                self.assertEqual(member_file.read(), b'x' * 3000)
+            with open(os.path.join(extract_dir, 'b.txt'), 'rb') as member_file:
+                self.assertEqual(member_file.read(), b'hello')
+            self.assertEqual(sorted(os.listdir(extract_dir)), ['b.txt', 'dir'])
+
+            self.assertRaises(S3ResumableExtractError, s3r.extract_archive, 'my_bucket',
+                              'unsafe.tar', extract_dir)
+            self.assertFalse(os.path.exists(os.path.join(temp_dir, 'evil')))
+        finally:
+            shutil.rmtree(temp_dir)
+
+    def test_download_file_metadata_cache(self):
+        data = os.urandom(20)
+        boto3 = MagicMock()
+        boto3.head_object.return_value = {'ResponseMetadata': {'HTTPHeaders': {
+            'content-length': '20', 'accept-ranges': 'bytes', 'etag': '"v2"'}}}
+        temp_dir = tempfile.mkdtemp()
+        try:
+            s3r = S3Resumable(boto3, metadata_cache=MetadataCache())
+            set_part_size(s3r, 10)
+
+            def get_object(Key, Range, IfMatch, **kwargs):
+                if IfMatch != '"v2"':
+                    raise ClientError({'Error': {'Code': 'PreconditionFailed'}}, '')
+                start, end = Range[len('bytes='):].split('-')
+                return {'Body': io.BytesIO(data[int(start):int(end) + 1])}
+
+            boto3.get_object.side_effect = get_object
+            s3r.download_file('my_bucket', 'a.bin', temp_dir)
+            s3r.download_file('my_bucket', 'a.bin', temp_dir, download_file='b.bin')
+            self.assertEqual(boto3.head_object.call_count, 1)
+
+            # A stale entry is detected by the first range request and requested again
+            s3r._core.options.metadata_cache.put('my_bucket', 'c.bin', {'content_length': 30,
+                                                           'etag': '"v1"'})
+            local_file_path = s3r.download_file('my_bucket', 'c.bin', temp_dir)
+            self.assertEqual(boto3.head_object.call_count, 2)
+            with open(local_file_path, 'rb') as result_file:
+                self.assertEqual(result_file.read(), data)
+            self.assertEqual(s3r._core.options.metadata_cache.get('my_bucket', 'c.bin')['etag'], '"v2"')
+        finally:
+            shutil.rmtree(temp_dir)
+
+    def test_download_file_coalesce(self):
+        data = os.urandom(95)
+        boto3 = MagicMock()
+        boto3.head_object.return_value = {'ResponseMetadata': {'HTTPHeaders': {
+            'content-length': '95', 'accept-ranges': 'bytes', 'etag': '"a"'}}}
+        requested = threading.Event()
+        resume = threading.Event()
+
+        def get_object(Key, Range, **kwargs):
+            requested.set()
+            resume.wait(5)
+            start, end = Range[len('bytes='):].split('-')
+            return {'Body': io.BytesIO(data[int(start):int(end) + 1])}
+
+        boto3.get_object.side_effect = get_object
+        temp_dir = tempfile.mkdtemp()
+        try:
+            results = []
+            workers = [S3Resumable(boto3, coalesce=True) for _ in range(2)]
+
+            def download(worker):
+                results.append(worker.download_file('my_bucket', 'a.bin', temp_dir))
+
+            threads = [threading.Thread(target=download, args=(worker,))
+                       for worker in workers]
+            threads[0].start()
+            self.assertTrue(requested.wait(5))
+            # The second request waits for the download in flight
+            threads[1].start()
+            time.sleep(0.1)
+            resume.set()
+            for thread in threads:
+                thread.join()
+            local_file_path = os.path.join(temp_dir, 'a.bin')
+            self.assertEqual(results, [local_file_path, local_file_path])
+            self.assertEqual(boto3.head_object.call_count, 1)
+            with open(local_file_path, 'rb') as result_file:
+                self.assertEqual(result_file.read(), data)
+
+            # Waiters give up after lock_timeout, the download in flight goes on
+            requested.clear()
+            resume.clear()
+            workers = [S3Resumable(boto3, coalesce=True, lock_timeout=0.1) for _ in range(2)]
+            threads = [threading.Thread(target=workers[0].download_file,
+                                        args=('my_bucket', 'b.bin', temp_dir))]
+            threads[0].start()
+            self.assertTrue(requested.wait(5))
+            with self.assertRaises(S3ResumableBloqued) as cm:
+                workers[1].download_file('my_bucket', 'b.bin', temp_dir)
+            self.assertIn('in flight', str(cm.exception))
+            resume.set()
+            threads[0].join()
+            with open(os.path.join(temp_dir, 'b.bin'), 'rb') as result_file:
+                self.assertEqual(result_file.read(), data)
+        finally:
+            shutil.rmtree(temp_dir)
+
+    def test_stream(self):
+        data = os.urandom(95)
+        boto3 = MagicMock()
+        boto3.head_object.return_value = {'ResponseMetadata': {'HTTPHeaders': {
+            'content-length': '95', 'accept-ranges': 'bytes', 'etag': '"a"'}}}
+
+        def get_object(Key, Range, **kwargs):
+            start, end = Range[len('bytes='):].split('-')
+            return {'Body': io.BytesIO(data[int(start):int(end) + 1])}
+
+        boto3.get_object.side_effect = get_object
+        temp_dir = tempfile.mkdtemp()
+        try:
+            for single_file in (False, True):
+                s3r = S3Resumable(boto3, max_concurrency=3, chunk_size_kilobytes=1,
+                                  single_file=single_file)
+                set_part_size(s3r, 10)
+                self.assertEqual(b"".join(s3r.stream('my_bucket', 'a.bin')), data)
+                self.assertRaises(ValueError, s3r.stream, 'my_bucket', 'a.bin', readahead=0)
+
+                # An interrupted stream keeps its parts in temp_dir
+                chunks = s3r.stream('my_bucket', 'a.bin', temp_dir=temp_dir, readahead=2)
+                self.assertEqual(next(chunks) + next(chunks), data[:20])
+                chunks.close()
+                self.assertIn('a.bin.manifest', os.listdir(temp_dir))
+                boto3.get_object.reset_mock()
+                with s3r.open_stream('my_bucket', 'a.bin', temp_dir=temp_dir) as stream:
+                    self.assertEqual(stream.read(15), data[:15])
+                    self.assertEqual(stream.read(), data[15:])
+                self.assertLessEqual(boto3.get_object.call_count, 8)
+                self.assertEqual(os.listdir(temp_dir), [])
+        finally:
+            shutil.rmtree(temp_dir)
+
+    def test_open(self):
+        data = os.urandom(95)
+        boto3 = self.objects_client({'a.bin': data})
+        s3r = S3Resumable(boto3, max_concurrency=2)
+        with s3r.open('my_bucket', 'a.bin', block_size=10, cache_size=20) as remote_file:
+            # Footers are read with a single small request
+            remote_file.seek(-5, io.SEEK_END)
+            self.assertEqual(remote_file.read(5), data[-5:])
+            self.assertEqual(boto3.get_object.call_args[1]['Range'], 'bytes=90-94')
+            self.assertEqual(boto3.get_object.call_args[1]['IfMatch'], '"a"')
+            self.assertEqual(remote_file.read_ranges([(0, 5), (12, 5), (60, 20)]),
+                             [data[0:5], data[12:17], data[60:80]])
+            self.assertEqual(boto3.get_object.call_count, 3)
+        self.assertRaises(ValueError, remote_file.read, 5)
+        self.assertRaises(ValueError, remote_file.readinto, bytearray(5))
+        self.assertRaises(ValueError, s3r.open, 'my_bucket', 'a.bin', block_size=0)
+
+        # Every request has the retries of an object
+        get_object = boto3.get_object.side_effect
+
+        def reset_odd_calls(**kwargs):
+            if boto3.get_object.call_count % 2:
+                raise BotocoreConnectionError(error="connection reset")
+            return get_object(**kwargs)
+
+        boto3.get_object.reset_mock()
+        boto3.get_object.side_effect = reset_odd_calls
+        s3r_retries = S3Resumable(boto3, retry_policy=RetryPolicy(
+            max_attempts=2, max_retries=1, base_delay=0, max_delay=0))
+        with s3r_retries.open('my_bucket', 'a.bin', block_size=10) as remote_file:
+            self.assertEqual(remote_file.read_ranges([(0, 5), (60, 5), (90, 5)]),
+                             [data[0:5], data[60:65], data[90:95]])
+        self.assertEqual(boto3.get_object.call_count, 6)
+        boto3.get_object.side_effect = get_object
+
+        # Blocks read from temp_dir are parts resumed by download_file
+        temp_dir = tempfile.mkdtemp()
+        try:
+            boto3.get_object.reset_mock()
+            set_part_size(s3r, 10)
+            with s3r.open('my_bucket', 'a.bin', temp_dir=temp_dir) as remote_file:
+                # Blocks are smaller than parts, not to read whole parts for a few bytes
+                self.assertEqual(remote_file.block_size, 1000 * 1000)
+            with s3r.open('my_bucket', 'a.bin', temp_dir=temp_dir,
+                          block_size=10) as remote_file:
+                remote_file.seek(25)
+                self.assertEqual(remote_file.read(30), data[25:55])
+            self.assertEqual(boto3.get_object.call_count, 4)
+            self.assertIn('a.bin.part3', os.listdir(temp_dir))
+            local_file_path = s3r.download_file('my_bucket', 'a.bin', temp_dir)
+            with open(local_file_path, 'rb') as result_file:
+                self.assertEqual(result_file.read(), data)
+            self.assertEqual(boto3.get_object.call_count, 10)
+        finally:
+            shutil.rmtree(temp_dir)
 
+    @patch('s3resumable.core.move_file')
     @patch('s3resumable.s3resumable.filelock')
     @patch('s3resumable.s3resumable.get_filelock_path')
-    @patch('s3resumable.s3resumable.create_directory_tree')
-    @patch('s3resumable.s3resumable.os')
-    def test_download_file(self, mock_os, mock_dt, mock_fp, mock_filelock):
+    @patch('s3resumable.core.create_directory_tree')
+    @patch('s3resumable.core.os')
+    def test_download_file(self, mock_os, mock_dt, mock_fp, mock_filelock, mock_move):
         s3r = S3Resumable(None)
         with self.assertRaises(ValueError):
             s3r.download_file(9, 1, 2)
             s3r.download_file("my_bucket", 1, 2)
             s3r.download_file("my_bucket", "my_key", 2)
-        s3r._download_parts = MagicMock()
+        s3r._core.download_parts = MagicMock()
         s3r.download_file("my_bucket", "my_key", "/tmp")
         mock_os.path.isfile.return_value = False
         s3r.download_file("my_bucket", "my_key", "/tmp")
+        mock_move.assert_called_once_with(s3r._core.download_parts.return_value,
+                                          mock_os.path.join.return_value)
 
 
 if __name__ == '__main__':
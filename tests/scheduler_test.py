@@ -0,0 +1,55 @@
+# -*- coding: utf-8 -*-
+# Copyright 2020 Immfly.com. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"). You
+# may not use this file except in compliance with the License. A copy of
+# the License is located at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# or in the "license" file accompanying this file. This file is
+# distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF
+# ANY KIND, either express or implied. See the License for the specific
+# language governing permissions and limitations under the License.
+from __future__ import absolute_import
+
+import threading
+import unittest
+
+from s3resumable.scheduler import PartScheduler
+
+
+class PartSchedulerTests(unittest.TestCase):
+    def test_map_parts(self):
+        with PartScheduler(3) as scheduler:
+            pending = scheduler.map_parts(lambda part: part * 2, range(5))
+            self.assertEqual([future.result() for future in pending], [0, 2, 4, 6, 8])
+            pending = scheduler.map_parts(lambda part: 1 // part, range(2))
+            with self.assertRaises(ZeroDivisionError):
+                pending[0].result()
+            self.assertEqual(pending[1].result(), 1)
+
+    def test_interleave_objects(self):
+        order = []
+        started = threading.Event()
+        release = threading.Event()
+
+        def block(part):
+            started.set()
+            release.wait()
+
+        with PartScheduler(1) as scheduler:
+            # Keep the only worker busy while both objects are queued
+            blocker = scheduler.map_parts(block, [0])
+            started.wait()
+            large = scheduler.map_parts(lambda part: order.append(("large", part)), range(4))
+            small = scheduler.map_parts(lambda part: order.append(("small", part)), range(1))
+            release.set()
+            for future in blocker + large + small:
+                future.result()
+        self.assertEqual(order, [("large", 0), ("large", 1), ("small", 0), ("large", 2),
+                                 ("large", 3)])
+
+
+if __name__ == '__main__':
+    unittest.main()
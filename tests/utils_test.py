@@ -15,11 +15,21 @@ from __future__ import absolute_import
 
 import unittest
 import errno
+import os
+import shutil
+import sys
+import tempfile
 from mock import patch
 from mock import MagicMock
 
+from s3resumable.utils import copy_fd
+from s3resumable.utils import copy_fileobj
 from s3resumable.utils import create_directory_tree
+from s3resumable.utils import free_space
 from s3resumable.utils import get_filelock_path
+from s3resumable.utils import link_file
+from s3resumable.utils import move_file
+from s3resumable.utils import remove_if_exists
 
 
 class UtilsTests(unittest.TestCase):
@@ -51,6 +61,119 @@ class UtilsTests(unittest.TestCase):
         self.assertNotEqual(filelock1, filelock3)
         self.assertNotEqual(filelock2, filelock3)
 
+    def test_free_space(self):
+        available = free_space(tempfile.gettempdir())
+        self.assertGreater(available, 0)
+        with patch('s3resumable.utils.os.statvfs', create=True) as mock_statvfs:
+            mock_statvfs.return_value.f_bavail = 3
+            mock_statvfs.return_value.f_frsize = 4096
+            self.assertEqual(free_space("/data"), 12288)
+
+    @patch('s3resumable.utils.os.remove')
+    def test_remove_if_exists(self, mock_remove):
+        remove_if_exists("/tmp/test")
+        mock_remove.assert_called_once_with("/tmp/test")
+        mock_remove.side_effect = OSError(errno.ENOENT, "test")
+        remove_if_exists("/tmp/test")
+        mock_remove.side_effect = OSError(errno.EACCES, "test")
+        with self.assertRaises(OSError):
+            remove_if_exists("/tmp/test")
+
+
+class FileCopyTests(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.data = os.urandom(100000)
+        self.src = os.path.join(self.temp_dir, "src")
+        self.dst = os.path.join(self.temp_dir, "dst")
+        with open(self.src, "wb") as src_file:
+            src_file.write(self.data)
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def read_dst(self):
+        with open(self.dst, "rb") as dst_file:
+            return dst_file.read()
+
+    def test_copy_fileobj(self):
+        with open(self.dst, "wb") as dst_file:
+            dst_file.write(b"head")
+            with open(self.src, "rb") as src_file:
+                self.assertEqual(copy_fileobj(src_file, dst_file), len(self.data))
+            with open(self.src, "rb") as src_file:
+                src_file.seek(10)
+                copy_fileobj(src_file, dst_file)
+        self.assertEqual(self.read_dst(), b"head" + self.data + self.data[10:])
+
+    @patch('s3resumable.utils.os.sendfile', create=True)
+    @patch('s3resumable.utils.os.copy_file_range', create=True)
+    def test_copy_fd_fallback(self, mock_copy_file_range, mock_sendfile):
+        mock_copy_file_range.side_effect = OSError(errno.EXDEV, "test")
+        mock_sendfile.side_effect = OSError(errno.EINVAL, "test")
+        src_fd = os.open(self.src, os.O_RDONLY)
+        dst_fd = os.open(self.dst, os.O_WRONLY | os.O_CREAT)
+        try:
+            self.assertEqual(copy_fd(src_fd, dst_fd, len(self.data) + 10), len(self.data))
+        finally:
+            os.close(src_fd)
+            os.close(dst_fd)
+        self.assertEqual(self.read_dst(), self.data)
+        mock_copy_file_range.side_effect = OSError(errno.EIO, "test")
+        with self.assertRaises(OSError):
+            copy_fd(0, 1, 10)
+
+    @unittest.skipUnless(hasattr(os, "sendfile") and sys.platform.startswith("linux"),
+                         "sendfile copies files on Linux")
+    @patch('s3resumable.utils.os.copy_file_range', create=True)
+    def test_copy_fd_sendfile(self, mock_copy_file_range):
+        mock_copy_file_range.side_effect = OSError(errno.ENOSYS, "test")
+        src_fd = os.open(self.src, os.O_RDONLY)
+        dst_fd = os.open(self.dst, os.O_WRONLY | os.O_CREAT)
+        try:
+            with patch('s3resumable.utils.os.read') as mock_read:
+                self.assertEqual(copy_fd(src_fd, dst_fd, len(self.data)), len(self.data))
+            mock_read.assert_not_called()
+        finally:
+            os.close(src_fd)
+            os.close(dst_fd)
+        self.assertEqual(self.read_dst(), self.data)
+
+    def test_move_file(self):
+        move_file(self.src, self.dst)
+        self.assertFalse(os.path.exists(self.src))
+        self.assertEqual(self.read_dst(), self.data)
+
+    def test_move_file_cross_device(self):
+        rename = os.rename
+
+        def fake_rename(src, dst):
+            if src == self.src:
+                raise OSError(errno.EXDEV, "test")
+            rename(src, dst)
+
+        with patch('s3resumable.utils.os.rename', side_effect=fake_rename):
+            move_file(self.src, self.dst)
+        self.assertFalse(os.path.exists(self.src))
+        self.assertEqual(os.listdir(self.temp_dir), ["dst"])
+        self.assertEqual(self.read_dst(), self.data)
+
+
+    def test_link_file(self):
+        link_file(self.src, self.dst)
+        self.assertEqual(os.stat(self.src).st_ino, os.stat(self.dst).st_ino)
+        os.remove(self.dst)
+
+        with patch('s3resumable.utils.os.link', side_effect=OSError(errno.EXDEV, "test")):
+            link_file(self.src, self.dst)
+        self.assertNotEqual(os.stat(self.src).st_ino, os.stat(self.dst).st_ino)
+        self.assertEqual(self.read_dst(), self.data)
+        self.assertEqual(sorted(os.listdir(self.temp_dir)), ["dst", "src"])
+
+        with self.assertRaises(OSError):
+            link_file(os.path.join(self.temp_dir, "missing"), self.dst)
+        self.assertEqual(self.read_dst(), self.data)
+
 
 if __name__ == '__main__':
     unittest.main()